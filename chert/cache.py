@@ -0,0 +1,135 @@
+"""
+Content-addressed, on-disk cache for rendered entry content.
+
+Keys are hex digests of everything that went into a render (source,
+config, templates, chert version), so invalidation is implicit: when
+an input changes, the key changes, and stale values age out via
+eviction.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from boltons.fileutils import mkdir_p
+
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+CACHE_FILE_EXT = '.json'
+
+
+def make_key(*parts):
+    "Returns a hex digest for any number of str/bytes *parts*."
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        hasher.update(b'%d:' % len(part))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+class RenderCache(object):
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE,
+                 max_age=DEFAULT_MAX_AGE, enabled=True):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def _get_key_path(self, key):
+        return os.path.join(self.path, key[:2], key + CACHE_FILE_EXT)
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        key_path = self._get_key_path(key)
+        try:
+            with open(key_path, 'rb') as f:
+                ret = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            self.miss_count += 1
+            return default
+        try:
+            os.utime(key_path)  # keeps eviction least-recently-used
+        except OSError:
+            pass
+        self.hit_count += 1
+        return ret
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        key_path = self._get_key_path(key)
+        key_dir = os.path.dirname(key_path)
+        mkdir_p(key_dir)
+        data = json.dumps(value, sort_keys=True).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, key_path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return
+
+    def _iter_entries(self):
+        if not os.path.isdir(self.path):
+            return
+        for dirpath, _, filenames in os.walk(self.path):
+            for fn in filenames:
+                if not fn.endswith(CACHE_FILE_EXT):
+                    continue
+                if os.path.basename(dirpath) != fn[:2]:
+                    continue  # not a cache entry, e.g., a manifest
+                cur_path = os.path.join(dirpath, fn)
+                try:
+                    stat = os.stat(cur_path)
+                except OSError:
+                    continue
+                yield cur_path, stat.st_size, stat.st_mtime
+
+    def evict(self, now=None):
+        """Removes cache files older than *max_age* seconds, then the
+        least-recently-used files until the cache is under *max_size*
+        bytes. Returns the number of files removed.
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        kept, total_size = [], 0
+        for cur_path, size, mtime in self._iter_entries():
+            if self.max_age is not None and (now - mtime) > self.max_age:
+                removed += _try_unlink(cur_path)
+                continue
+            kept.append((mtime, size, cur_path))
+            total_size += size
+        if self.max_size is not None and total_size > self.max_size:
+            kept.sort()
+            for mtime, size, cur_path in kept:
+                if total_size <= self.max_size:
+                    break
+                removed += _try_unlink(cur_path)
+                total_size -= size
+        return removed
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s path=%r enabled=%r hits=%r misses=%r>'
+                % (cn, self.path, self.enabled,
+                   self.hit_count, self.miss_count))
+
+
+def _try_unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        return 0
+    return 1
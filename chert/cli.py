@@ -46,23 +46,24 @@ def _cur_input_path_mw(next_):
     return next_(input_path=input_path)
 
 
-def serve(input_path):
+def serve(input_path, no_cache, workers):
     'work on a Chert site using the local server'
-    ch = Site(input_path, dev_mode=True)
+    ch = Site(input_path, dev_mode=True, use_cache=not no_cache,
+              workers=workers)
     ch.serve()
 
 
 @chlog.wrap('critical')
-def render(input_path):
+def render(input_path, no_cache, workers):
     'generate a local copy of the site'
-    ch = Site(input_path)
+    ch = Site(input_path, use_cache=not no_cache, workers=workers)
     ch.process()
 
 
 @chlog.wrap('critical', inject_as='_act')
-def publish(input_path, _act):
+def publish(input_path, no_cache, workers, _act):
     'upload a Chert site to the remote server'
-    ch = Site(input_path)
+    ch = Site(input_path, use_cache=not no_cache, workers=workers)
     ch.process()
     success = ch.publish()
     if success:
@@ -106,6 +107,12 @@ def main():
     cmd.add(clean)
     cmd.add(version)
 
+    cmd.add('--no-cache', parse_as=True,
+            doc='skip the render cache and rerender every entry')
+    cmd.add('--workers', parse_as=int, missing=None,
+            doc='number of processes for parsing and rendering entries'
+                ' (0 for one per CPU)')
+
     # cmd.add('--target-dir', doc='path to generate new chert site')
 
     cmd.add(_cur_input_path_mw)
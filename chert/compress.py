@@ -0,0 +1,181 @@
+"""
+Precompressed variants of text outputs, for web servers that can
+serve them directly (e.g., nginx's gzip_static), and for the dev
+server.
+
+gzip is always available. zstd and brotli variants are written when
+the zstandard and brotli modules are installed, respectively.
+"""
+import os
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DEFAULT_MIN_SIZE = 1024  # bytes, smaller files gain little
+DEFAULT_WORKERS = 4
+COMPRESSIBLE_EXTS = ('.html', '.xml', '.json', '.md', '.txt',
+                     '.css', '.js', '.svg')
+
+
+def _gzip_compress(data):
+    # no timestamp in the header, so unchanged input means unchanged output
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+def _brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+class Compressor(object):
+    def __init__(self, name, encoding, ext, compress):
+        self.name = name
+        self.encoding = encoding  # as in Accept-Encoding
+        self.ext = ext
+        self.compress = compress
+
+    def __repr__(self):
+        return '<%s name=%r ext=%r>' % (self.__class__.__name__, self.name, self.ext)
+
+
+# in order of preference when serving
+COMPRESSORS = [Compressor('brotli', 'br', '.br', _brotli_compress),
+               Compressor('zstd', 'zstd', '.zst', _zstd_compress),
+               Compressor('gzip', 'gzip', '.gz', _gzip_compress)]
+_AVAILABLE = {'gzip': True,
+              'zstd': zstandard is not None,
+              'brotli': brotli is not None}
+
+
+def get_compressors(names=None):
+    """Returns the available compressors among *names*, defaulting to
+    all of them. Raises ValueError on unknown names."""
+    known = [c.name for c in COMPRESSORS]
+    if names is None:
+        names = known
+    unknown = set(names) - set(known)
+    if unknown:
+        raise ValueError('expected compression formats from %r, not: %r'
+                         % (known, sorted(unknown)))
+    return [c for c in COMPRESSORS if c.name in names and _AVAILABLE[c.name]]
+
+
+def get_variant_paths(path):
+    return [path + c.ext for c in COMPRESSORS]
+
+
+def get_variant_source(path, compressors=COMPRESSORS):
+    """Returns the path *path* is a compressed variant of, if it has
+    the extension of one of *compressors*, otherwise None."""
+    for compressor in compressors:
+        if path.endswith(compressor.ext):
+            return path[:-len(compressor.ext)]
+    return None
+
+
+def iter_compressible_paths(root_path, exts=COMPRESSIBLE_EXTS):
+    # symlinked directories (i.e., uploads) are not followed
+    for cur_dir, _, filenames in os.walk(root_path):
+        for fn in filenames:
+            if os.path.splitext(fn)[1] in exts:
+                yield os.path.join(cur_dir, fn)
+
+
+def _is_current(src_stat, variant_path):
+    try:
+        return os.stat(variant_path).st_mtime_ns == src_stat.st_mtime_ns
+    except OSError:
+        return False
+
+
+def _compress_file(fal, path, compressors, min_size):
+    "Returns the (compressed, skipped, removed) counts for *path*."
+    src_stat = os.stat(path)
+    if src_stat.st_size < min_size:
+        # remove variants left over from when it was bigger
+        removed = 0
+        for variant_path in get_variant_paths(path):
+            if os.path.exists(variant_path):
+                os.unlink(variant_path)
+                removed += 1
+        return 0, 0, removed
+    data, compressed, skipped = None, 0, 0
+    for compressor in compressors:
+        variant_path = path + compressor.ext
+        # variants get their source's mtime, see below
+        if _is_current(src_stat, variant_path):
+            skipped += 1
+            continue
+        if data is None:
+            data = fal.read(path)
+        fal.write(variant_path, compressor.compress(data))
+        os.utime(variant_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        compressed += 1
+    return compressed, skipped, 0
+
+
+def compress_tree(fal, root_path, compressors, min_size=DEFAULT_MIN_SIZE,
+                  workers=DEFAULT_WORKERS):
+    """Writes a compressed variant of each text file under *root_path*
+    for each of *compressors*, next to the original (e.g.,
+    index.html.gz). Variants carry the mtime of their source, and are
+    only recompressed when that changes. Returns a dict of counts."""
+    paths = list(iter_compressible_paths(root_path))
+    # the compression functions release the GIL
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix='chert-compress') as executor:
+        results = list(executor.map(lambda p: _compress_file(fal, p, compressors,
+                                                             min_size),
+                                    paths))
+    compressed, skipped, removed = [sum(c) for c in zip((0, 0, 0), *results)]
+    return {'compressed_count': compressed,
+            'skipped_count': skipped,
+            'removed_count': removed}
+
+
+def parse_accept_encoding(header_value):
+    ret = set()
+    for part in (header_value or '').split(','):
+        coding, _, params = part.partition(';')
+        coding, params = coding.strip().lower(), params.replace(' ', '')
+        if not coding:
+            continue
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        ret.add(coding)
+    return ret
+
+
+def get_encoded_variant(path, accept_encoding, compressors=COMPRESSORS):
+    """Returns a (variant_path, encoding) pair for the best existing
+    variant of *path* acceptable under the *accept_encoding* header
+    value, or (None, None)."""
+    accepted = parse_accept_encoding(accept_encoding)
+    try:
+        src_stat = os.stat(path)
+    except OSError:
+        return None, None
+    for compressor in compressors:
+        if compressor.encoding not in accepted and '*' not in accepted:
+            continue
+        variant_path = path + compressor.ext
+        if _is_current(src_stat, variant_path):
+            return variant_path, compressor.encoding
+    return None, None
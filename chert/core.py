@@ -1,39 +1,69 @@
 import re
 import os
+import copy
+import html
+import hashlib
 import importlib.util
 import json
+import pickle
 import shutil
 import time
 import string
-import itertools
 import subprocess
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from os.path import abspath, join as pjoin
-from socketserver import ThreadingMixIn
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 
 from threading import Thread
-import shlex
 
 import yaml
+import markdown
 from markdown import Markdown
 from boltons.urlutils import URL
 from boltons.strutils import slugify, html2text
 from boltons.dictutils import OrderedMultiDict as OMD
 from boltons.timeutils import LocalTZ, UTC
-from boltons.fileutils import mkdir_p, copytree, iter_find_files
+from boltons.fileutils import mkdir_p, iter_find_files
 from boltons.debugutils import pdb_on_signal
 
-from ashes import AshesEnv, Template
+from ashes import AshesEnv
 from dateutil.parser import parse as parse_date
 from markdown.extensions.codehilite import CodeHiliteExtension
 
 from chert import hypertext
+from chert.cache import (RenderCache,
+                         make_key,
+                         DEFAULT_MAX_SIZE as DEFAULT_CACHE_MAX_SIZE,
+                         DEFAULT_MAX_AGE as DEFAULT_CACHE_MAX_AGE)
+from chert.deps import DependencyGraph
+from chert.publish import (PUBLISH_TARGETS,
+                           build_manifest,
+                           diff_manifests,
+                           is_valid_manifest)
+from chert.templates import TemplateCache
+from chert.index import EntryIndex, INDEX_FILENAME
+from chert.highlight import (HighlightCache,
+                             get_caching_extension,
+                             DEFAULT_MAX_ENTRIES as DEFAULT_HIGHLIGHT_MAX_ENTRIES)
 from chert.utils import dt_to_dict
+from chert.watch import iter_changed_files
 from chert import __version__
 from chert.log import chert_log as chlog
-from chert.fal import ChertFAL
-from chert.parsers import parse_entry
+from chert.fal import ChertFAL, WriterPool, DEFAULT_WRITE_WORKERS, get_file_hash
+from chert.compress import (compress_tree,
+                            get_compressors,
+                            get_variant_paths,
+                            get_variant_source,
+                            DEFAULT_MIN_SIZE as DEFAULT_COMPRESS_MIN_SIZE)
+from chert.devserver import (DevServer,
+                             MemoryOutputs,
+                             LiveReloadHub,
+                             LIVE_RELOAD_PATH)
+from chert.parsers import (parse_entry,
+                           parse_entry_parts,
+                           get_parts_parser,
+                           read_entry_headers,
+                           omd_load)  # omd_load for backwards compat
 
 DEBUG = False
 if DEBUG:
@@ -43,6 +73,11 @@ CUR_PATH = os.path.dirname(abspath(__file__))
 DEFAULT_DATE = datetime(2001, 2, 3, microsecond=456789, tzinfo=UTC)
 
 DEFAULT_CONFIG_FILENAME = 'chert.yaml'
+DEFAULT_CACHE_DIRNAME = '.chert_cache'
+HIGHLIGHT_CACHE_DIRNAME = 'highlight'
+TEMPLATE_CACHE_DIRNAME = 'templates'
+MANIFEST_FILENAME = 'manifest.json'
+PUBLISHED_DIRNAME = 'published'
 
 SITE_TITLE = 'Chert'
 SITE_HEAD_TITLE = SITE_TITLE  # goes in the head tag
@@ -76,12 +111,19 @@ MD_LAYOUT_PAT = '*' + MD_LAYOUT_EXT
 
 RSS_FEED_FILENAME = 'rss.xml'
 ATOM_FEED_FILENAME = 'atom.xml'
+DEFAULT_FEED_MAX_ENTRIES = 0  # 0 for all entries
+DEFAULT_FEED_CONTENT = 'full'
+FEED_CONTENT_MODES = ('full', 'summary', 'truncated')
+DEFAULT_FEED_TRUNCATE_LENGTH = 1000  # characters of text
+DEFAULT_ARCHIVE_PAGE_SIZE = 0  # 0 for a single page
 EXPORT_SRC_EXT = '.md'
 EXPORT_HTML_EXT = '.html'  # some people might prefer .htm
 
 DEV_SERVER_HOST = '127.0.0.1'
 DEV_SERVER_PORT = 8080
 DEV_SERVER_BASE_PATH = '/'  # TODO: merge with prod canonical_base_path?
+DEV_WATCH_INTERVAL = 0.5  # only used when polling
+DEV_WATCH_DEBOUNCE = 0.1
 
 _punct_re = re.compile('[%s]+' % re.escape(string.punctuation))
 _analytics_re = re.compile(r"(?P<code>[\w-]+)")
@@ -254,12 +296,17 @@ class DataPart(Part):
 
 
 class Entry(object):
+    """An entry created without *parts* but with a *source_path* is
+    lazy: its body is read and parsed on first access of
+    :attr:`parts`, :attr:`loaded_parts`, or :attr:`source_text`.
+    """
     def __init__(self, headers=None, parts=None, **kwargs):
         self.headers = headers or {}
         self.headers.update(kwargs)
-        self.parts = parts
+        self._parts = parts
+        self._loaded_parts = None
 
-        self.source_text = kwargs.pop('source_text', None)
+        self._source_text = kwargs.pop('source_text', None)
         self.source_path = kwargs.pop('source_path', None)
 
         pub_date = self.headers.get('publish_date')
@@ -277,8 +324,41 @@ class Entry(object):
         self.last_edit_date = []
 
         self.summary = self.headers.get('summary')
+        self._dict_cache = {}
         self._load_mappings()
-        self._load_parts()
+        if parts is not None:
+            self._load_parts()
+
+    @property
+    def parts(self):
+        if self._parts is None:
+            self._load_body()
+        return self._parts
+
+    @parts.setter
+    def parts(self, parts):
+        self._parts = parts
+        self._loaded_parts = None
+
+    @property
+    def loaded_parts(self):
+        if self._loaded_parts is None:
+            self._load_parts()
+        return self._loaded_parts
+
+    @property
+    def source_text(self):
+        if self._source_text is None and self._parts is None:
+            self._load_body()
+        return self._source_text
+
+    @source_text.setter
+    def source_text(self, source_text):
+        self._source_text = source_text
+
+    @property
+    def is_body_loaded(self):
+        return self._parts is not None
 
     @property
     def title(self):
@@ -334,10 +414,29 @@ class Entry(object):
         return ret
 
     @classmethod
-    def from_path(cls, in_path):
+    def from_path(cls, in_path, headers_only=False, headers=None):
+        """With *headers_only*, only the entry's headers are read (or
+        taken from *headers*, e.g., from the entry index), and the body
+        is left for first access, unless the entry has a custom
+        entry_type, whose parser may modify the headers."""
+        if headers_only:
+            if headers is None:
+                headers = read_entry_headers(in_path)
+            if get_parts_parser(headers) is parse_entry_parts:
+                return cls.from_dict({'headers': headers}, source_path=in_path)
         bytestring = ChertFAL(chlog).read(in_path)
         ret = cls.from_string(bytestring,
                               source_path=in_path)
+        ret.source_text = bytestring
+        return ret
+
+    @classmethod
+    def from_parsed(cls, headers, parts, source_text=None, **kwargs):
+        """Creates an Entry from the results of
+        :func:`chert.parsers.parse_entry`, e.g., as returned from a
+        worker process."""
+        ret = cls.from_dict({'headers': headers, 'parts': parts}, **kwargs)
+        ret.source_text = source_text
         return ret
 
     def get_word_count(self):
@@ -363,6 +462,15 @@ class Entry(object):
         frm, ftm, flm
         # TODO: etc.
 
+    def _load_body(self):
+        if self.source_path is None:
+            raise ValueError('expected parts or a source_path to load them from')
+        bytestring = ChertFAL(chlog).read(self.source_path)
+        # headers were already loaded, see from_path()
+        _, parts = parse_entry(bytestring, source_path=self.source_path)
+        self._source_text = bytestring
+        self._parts = parts
+
     def _load_parts(self):
         """Loads each part to a standardized dictionary format suitable for
         rendering.
@@ -371,7 +479,7 @@ class Entry(object):
         di and pi always increase. dci resets at every text element.
         text parts have no data indices (di and dci).
         """
-        self.loaded_parts = lps = []
+        self._loaded_parts = lps = []
 
         di, dci = 1, 1
         for pi, part in enumerate(self.parts, start=1):
@@ -401,13 +509,23 @@ class Entry(object):
 
     def __repr__(self):
         cn = self.__class__.__name__
-        try:
-            part_count = ' parts=%s' % len(self.parts)
-        except:
-            part_count = ''
+        part_count = ''
+        if self._parts is not None:  # lazy entries aren't loaded by repr
+            part_count = ' parts=%s' % len(self._parts)
         return '<%s title=%r%s>' % (cn, self.title, part_count)
 
+    def clear_dict_cache(self):
+        self._dict_cache = {}
+
     def to_dict(self, with_links=False):
+        """Returns the entry's template context. Contexts are memoized,
+        as each entry appears in several lists and as a neighbor of
+        other entries, so the Site clears them with
+        :meth:`clear_dict_cache` whenever rendering changes entries."""
+        try:
+            return self._dict_cache[with_links]
+        except KeyError:
+            pass
         ret = dict(headers=self.headers,
                    parts=self.parts,
                    entry_root=self.entry_root,
@@ -432,6 +550,33 @@ class Entry(object):
         else:
             ret['update_timestamp_local'] = None
             ret['update_timestamp_utc'] = None
+        self._dict_cache[with_links] = ret
+        return ret
+
+    def get_feed_dict(self, content=DEFAULT_FEED_CONTENT,
+                      truncate_length=DEFAULT_FEED_TRUNCATE_LENGTH):
+        """Returns the entry's context for feeds, where content_ihtml
+        is either the full content, the summary, or the content's text
+        truncated to *truncate_length* characters. Memoized like
+        :meth:`to_dict`."""
+        if content == 'full':
+            return self.to_dict(with_links=True)
+        key = ('feed', content, truncate_length)
+        try:
+            return self._dict_cache[key]
+        except KeyError:
+            pass
+        if content == 'summary':
+            text = self.summary or ''
+        elif content == 'truncated':
+            text = _truncate_text(html2text(getattr(self, 'content_html', None) or ''),
+                                  truncate_length)
+        else:
+            raise ValueError('expected feed content mode in %r, not: %r'
+                             % (FEED_CONTENT_MODES, content))
+        ret = dict(self.to_dict(with_links=True))
+        ret['content_ihtml'] = '<p>%s</p>' % html.escape(text)
+        self._dict_cache[key] = ret
         return ret
 
     def _autosummarize(self):
@@ -476,14 +621,50 @@ class EntryList(object):
         ret['canonical_atom_feed_url'] = canonical_atom_feed_url
         return ret
 
+    def get_pages(self, page_size):
+        """Splits the entries, newest first, into pages of *page_size*
+        entries. Pages are numbered from the oldest, so that a numbered
+        page keeps the same entries as new ones are added. Returns a
+        list of (page_number, entries) pairs, newest first. Only the
+        newest page, which is served at the list's index URL, may be
+        partial."""
+        entries = self.entries
+        if not page_size or len(entries) <= page_size:
+            return [(1, entries)]
+        count = len(entries)
+        page_count = (count + page_size - 1) // page_size
+        ret = [(page_count, entries[:count - (page_count - 1) * page_size])]
+        for page_number in range(page_count - 1, 0, -1):
+            end = count - (page_number - 1) * page_size
+            ret.append((page_number, entries[end - page_size:end]))
+        return ret
+
+    def get_page_filename(self, page_number, page_count):
+        "Returns the page's output path, relative to the site root."
+        if page_number == page_count:
+            if self.tag:
+                return self.path_part + 'index.html'
+            return 'archive' + EXPORT_HTML_EXT
+        if self.tag:
+            return self.path_part + '%s%s' % (page_number, EXPORT_HTML_EXT)
+        return 'archive/%s%s' % (page_number, EXPORT_HTML_EXT)
+
     def render(self, site_obj):
         # TODO: with a more complex API this could be made stateless
         # and return the feed, making the site object track rendered
         # feeds
-        site_info = site_obj.get_site_info()
+        site_info = site_obj.get_render_site_info()
         list_info = self.get_list_info(site_info)
-        entry_ctxs = [e.to_dict(with_links=True) for e in self.entries]
-        feed_render_ctx = {'entries': entry_ctxs,
+
+        max_entries = site_obj.get_list_config(self, 'feed', 'max_entries',
+                                               DEFAULT_FEED_MAX_ENTRIES)
+        content = site_obj.get_list_config(self, 'feed', 'content',
+                                           DEFAULT_FEED_CONTENT)
+        truncate_length = site_obj.get_list_config(self, 'feed', 'truncate_length',
+                                                   DEFAULT_FEED_TRUNCATE_LENGTH)
+        feed_entries = self.entries[:max_entries] if max_entries else self.entries
+        feed_render_ctx = {'entries': [e.get_feed_dict(content, truncate_length)
+                                       for e in feed_entries],
                            'site': site_info,
                            'list': list_info}
         self.rendered_rss_feed = site_obj.rss_template.render(feed_render_ctx)
@@ -491,8 +672,31 @@ class EntryList(object):
 
         tag_archive_layout = site_obj.get_config('site', 'tag_archive_layout', 'brief')
         tag_archive_layout = 'archive_' + tag_archive_layout + HTML_LAYOUT_EXT
-        self.rendered_html = site_obj.html_renderer.render(tag_archive_layout,
-                                                           feed_render_ctx)
+        page_size = site_obj.get_list_config(self, 'archive', 'page_size',
+                                             DEFAULT_ARCHIVE_PAGE_SIZE)
+        pages = self.get_pages(page_size)
+        page_count = len(pages)
+        base_path = site_info['canonical_base_path']
+        self.rendered_pages = []  # (filename, html) pairs, newest first
+        for page_number, page_entries in pages:
+            page_info = dict(list_info, page_number=page_number,
+                             page_count=page_count,
+                             newer_page_url=None, older_page_url=None)
+            if page_number < page_count:
+                page_info['newer_page_url'] = base_path + self.get_page_filename(
+                    page_number + 1, page_count)
+            if page_number > 1:
+                page_info['older_page_url'] = base_path + self.get_page_filename(
+                    page_number - 1, page_count)
+            page_render_ctx = {'entries': [e.to_dict(with_links=True)
+                                           for e in page_entries],
+                               'site': site_info,
+                               'list': page_info}
+            page_html = site_obj.html_renderer.render(tag_archive_layout,
+                                                      page_render_ctx)
+            self.rendered_pages.append((self.get_page_filename(page_number, page_count),
+                                        page_html))
+        self.rendered_html = self.rendered_pages[0][1]
 
     def append(self, entry):
         return self.entries.append(entry)
@@ -547,9 +751,28 @@ class Site(object):
                  required=False)
         set_path('output_path', kw.pop('output_path', None), 'site',
                  required=False)
+        set_path('cache_path', kw.pop('cache_path', None),
+                 DEFAULT_CACHE_DIRNAME, required=False)
+        self.use_cache = kw.pop('use_cache', True)
+        self.workers = kw.pop('workers', None)
+        self.lazy_entries = kw.pop('lazy_entries', None)
+        self.custom_mod = None
         self.reload_config()
+        # outlives reset(), so highlighting is shared across rebuilds
+        self.highlight_cache = HighlightCache(
+            max_entries=self.get_config('cache', 'highlight_max_entries',
+                                        DEFAULT_HIGHLIGHT_MAX_ENTRIES))
+        # likewise compiled templates, which are also kept on disk
+        self.template_cache = TemplateCache(disk_cache=RenderCache(
+            pjoin(self.cache_path, TEMPLATE_CACHE_DIRNAME),
+            max_size=None, max_age=None,
+            enabled=self.use_cache and self.get_config('cache', 'enabled', True)))
         self.reset()
         self.dev_mode = kw.pop('dev_mode', False)
+        # set by serve(), see chert.devserver
+        self.memory_outputs = None
+        # opened on load, see chert.index
+        self.entry_index = None
         if kw:
             raise TypeError('unexpected keyword arguments: %r' % kw)
         chlog.debug('init site').success()
@@ -574,9 +797,14 @@ class Site(object):
         self._rebuild_tag_map()
 
         self.last_load = None
-
-        self.md_converter = Markdown(extensions=MD_EXTENSIONS)
-        self.inline_md_converter = Markdown(extensions=INLINE_MD_EXTENSIONS)
+        self._site_info = None
+        self.template_cache.reset_stats()
+
+        hilite_cache = self.highlight_cache
+        self.md_converter = Markdown(extensions=BASE_MD_EXTENSIONS + [
+            get_caching_extension(_HILITE, hilite_cache)])
+        self.inline_md_converter = Markdown(extensions=BASE_MD_EXTENSIONS + [
+            get_caching_extension(_HILITE_INLINE, hilite_cache)])
         self._load_feed_templates()
         return
 
@@ -609,12 +837,13 @@ class Site(object):
         return
 
     def _load_feed_templates(self):
+        template_cache = self.template_cache
         default_atom_tmpl_path = pjoin(CUR_PATH, ATOM_FEED_FILENAME)
         atom_tmpl_path = pjoin(self.theme_path, ATOM_FEED_FILENAME)
         if not os.path.exists(atom_tmpl_path):
             atom_tmpl_path = default_atom_tmpl_path
         # TODO: defer opening to loading?
-        self.atom_template = Template.from_path(atom_tmpl_path,
+        self.atom_template = template_cache.load(atom_tmpl_path,
                                                 name=ATOM_FEED_FILENAME)
 
         default_rss_tmpl_path = pjoin(CUR_PATH, RSS_FEED_FILENAME)
@@ -622,8 +851,8 @@ class Site(object):
         if not os.path.exists(rss_tmpl_path):
             rss_tmpl_path = default_rss_tmpl_path
         # TODO: defer opening to loading?
-        self.rss_template = Template.from_path(rss_tmpl_path,
-                                               name=RSS_FEED_FILENAME)
+        self.rss_template = template_cache.load(rss_tmpl_path,
+                                                name=RSS_FEED_FILENAME)
 
     def get_config(self, section, key=None, default=_UNSET):
         try:
@@ -641,10 +870,38 @@ class Site(object):
                 raise
             return default
 
+    def get_list_config(self, entry_list, section, key, default=_UNSET):
+        """Returns *key* from the config *section*. For tag lists, an
+        override under the section's tags mapping takes precedence,
+        e.g., feed.tags.python.max_entries."""
+        if entry_list.tag:
+            tag_overrides = self.get_config(section, 'tags', None) or {}
+            try:
+                return tag_overrides[entry_list.tag][key]
+            except (KeyError, TypeError):
+                pass
+        return self.get_config(section, key, default)
+
+    def get_render_site_info(self):
+        """Returns the site info for the current build, computed once
+        per build, or if not rendering, fresh from the config."""
+        if self._site_info is None:
+            return self.get_site_info()
+        return self._site_info
+
     def get_site_info(self):
         ret = {}
         ret['dev_mode'] = self.dev_mode
-        refresh_secs = self.get_config('dev', 'autorefresh', DEFAULT_AUTOREFRESH) or False
+        live_reload = self.dev_mode and self.get_config('dev', 'live_reload', True)
+        if live_reload:
+            # pages reload when notified, no need to poll
+            refresh_secs = self.get_config('dev', 'autorefresh', 0) or False
+            base_path = self.get_config('dev', 'base_path', DEV_SERVER_BASE_PATH)
+            ret['dev_mode_live_reload_url'] = (base_path.rstrip('/') + '/'
+                                               + LIVE_RELOAD_PATH)
+        else:
+            refresh_secs = self.get_config('dev', 'autorefresh', DEFAULT_AUTOREFRESH) or False
+            ret['dev_mode_live_reload_url'] = False
 
         ret['dev_mode_refresh_seconds'] = refresh_secs
         site_config = self.get_config('site')
@@ -730,6 +987,10 @@ class Site(object):
     def output_path(self):
         return self.paths['output_path']
 
+    @property
+    def cache_path(self):
+        return self.paths['cache_path']
+
     @property
     def all_entries(self):
         return (self.special_entries.entries
@@ -776,41 +1037,242 @@ class Site(object):
             hook_func(self)
         return
 
+    def _load_custom_html_transforms(self):
+        get_transforms = getattr(self.custom_mod, 'chert_html_transforms', None)
+        if get_transforms is None:
+            return []
+        with chlog.debug('load custom html transforms') as rec:
+            ret = list(get_transforms(self) or [])
+            rec['transform_count'] = len(ret)
+        return ret
+
     @chlog.wrap('critical', 'load site')
     def load(self):
         self.last_load = time.time()
         self._load_custom_mod()
         self._call_custom_hook('pre_load')
-        self.html_renderer = AshesEnv(paths=[self.theme_path])
-        self.html_renderer.load_all()
-        self.md_renderer = AshesEnv(paths=[self.theme_path],
-                                    exts=['md'],
-                                    keep_whitespace=False)
-        self.md_renderer.autoescape_filter = ''
-        self.md_renderer.load_all()
+        self._load_renderers()
+
+        self._entry_map = {}
+        entry_paths = self._find_entry_paths()
+        entry_index = self._load_entry_index()
+        lazy = self.use_lazy_entries()
+        indexed_headers = {}
+        if lazy:
+            # unchanged entries' headers come from the index, and
+            # bodies are parsed on first access, e.g., when rendering
+            indexed_headers = self._get_indexed_headers(entry_paths)
+        parse_paths = [ep for ep in entry_paths if ep not in indexed_headers]
+        file_infos = self._get_entry_file_infos(parse_paths, with_hash=lazy)
+        if lazy:
+            parse_results = [None] * len(parse_paths)
+        else:
+            parse_results = self._parse_entry_paths(parse_paths)
+        for ep, parsed in zip(parse_paths, parse_results):
+            entry = self._load_entry(ep, parsed)
+            if entry is not None:
+                self._entry_map[ep] = entry
+        self._update_entry_index([self._entry_map[ep] for ep in parse_paths
+                                  if ep in self._entry_map],
+                                 [ep for ep in entry_index.get_source_paths()
+                                  if ep not in self._entry_map
+                                  and ep not in indexed_headers],
+                                 file_infos)
+        for ep, headers in indexed_headers.items():
+            entry = self._load_entry(ep, headers=headers)
+            if entry is not None:
+                self._entry_map[ep] = entry
+        self._organize_entries()
 
+        self._call_custom_hook('post_load')
+        self.dep_graph = self._build_dep_graph()
+
+    def _load_renderers(self):
+        # compiled templates are cached, see chert.templates
+        template_cache = self.template_cache
+        with chlog.info('load templates') as rec:
+            self.html_renderer = AshesEnv(paths=[self.theme_path])
+            template_cache.load_all(self.html_renderer)
+            self.md_renderer = AshesEnv(paths=[self.theme_path],
+                                        exts=['md'],
+                                        keep_whitespace=False)
+            self.md_renderer.autoescape_filter = ''
+            template_cache.load_all(self.md_renderer)
+            rec['hit_count'] = template_cache.hit_count
+            rec['disk_hit_count'] = template_cache.disk_hit_count
+            rec['compile_count'] = template_cache.compile_count
+            rec['compile_ms'] = round(template_cache.compile_time * 1000, 2)
+            # including feed templates, loaded on reset()
+            rec['template_count'] = (rec['hit_count'] + rec['disk_hit_count']
+                                     + rec['compile_count'])
+            rec.success('loaded {template_count} templates: {hit_count} from memory,'
+                        ' {disk_hit_count} from disk, compiled {compile_count}'
+                        ' in {compile_ms}ms')
+
+    def _find_entry_paths(self):
         entries_path = self.paths['entries_path']
         entry_paths = []
         for entry_path in iter_find_files(entries_path, ENTRY_PATS):
             entry_paths.append(entry_path)
         entry_paths.sort()
+        return entry_paths
+
+    def get_workers(self):
+        """Number of processes used to parse and render entries. Set
+        with the *workers* argument or the build.workers config, 0 for
+        one per CPU. Defaults to 1, working in the current process."""
+        workers = self.workers
+        if workers is None:
+            workers = self.get_config('build', 'workers', 1)
+        if not workers:
+            workers = os.cpu_count() or 1
+        return int(workers)
+
+    def use_lazy_entries(self):
+        """Whether only the headers of entries are parsed on load. Set
+        with the *lazy_entries* argument or the build.lazy_entries
+        config. Defaults to False."""
+        lazy_entries = self.lazy_entries
+        if lazy_entries is None:
+            lazy_entries = self.get_config('build', 'lazy_entries', False)
+        return bool(lazy_entries)
+
+    def _load_entry_index(self):
+        """Opens the entry index, kept in the cache directory when
+        caching is enabled, and otherwise in memory, so that custom
+        hooks can always query it. See :class:`chert.index.EntryIndex`."""
+        if self.entry_index is not None:
+            return self.entry_index
+        index_path = ':memory:'
+        if (self.use_cache and self.get_config('cache', 'enabled', True)
+                and self.get_config('cache', 'entry_index', True)):
+            index_path = pjoin(self.cache_path, INDEX_FILENAME)
+        with chlog.debug('open entry index {index_path}',
+                         index_path=index_path) as rec:
+            self.entry_index = EntryIndex(index_path)
+            rec['entry_count'] = len(self.entry_index)
+            rec['rebuilt'] = self.entry_index.rebuilt
+        return self.entry_index
+
+    def _get_indexed_headers(self, entry_paths):
+        "Returns a map of the current indexed headers of *entry_paths*."
+        ret = {}
+        entry_index = self.entry_index
+        with chlog.info('load indexed entries', reraise=False) as rec:
+            for ep in entry_paths:
+                headers = entry_index.get_headers(ep)
+                if headers is not None:
+                    ret[ep] = headers
+            rec.success('loaded {indexed_count} of {entry_count} entries'
+                        ' from the index', indexed_count=len(ret),
+                        entry_count=len(entry_paths))
+        return ret
 
+    def _get_entry_file_infos(self, entry_paths, with_hash=False):
+        """Returns a map of each of *entry_paths* to its (stat,
+        content_hash), the hash being None unless *with_hash*. Taken
+        before parsing, so that edits made during parsing make the
+        index record stale, rather than current with old headers."""
+        ret = {}
         for ep in entry_paths:
-            with chlog.info('entry load') as rec:
-                try:
-                    entry = self._entry_type.from_path(ep)
-                    rec['entry_title'] = entry.title
-                    rec['entry_length'] = round(entry.get_reading_time(), 1)
-                except IOError:
-                    rec.exception('unopenable entry path: {}', ep)
-                    continue
-                except Exception:
-                    rec['entry_path'] = ep
-                    rec.exception('entry {entry_path} load error: {exc_message}')
-                    continue
+            try:
+                ret[ep] = (os.stat(ep), get_file_hash(ep) if with_hash else None)
+            except OSError:
+                pass  # logged on load
+        return ret
+
+    def _update_entry_index(self, entries, stale_paths=(), file_infos=None):
+        """Indexes each of *entries* whose record is out of date, and
+        drops the records for *stale_paths*, e.g., of removed entries.
+        *file_infos* are as returned by :meth:`_get_entry_file_infos`,
+        for entries without one, nothing is indexed. Index errors are
+        logged, but don't stop the build."""
+        entry_index = self.entry_index
+        file_infos = file_infos or {}
+        with chlog.info('update entry index', reraise=False) as rec:
+            added_count = 0
+            for entry in entries:
+                with chlog.debug('index entry {entry_path}',
+                                 entry_path=entry.source_path,
+                                 reraise=False) as entry_rec:
+                    try:
+                        stat, content_hash = file_infos[entry.source_path]
+                    except KeyError:
+                        entry_rec.failure('entry file not stat-ed before load')
+                        continue
+                    if content_hash is None:
+                        # bytes parsed after the stat, see above
+                        content_hash = hashlib.sha256(entry.source_text).hexdigest()
+                    if entry_index.is_current(entry.source_path, stat, content_hash):
+                        entry_rec.success('entry already indexed')
+                        continue
+                    # raises TypeError on unindexable headers
+                    entry_index.add(entry, stat, content_hash)
+                    added_count += 1
+            for ep in stale_paths:
+                entry_index.remove(ep)
+            rec.success('indexed {added_count} entries, removed {removed_count}',
+                        added_count=added_count, removed_count=len(stale_paths))
+        return
+
+    def _parse_entry_paths(self, entry_paths):
+        """Returns a list of parse results, in the same order as
+        *entry_paths*, or a list of Nones if parsing is to be done
+        serially by :meth:`_load_entry`."""
+        workers = min(self.get_workers(), len(entry_paths))
+        if workers < 2:
+            return [None] * len(entry_paths)
+        chunksize = max(1, len(entry_paths) // (workers * 4))
+        with chlog.info('parse entries', worker_count=workers) as rec:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # by type, so that overrides of from_path() are honored
+                ret = list(pool.map(_parse_entry_path,
+                                    [self._entry_type] * len(entry_paths),
+                                    entry_paths, chunksize=chunksize))
+            rec.success('parsed {entry_count} entries with {worker_count} workers',
+                        entry_count=len(ret))
+        return ret
+
+    def _load_entry(self, ep, parsed=None, headers=None):
+        """Returns the loaded Entry at path *ep*, or None on error. If
+        *parsed* is passed, it's the result of :func:`_parse_entry_path`,
+        used instead of reading and parsing the entry here.
+        With lazy entries, *headers* may be passed to skip reading them,
+        see :meth:`Entry.from_path`."""
+        with chlog.info('entry load') as rec:
+            try:
+                if parsed is None:
+                    entry = self._entry_type.from_path(
+                        ep, headers_only=self.use_lazy_entries(), headers=headers)
+                elif isinstance(parsed, Exception):
+                    raise parsed
+                else:
+                    entry = parsed
+                rec['entry_title'] = entry.title
+                if entry.is_body_loaded:
+                    rec['entry_length'] = '%sm' % round(entry.get_reading_time(), 1)
                 else:
-                    rec.success('entry loaded:'
-                                ' {entry_title} ({entry_length}m)')
+                    rec['entry_length'] = 'headers only'
+            except IOError:
+                rec.exception('unopenable entry path: {}', ep)
+                return None
+            except Exception:
+                rec['entry_path'] = ep
+                rec.exception('entry {entry_path} load error: {exc_message}')
+                return None
+            else:
+                rec.success('entry loaded:'
+                            ' {entry_title} ({entry_length})')
+        return entry
+
+    def _organize_entries(self):
+        """(Re)builds the published, draft, and special EntryLists, the
+        tag map, and the prev/next links from the loaded entries."""
+        self.entries.clear()
+        self.draft_entries.clear()
+        self.special_entries.clear()
+        for ep in sorted(self._entry_map):
+            entry = self._entry_map[ep]
             if entry.is_draft:
                 self.draft_entries.append(entry)
             elif entry.is_special:
@@ -830,8 +1292,7 @@ class Site(object):
             start_next = max(0, i - NEXT_ENTRY_COUNT)
             entry.next_entries = self.entries[start_next:i - 1][::-1]
             entry.prev_entries = self.entries[i:i + PREV_ENTRY_COUNT]
-
-        self._call_custom_hook('post_load')
+        return
 
     def _rebuild_tag_map(self):
         self.tag_map = {}
@@ -844,6 +1305,28 @@ class Site(object):
         for tag, entry_list in self.tag_map.items():
             entry_list.sort()
 
+    def _build_dep_graph(self):
+        """Maps each output (entry pages, entry lists, and the index) to
+        the entry source paths it was rendered from. Entry pages
+        depend on their own source and their prev/next neighbors, entry
+        lists on their members.
+        """
+        graph = DependencyGraph()
+        for entry in self.all_entries:
+            output = ('entry', entry.source_path)
+            graph.add(output, entry.source_path)
+            for neighbor in (getattr(entry, 'prev_entries', [])
+                             + getattr(entry, 'next_entries', [])):
+                graph.add(output, neighbor.source_path)
+        graph.add(('list', None), *[e.source_path for e in self.entries])
+        for tag, entry_list in self.tag_map.items():
+            graph.add(('list', tag), *[e.source_path for e in entry_list])
+        if self.entries:
+            # the index is the newest entry's page, neighbor links and all
+            graph.add(('index', None),
+                      *graph.get_inputs(('entry', self.entries[0].source_path)))
+        return graph
+
     @chlog.wrap('critical', 'validate site')
     def validate(self):
         self._call_custom_hook('pre_validate')
@@ -863,107 +1346,296 @@ class Site(object):
         return slugify(header_text,
                        delim=self.get_config('site', 'anchor_delim', '-'))
 
-    @chlog.wrap('critical', 'render site', verbose=True)
-    def render(self):
-        self._call_custom_hook('pre_render')
-        entries = self.entries
-        mdc, imdc = self.md_converter, self.inline_md_converter
-        site_info = self.get_site_info()
-        canonical_domain = site_info['canonical_domain']
+    def _load_render_cache(self):
+        self.render_cache = RenderCache(
+            self.cache_path,
+            max_size=self.get_config('cache', 'max_size', DEFAULT_CACHE_MAX_SIZE),
+            max_age=self.get_config('cache', 'max_age', DEFAULT_CACHE_MAX_AGE),
+            enabled=self.use_cache and self.get_config('cache', 'enabled', True))
+        # the highlight cache lives inside the render cache directory,
+        # and is evicted along with it
+        self.highlight_cache.disk_cache = RenderCache(
+            pjoin(self.cache_path, HIGHLIGHT_CACHE_DIRNAME),
+            max_size=None, max_age=None, enabled=self.render_cache.enabled)
+        return self.render_cache
+
+    def _get_render_key_base(self, site_info):
+        """The part of the render cache key shared by all entries: chert
+        and Markdown versions, the config that reaches the templates,
+        and the contents of every layout in the theme."""
+        site_info = dict([(k, v) for k, v in site_info.items()
+                          if not k.startswith('last_generated')])
+        parts = [__version__, markdown.__version__, self._html_backend.name,
+                 json.dumps(site_info, sort_keys=True, default=str),
+                 json.dumps(self.get_config('site'), sort_keys=True, default=str),
+                 json.dumps(self.get_config('theme'), sort_keys=True, default=str)]
+        layout_paths = sorted(iter_find_files(self.theme_path,
+                                              [HTML_LAYOUT_PAT, MD_LAYOUT_PAT]))
+        for layout_path in layout_paths:
+            parts.append(layout_path)
+            parts.append(self.fal.read(layout_path))
+        if self._custom_html_transforms:
+            parts.append(self.fal.read(pjoin(self.input_path, 'custom.py')))
+        return make_key(*parts)
+
+    def _get_render_key(self, entry, key_base):
+        source = entry.source_text
+        if source is None:
+            source = json.dumps(entry.parts, sort_keys=True, default=str)
+        headers = json.dumps(entry.headers, sort_keys=True, default=str)
+        return make_key(key_base, source, headers)
+
+    def _prepare_render(self, site_info=None):
+        if site_info is None:
+            site_info = self.get_site_info()
+        self._site_info = site_info
+        backend_name = self.get_config('site', 'html_backend', 'auto')
+        self._html_backend = hypertext.get_html_backend(backend_name)
+        self._custom_html_transforms = self._load_custom_html_transforms()
+        self._inline_code_style_kw = hypertext.get_inline_code_style_kw(
+            _HILITE_INLINE.getConfig('pygments_style'),
+            _HILITE_INLINE.getConfig('css_class'))
+        render_cache = self._load_render_cache()
+        if render_cache.enabled:
+            self._render_key_base = self._get_render_key_base(site_info)
+        return
 
-        def markdown2html(string):
-            if not string:
-                return ''
-            ret = mdc.convert(string)
-            mdc.reset()
-            return ret
+    def _markdown2html(self, string):
+        if not string:
+            return ''
+        mdc = self.md_converter
+        ret = mdc.convert(string)
+        mdc.reset()
+        return ret
 
-        def markdown2ihtml(string, entry_fn):
-            if not string:
-                return ''
+    def _markdown2ihtml(self, string, entry_fn):
+        if not string:
+            return ''
+        imdc = self.inline_md_converter
+        ret = hypertext.canonicalize_links(imdc.convert(string),
+                                           self._site_info['canonical_domain'],
+                                           entry_fn)
+        imdc.reset()
+        return ret
 
-            ret = hypertext.canonicalize_links(imdc.convert(string),
-                                               canonical_domain,
-                                               entry_fn)
-            imdc.reset()
-            return ret
+    def _render_entry_content(self, entry):
+        render_cache = self.render_cache
+        cache_key, rendered = None, None
+        if render_cache.enabled:
+            cache_key = self._get_render_key(entry, self._render_key_base)
+            rendered = render_cache.get(cache_key)
+        if rendered is None:
+            rendered = self._get_rendered_content(entry)
+            if cache_key is not None:
+                render_cache.put(cache_key, rendered)
+        self._apply_rendered_content(entry, rendered)
+        return
 
-        def render_parts(entry):
-            for part in entry.loaded_parts:
-                part['content_html'] = markdown2html(part['content'])
-                part['content_ihtml'] = markdown2ihtml(part['content'],
-                                                       entry.output_filename)
-            if not entry.summary:
-                with chlog.debug('autosummarizing', reraise=False):
-                    entry.summary = entry._autosummarize()
-
-            tmpl_name = entry.entry_layout + MD_LAYOUT_EXT
-            render_ctx = {'entry': entry.to_dict(with_links=False),
-                          'site': site_info}
-            entry.content_md = self.md_renderer.render(tmpl_name, render_ctx)
-
-            tmpl_name = entry.content_layout + HTML_LAYOUT_EXT
-            content_html = self.html_renderer.render(tmpl_name, render_ctx)
-            with chlog.debug('parse_content_html'):
-                content_html_tree = hypertext.html_text_to_tree(content_html)
-            with chlog.debug('add_toc_content_html'):
-                hypertext.add_toc(content_html_tree, make_anchor_id=self._make_anchor_id)
-            with chlog.debug('retarget_links_content_html'):
-                _mode = self.get_config('site', 'retarget_links', 'external')
-                hypertext.retarget_links(content_html_tree, mode=_mode)
-            with chlog.debug('reserialize_content_html'):
-                content_html = hypertext.html_tree_to_text(content_html_tree)
-            entry.content_html = content_html
+    def _apply_rendered_content(self, entry, rendered):
+        """Sets the entry's rendered content (as returned by
+        :meth:`_get_rendered_content`, possibly from the render cache or
+        a worker process) onto *entry* and its parts."""
+        for part, rendered_part in zip(entry.loaded_parts, rendered['parts']):
+            part.update(rendered_part)
+        if not entry.summary:
+            with chlog.debug('autosummarizing', reraise=False):
+                entry.summary = entry._autosummarize()
+        entry.content_md = rendered['content_md']
+        entry.content_html = rendered['content_html']
+        entry.content_ihtml = rendered['content_ihtml']
+        return
 
+    def _get_html_transforms(self, entry, inline=False):
+        """Returns the transforms run over an entry's content HTML
+        tree, or with *inline*, over its inline (feed) HTML tree,
+        followed by any returned by the chert_html_transforms function
+        in custom.py."""
+        if inline:
+            # the inline layout path keeps the default anchor ids
+            inline_layout = self.get_config('theme', 'render_inline_layout', False)
+            make_anchor_id = slugify if inline_layout else self._make_anchor_id
+            ret = [hypertext.TOCifier(make_anchor_id=make_anchor_id),
+                   hypertext.LinkCanonicalizer(self._site_info['canonical_domain'],
+                                               entry.output_filename)]
+            if self._inline_code_style_kw:
+                ret.append(hypertext.CodeStyleInliner(**self._inline_code_style_kw))
+        else:
+            retarget_mode = self.get_config('site', 'retarget_links', 'external')
+            ret = [hypertext.TOCifier(make_anchor_id=self._make_anchor_id),
+                   hypertext.LinkRetargeter(retarget_mode)]
+        return ret + self._custom_html_transforms
+
+    def _get_rendered_content(self, entry):
+        site_info = self._site_info
+        for part in entry.loaded_parts:
+            part['content_html'] = self._markdown2html(part['content'])
+            part['content_ihtml'] = self._markdown2ihtml(part['content'],
+                                                         entry.output_filename)
+        if not entry.summary:
+            with chlog.debug('autosummarizing', reraise=False):
+                entry.summary = entry._autosummarize()
+
+        tmpl_name = entry.entry_layout + MD_LAYOUT_EXT
+        render_ctx = {'entry': entry.to_dict(with_links=False),
+                      'site': site_info}
+        content_md = self.md_renderer.render(tmpl_name, render_ctx)
+
+        tmpl_name = entry.content_layout + HTML_LAYOUT_EXT
+        content_html = self.html_renderer.render(tmpl_name, render_ctx)
+        with chlog.debug('parse_content_html'):
+            content_html_tree = hypertext.html_text_to_tree(content_html,
+                                                            self._html_backend)
+        # themes with a distinct inline (feed) layout opt into a second
+        # render, otherwise inline HTML is derived from a copy of the
+        # same tree
+        render_inline_layout = self.get_config('theme', 'render_inline_layout', False)
+        if render_inline_layout:
             render_ctx['inline'] = True
             content_ihtml = self.html_renderer.render(tmpl_name, render_ctx)
-            with chlog.debug('canonicalize_ihtml_links'):
-                # TODO: use tree (and move slightly down)
-                content_ihtml = hypertext.canonicalize_links(content_ihtml,
-                                                             canonical_domain,
-                                                             entry.output_filename)
             with chlog.debug('parse_content_ihtml'):
-                content_ihtml_tree = hypertext.html_text_to_tree(content_ihtml)
-            with chlog.debug('add_toc_content_ihtml'):
-                hypertext.add_toc(content_ihtml_tree)
-            with chlog.debug('reserialize_content_ihtml'):
-                content_ihtml = hypertext.html_tree_to_text(content_ihtml_tree)
+                content_ihtml_tree = hypertext.html_text_to_tree(content_ihtml,
+                                                                 self._html_backend)
+        else:
+            with chlog.debug('copy_content_ihtml'):
+                content_ihtml_tree = copy.deepcopy(content_html_tree)
+
+        with chlog.debug('transform_content_html'):
+            html_pipeline = hypertext.DOMPipeline(self._get_html_transforms(entry))
+            html_pipeline.process(content_html_tree)
+        with chlog.debug('reserialize_content_html'):
+            content_html = hypertext.html_tree_to_text(content_html_tree,
+                                                       self._html_backend)
+
+        with chlog.debug('transform_content_ihtml'):
+            ihtml_transforms = self._get_html_transforms(entry, inline=True)
+            hypertext.DOMPipeline(ihtml_transforms).process(content_ihtml_tree)
+        with chlog.debug('reserialize_content_ihtml'):
+            content_ihtml = hypertext.html_tree_to_text(content_ihtml_tree,
+                                                        self._html_backend)
+
+        rendered_parts = [{'content_html': part['content_html'],
+                           'content_ihtml': part['content_ihtml']}
+                          for part in entry.loaded_parts]
+        return {'parts': rendered_parts,
+                'content_md': content_md,
+                'content_html': content_html,
+                'content_ihtml': content_ihtml}
+
+    def _render_entries_content(self, entries):
+        """Renders the content of each of *entries*, fanning out to a
+        process pool when more than one worker is configured. Worker
+        processes build their own Site from the same paths, so content
+        rendering must not depend on changes made by custom hooks to
+        the Site's renderers or converters.
+        """
+        entries = list(entries)
+        workers = min(self.get_workers(), len(entries))
+        if workers < 2:
+            for entry in entries:
+                self._render_entry_content(entry)
+            return
 
-            entry.content_ihtml = content_ihtml
+        render_cache = self.render_cache
+        pending = []
+        for entry in entries:
+            cache_key, rendered = None, None
+            if render_cache.enabled:
+                cache_key = self._get_render_key(entry, self._render_key_base)
+                rendered = render_cache.get(cache_key)
+            if rendered is None:
+                pending.append((entry, cache_key))
+            else:
+                self._apply_rendered_content(entry, rendered)
+        if not pending:
             return
+        workers = min(workers, len(pending))
+        site_kw = dict([(name, self.paths[name]) for name in
+                        ('config_path', 'entries_path', 'themes_path',
+                         'uploads_path', 'output_path', 'cache_path')])
+        site_kw.update(use_cache=False, workers=1, dev_mode=self.dev_mode)
+        # custom.py is only re-imported by workers if it has transforms
+        load_custom = bool(self._custom_html_transforms)
+        init_args = (self.__class__, self.input_path, site_kw,
+                     self._site_info, load_custom)
+        entry_args = [(entry.__class__, entry.headers, entry.parts,
+                       entry.source_text, entry.summary)
+                      for entry, _ in pending]
+        chunksize = max(1, len(pending) // (workers * 4))
+        with chlog.info('render entry content in parallel',
+                        worker_count=workers, entry_count=len(pending)):
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_render_worker,
+                                     initargs=init_args) as pool:
+                results = pool.map(_render_entry_worker, entry_args,
+                                   chunksize=chunksize)
+                for (entry, cache_key), rendered in zip(pending, results):
+                    if cache_key is not None:
+                        render_cache.put(cache_key, rendered)
+                    self._apply_rendered_content(entry, rendered)
+        return
+
+    def _render_entry_html(self, entry, with_links=False):
+        tmpl_name = entry.entry_layout + HTML_LAYOUT_EXT
+        render_ctx = {'entry': entry.to_dict(with_links=with_links),
+                      'site': self._site_info}
+        entry_html = self.html_renderer.render(tmpl_name, render_ctx)
+        entry.entry_html = entry_html
+        return
 
-        def render_html(entry, with_links=False):
-            tmpl_name = entry.entry_layout + HTML_LAYOUT_EXT
-            render_ctx = {'entry': entry.to_dict(with_links=with_links),
-                          'site': site_info}
-            entry_html = self.html_renderer.render(tmpl_name, render_ctx)
-            entry.entry_html = entry_html
+    def _log_render_cache(self):
+        hilite_cache = self.highlight_cache
+        with chlog.debug('highlight cache stats') as rec:
+            rec['hit_count'] = hilite_cache.hit_count
+            rec['miss_count'] = hilite_cache.miss_count
+            rec.success('highlight cache had {hit_count} hits and'
+                        ' {miss_count} misses')
+        render_cache = self.render_cache
+        if not render_cache.enabled:
             return
+        with chlog.info('evict stale render cache') as rec:
+            rec['evict_count'] = render_cache.evict()
+            rec['hit_count'] = render_cache.hit_count
+            rec['miss_count'] = render_cache.miss_count
+            rec.success('render cache had {hit_count} hits and'
+                        ' {miss_count} misses, evicted {evict_count}')
+
+    def _clear_entry_dicts(self):
+        # memoized entry contexts (see Entry.to_dict) embed rendered
+        # content and neighbors' contexts, so are cleared wholesale
+        # between rendering steps
+        for entry in self.all_entries:
+            entry.clear_dict_cache()
+
+    @chlog.wrap('critical', 'render site', verbose=True)
+    def render(self):
+        self._call_custom_hook('pre_render')
+        self._prepare_render()
+        self._clear_entry_dicts()
 
         with chlog.info('render published entry content', verbose=True):
-            for entry in entries:
-                render_parts(entry)
+            self._render_entries_content(self.entries)
         with chlog.info('render draft entry content', verbose=True):
-            for entry in self.draft_entries:
-                render_parts(entry)
+            self._render_entries_content(self.draft_entries)
         with chlog.info('render special entry content', verbose=True):
-            for entry in self.special_entries:
-                render_parts(entry)
+            self._render_entries_content(self.special_entries)
 
+        self._clear_entry_dicts()
         with chlog.info('render entry html'):
-            for entry in entries:
-                render_html(entry, with_links=True)
+            for entry in self.entries:
+                self._render_entry_html(entry, with_links=True)
             for entry in self.draft_entries:
-                render_html(entry)
+                self._render_entry_html(entry)
             for entry in self.special_entries:
-                render_html(entry)
+                self._render_entry_html(entry)
 
-        # render feeds
+        # render feeds, entry contexts are reused across lists
+        self._clear_entry_dicts()
         with chlog.info('render feed and tag lists'):
             self.entries.render(site_obj=self)
             for tag, entry_list in self.tag_map.items():
                 entry_list.render(site_obj=self)
 
+        self._log_render_cache()
         self._call_custom_hook('post_render')
 
     @chlog.wrap('critical', 'audit site')
@@ -977,78 +1649,201 @@ class Site(object):
         self._call_custom_hook('pre_audit')
         self._call_custom_hook('post_audit')
 
-    @chlog.wrap('critical', 'export site')
-    def export(self):
-        fal = self.fal
-        self._call_custom_hook('pre_export')
+    def _export_entry(self, entry, writer=None):
+        if writer is None:
+            writer = self.fal
         output_path = self.paths['output_path']
+        entry_custom_base_path = os.path.split(entry.entry_root)[0]
+        if entry_custom_base_path:
+            writer.makedirs(pjoin(output_path, entry_custom_base_path))
+        er = entry.entry_root
+        entry_html_fn = er + EXPORT_HTML_EXT
+        entry_gen_md_fn = er + '.gen.md'
+        entry_data_fn = er + '.json'
+
+        html_output_path = pjoin(output_path, entry_html_fn)
+        data_output_path = pjoin(output_path, entry_data_fn)
+        gen_md_output_path = pjoin(output_path, entry_gen_md_fn)
+
+        writer.write(html_output_path, entry.entry_html)
+        writer.write(gen_md_output_path, entry.content_md)  # TODO
+        _data = json.dumps(entry.loaded_parts, indent=2, sort_keys=True)
+        writer.write(data_output_path, _data)
+
+        # TODO: copy file
+        # fal.write(src_output_path, entry.source_text)
+        return
 
-        with chlog.critical('create output path'):
-            mkdir_p(output_path)
-
-        def export_entry(entry):
-            entry_custom_base_path = os.path.split(entry.entry_root)[0]
-            if entry_custom_base_path:
-                mkdir_p(pjoin(output_path, entry_custom_base_path))
-            er = entry.entry_root
-            entry_html_fn = er + EXPORT_HTML_EXT
-            entry_gen_md_fn = er + '.gen.md'
-            entry_data_fn = er + '.json'
-
-            html_output_path = pjoin(output_path, entry_html_fn)
-            data_output_path = pjoin(output_path, entry_data_fn)
-            gen_md_output_path = pjoin(output_path, entry_gen_md_fn)
-
-            #fal.write(html_output_path, entry.entry_html)
-            #
-            fal.write(html_output_path, entry.entry_html)
-            fal.write(gen_md_output_path, entry.content_md)  # TODO
-            _data = json.dumps(entry.loaded_parts, indent=2, sort_keys=True)
-            fal.write(data_output_path, _data)
-
-            # TODO: copy file
-            # fal.write(src_output_path, entry.source_text)
-            return
-
-        for entry in self.entries:
-            export_entry(entry)
-        for entry in self.draft_entries:
-            export_entry(entry)
-        for entry in self.special_entries:
-            export_entry(entry)
-
+    def _export_index(self, writer=None):
+        if writer is None:
+            writer = self.fal
         # index is just the most recent entry for now
-        index_path = pjoin(output_path, 'index' + EXPORT_HTML_EXT)
+        index_path = pjoin(self.paths['output_path'], 'index' + EXPORT_HTML_EXT)
         if self.entries:
             index_content = self.entries[0].entry_html
         else:
             index_content = 'No entries yet!'
-        fal.write(index_path, index_content)
-        archive_path = pjoin(output_path, ('archive' + EXPORT_HTML_EXT))
-        fal.write(archive_path, self.entries.rendered_html)
+        writer.write(index_path, index_content)
 
-        # output feeds
-        rss_path = pjoin(output_path, RSS_FEED_FILENAME)
-        fal.write(rss_path, self.entries.rendered_rss_feed)
-        atom_path = pjoin(output_path, ATOM_FEED_FILENAME)
-        fal.write(atom_path, self.entries.rendered_atom_feed)
+    def _export_entry_list(self, entry_list, writer=None):
+        if writer is None:
+            writer = self.fal
+        output_path = self.paths['output_path']
+        if entry_list.tag:
+            list_path = pjoin(output_path, entry_list.path_part)
+            writer.makedirs(list_path)
+        else:
+            list_path = output_path
+        # the first page is the newest, at the list's index path
+        for page_filename, page_html in entry_list.rendered_pages:
+            page_path = pjoin(output_path, page_filename)
+            writer.makedirs(os.path.dirname(page_path))
+            writer.write(page_path, page_html)
+        rss_path = pjoin(list_path, RSS_FEED_FILENAME)
+        atom_path = pjoin(list_path, ATOM_FEED_FILENAME)
+        writer.write(rss_path, entry_list.rendered_rss_feed)
+        writer.write(atom_path, entry_list.rendered_atom_feed)
+
+    def _get_entry_filenames(self, entry):
+        "Returns the paths of *entry*'s outputs, relative to the output path."
+        er = entry.entry_root
+        return [er + EXPORT_HTML_EXT, er + '.gen.md', er + '.json']
+
+    def _get_list_filenames(self, entry_list):
+        """Returns the paths of *entry_list*'s rendered pages and feeds,
+        relative to the output path."""
+        if not hasattr(entry_list, 'rendered_pages'):
+            return []
+        ret = [page_filename for page_filename, _ in entry_list.rendered_pages]
+        ret.extend([entry_list.path_part + RSS_FEED_FILENAME,
+                    entry_list.path_part + ATOM_FEED_FILENAME])
+        return ret
 
-        for tag, entry_list in self.tag_map.items():
-            tag_path = pjoin(output_path, entry_list.path_part)
-            mkdir_p(tag_path)
-            rss_path = pjoin(tag_path, RSS_FEED_FILENAME)
-            atom_path = pjoin(tag_path, ATOM_FEED_FILENAME)
-            archive_path = pjoin(tag_path, 'index.html')
-            fal.write(rss_path, entry_list.rendered_rss_feed)
-            fal.write(atom_path, entry_list.rendered_atom_feed)
-            fal.write(archive_path, entry_list.rendered_html)
-
-        # copy assets, i.e., all directories under the theme path
+    def _remove_outputs(self, filenames, writer=None):
+        """Removes the outputs at *filenames*, relative to the output
+        path. On disk, compressed variants and directories left empty
+        (e.g., of a tag with no more entries) go too."""
+        if writer is None:
+            writer = self.fal
+        output_path = self.paths['output_path']
+        for filename in filenames:
+            path = pjoin(output_path, filename)
+            writer.remove(path)
+            if self.memory_outputs is None:
+                for variant_path in get_variant_paths(path):
+                    writer.remove(variant_path)
+        if self.memory_outputs is not None:
+            return
+        dir_paths = set([os.path.dirname(pjoin(output_path, fn)) for fn in filenames])
+        for dir_path in sorted(dir_paths, key=len, reverse=True):
+            while _is_under(dir_path, output_path) and abspath(dir_path) != abspath(output_path):
+                try:
+                    os.rmdir(dir_path)
+                except OSError:
+                    break  # not empty
+                dir_path = os.path.dirname(dir_path)
+        return
+
+    def _get_writer(self, replace=False):
+        """Returns a WriterPool writing through the site's FAL, with
+        build.write_workers threads (default 8), or when serving from
+        memory, a stage of the MemoryOutputs, which is served when the
+        export is done. With *replace*, the stage replaces all
+        previous outputs."""
+        if self.memory_outputs is not None:
+            return self.memory_outputs.stage(replace=replace)
+        workers = self.get_config('build', 'write_workers',
+                                  DEFAULT_WRITE_WORKERS)
+        return WriterPool(self.fal, workers=int(workers or 1))
+
+    def _export_assets(self):
+        # sync assets, i.e., all directories under the theme path,
+        # copying only changed files and removing those the theme no
+        # longer has
+        output_path = self.paths['output_path']
+        hardlink = self.get_config('build', 'hardlink_assets', False)
+        check_hash = self.get_config('build', 'hash_assets', False)
+        compressors = self._get_compressors()
         for sdn in get_subdirectories(self.theme_path):
             cur_src = pjoin(self.theme_path, sdn)
             cur_dest = pjoin(output_path, sdn)
-            with chlog.critical('copy assets', src=cur_src, dest=cur_dest):
-                copytree(cur_src, cur_dest)
+
+            # keeps the compressed variants of synced files, see
+            # _export_compressed(), which updates them as needed
+            def _is_variant(rel_path, cur_src=cur_src):
+                src_rel_path = get_variant_source(rel_path, compressors)
+                return (src_rel_path is not None
+                        and os.path.isfile(pjoin(cur_src, src_rel_path)))
+
+            self.fal.sync_tree(cur_src, cur_dest, hardlink=hardlink,
+                               check_hash=check_hash, keep=_is_variant,
+                               level='critical')
+
+    def _get_compressors(self):
+        """Returns the compressors configured by build.compress, which
+        may be true for all available formats, or a list of format
+        names (gzip, zstd, brotli). Formats whose module isn't
+        installed are skipped."""
+        compress = self.get_config('build', 'compress', False)
+        if not compress:
+            return []
+        if compress is True:
+            return get_compressors()
+        if isinstance(compress, str):
+            compress = [compress]
+        return get_compressors(compress)
+
+    def _export_compressed(self):
+        compressors = self._get_compressors()
+        if not compressors:
+            return
+        min_size = self.get_config('build', 'compress_min_size',
+                                   DEFAULT_COMPRESS_MIN_SIZE)
+        workers = self.get_config('build', 'compress_workers',
+                                  os.cpu_count() or 1)
+        with chlog.critical('write compressed variants') as rec:
+            rec['formats'] = ', '.join([c.name for c in compressors])
+            counts = compress_tree(self.fal, self.paths['output_path'],
+                                   compressors, min_size=int(min_size),
+                                   workers=int(workers or 1))
+            for key, value in counts.items():
+                rec[key] = value
+            rec.success('compressed {compressed_count} variants ({formats}),'
+                        ' skipped {skipped_count} unchanged,'
+                        ' removed {removed_count}')
+
+    @chlog.wrap('critical', 'export site')
+    def export(self):
+        self._call_custom_hook('pre_export')
+        output_path = self.paths['output_path']
+
+        if self.memory_outputs is None:
+            with chlog.critical('create output path'):
+                mkdir_p(output_path)
+
+        self.fal.reset_counts()
+        # serialization happens here, writes happen in the pool
+        with self._get_writer(replace=True) as writer:
+            for entry in self.entries:
+                self._export_entry(entry, writer)
+            for entry in self.draft_entries:
+                self._export_entry(entry, writer)
+            for entry in self.special_entries:
+                self._export_entry(entry, writer)
+
+            self._export_index(writer)
+
+            # output feeds
+            self._export_entry_list(self.entries, writer)
+            for tag, entry_list in self.tag_map.items():
+                self._export_entry_list(entry_list, writer)
+
+        if self.memory_outputs is not None:
+            # the dev server serves assets and uploads from their sources
+            self._call_custom_hook('post_export')
+            return
+
+        self._export_assets()
 
         # optionally symlink the uploads directory.  this is an
         # important step for sites with uploads because Chert's
@@ -1072,97 +1867,323 @@ class Site(object):
                     os.symlink(self.uploads_path, uploads_link_path)
                 rec.success(message)
 
+        self._export_compressed()
+        self._log_write_counts()
+        if self.use_cache:
+            self._write_manifest()
+        self._call_custom_hook('post_export')
+
+    def _log_write_counts(self):
+        with chlog.info('count exported files') as rec:
+            for key, value in self.fal.get_counts().items():
+                rec[key] = value
+            rec.success('wrote {written_count} files ({written_bytes} bytes),'
+                        ' skipped {skipped_count} unchanged files'
+                        ' ({skipped_bytes} bytes)')
+
+    def _needs_full_process(self, changed_paths):
+        if not self.last_load:
+            return True
+        custom_mod_path = pjoin(self.input_path, 'custom.py')
+        for path in changed_paths:
+            if path in (self.paths['config_path'], custom_mod_path):
+                return True
+            if _is_under(path, self.theme_path):
+                rel_path = os.path.relpath(path, self.theme_path)
+                if os.path.dirname(rel_path):
+                    continue  # assets are handled separately
+                return True  # layouts and feed templates affect every page
+        return False
+
+    @chlog.wrap('critical', 'update site', inject_as='log_rec')
+    def update(self, changed_paths, log_rec):
+        """Rebuilds only the outputs affected by *changed_paths*, using
+        the dependency graph built at load time. Config, custom.py, and
+        theme layout changes fall back to a full :meth:`process`.
+
+        Returns the set of affected outputs, or None after a full
+        process.
+        """
+        if self._needs_full_process(changed_paths):
+            log_rec['update_mode'] = 'full'
+            self.process()
+            return None
+        log_rec['update_mode'] = 'incremental'
+        changed_entry_paths = [p for p in changed_paths
+                               if _is_under(p, self.entries_path)]
+        changed_asset = any(_is_under(p, self.theme_path)
+                            for p in changed_paths)
+
+        # outputs not exported again below, e.g., of deleted entries or
+        # emptied tags, are removed
+        old_filenames = set()
+        for ep in changed_entry_paths:
+            if ep in self._entry_map:
+                old_filenames.update(self._get_entry_filenames(self._entry_map[ep]))
+        old_list_filenames = dict([(tag, self._get_list_filenames(entry_list))
+                                   for tag, entry_list in self.tag_map.items()])
+        old_list_filenames[None] = self._get_list_filenames(self.entries)
+
+        self._call_custom_hook('pre_load')
+        file_infos = self._get_entry_file_infos(changed_entry_paths,
+                                                with_hash=self.use_lazy_entries())
+        for ep in changed_entry_paths:
+            self._entry_map.pop(ep, None)
+            if not os.path.exists(ep):
+                continue
+            entry = self._load_entry(ep)
+            if entry is not None:
+                self._entry_map[ep] = entry
+        self._update_entry_index([self._entry_map[ep] for ep in changed_entry_paths
+                                  if ep in self._entry_map],
+                                 [ep for ep in changed_entry_paths
+                                  if ep not in self._entry_map],
+                                 file_infos)
+        self._organize_entries()
+        self._call_custom_hook('post_load')
+
+        old_graph, self.dep_graph = self.dep_graph, self._build_dep_graph()
+        affected = (old_graph.get_affected(changed_entry_paths)
+                    | self.dep_graph.get_affected(changed_entry_paths)
+                    | old_graph.diff(self.dep_graph))
+        log_rec['affected_count'] = len(affected)
+
+        self.validate()
+
+        self._call_custom_hook('pre_render')
+        self._prepare_render()
+        rerender_paths = set(changed_entry_paths)
+        published = set(self.entries)
+        affected_entries = [self._entry_map[src] for kind, src
+                            in sorted(affected, key=repr)
+                            if kind == 'entry' and src in self._entry_map]
+        self._clear_entry_dicts()
+        for entry in affected_entries:
+            if entry.source_path in rerender_paths:
+                self._render_entry_content(entry)
+        self._clear_entry_dicts()
+        for entry in affected_entries:
+            self._render_entry_html(entry, with_links=entry in published)
+        self._clear_entry_dicts()
+        affected_lists = [self.entries] if ('list', None) in affected else []
+        affected_lists.extend([self.tag_map[tag] for kind, tag in affected
+                               if kind == 'list' and tag in self.tag_map])
+        for entry_list in affected_lists:
+            entry_list.render(site_obj=self)
+        self._log_render_cache()
+        self._call_custom_hook('post_render')
+
+        self._call_custom_hook('pre_export')
+        for kind, key in affected:
+            if kind == 'list':
+                old_filenames.update(old_list_filenames.get(key, ()))
+        new_filenames = set()
+        for entry in affected_entries:
+            new_filenames.update(self._get_entry_filenames(entry))
+        for entry_list in affected_lists:
+            new_filenames.update(self._get_list_filenames(entry_list))
+        removed_filenames = sorted(old_filenames - new_filenames)
+        log_rec['removed_count'] = len(removed_filenames)
+
+        self.fal.reset_counts()
+        with self._get_writer() as writer:
+            for entry in affected_entries:
+                self._export_entry(entry, writer)
+            for entry_list in affected_lists:
+                self._export_entry_list(entry_list, writer)
+            if ('index', None) in affected:
+                self._export_index(writer)
+            self._remove_outputs(removed_filenames, writer)
+        if self.memory_outputs is not None:
+            self._call_custom_hook('post_export')
+            log_rec.success('updated {affected_count} outputs in memory')
+            return affected
+        if changed_asset:
+            self._export_assets()
+        self._export_compressed()
+        self._log_write_counts()
+        if self.use_cache:
+            self._write_manifest()
         self._call_custom_hook('post_export')
 
+        log_rec.success('updated {affected_count} outputs')
+        return affected
+
+    def _get_static_dirs(self):
+        """Returns the (url_prefix, dir_path) pairs the dev server falls
+        back to. In memory, these are the theme asset directories and
+        uploads, otherwise, the output directory."""
+        if self.memory_outputs is None:
+            return [('', self.paths['output_path'])]
+        ret = [(sdn, pjoin(self.theme_path, sdn))
+               for sdn in get_subdirectories(self.theme_path)]
+        ret.append(('uploads', self.uploads_path))
+        return ret
+
+    def _get_changed_outputs(self, changed_paths):
+        """Returns the paths of the outputs changed by the last build,
+        relative to the output directory, and whether every page
+        should reload, e.g., after a stylesheet changes."""
+        if self.memory_outputs is not None:
+            rel_paths = self.memory_outputs.pop_changed()
+        else:
+            output_path = self.paths['output_path']
+            rel_paths = set([os.path.relpath(p, output_path).replace(os.sep, '/')
+                             for p in self.fal.written_paths | self.fal.removed_paths])
+        reload_all = any(_is_under(p, self.theme_path)
+                         and os.path.dirname(os.path.relpath(p, self.theme_path))
+                         for p in changed_paths)
+        return rel_paths, reload_all
+
     def serve(self):
+        """Runs the dev server, rebuilding the site as files change. With
+        dev.in_memory (the default), pages are served from memory, and
+        nothing is written to the output directory. With
+        dev.live_reload (the default), open pages reload as soon as
+        their output changes."""
         dev_config = self.get_config('dev')
         host = dev_config.get('server_host', DEV_SERVER_HOST)
         port = dev_config.get('server_port', int(DEV_SERVER_PORT))
         base_url = dev_config.get('base_path', DEV_SERVER_BASE_PATH)
-
-        class Handler(SimpleHTTPRequestHandler):
-            def send_head(self):
-                if not self.path.startswith(base_url):
-                    self.send_error(404, 'File not found')
-                    return None
-                self.path = self.path[len(base_url):]
-                if not self.path.startswith('/'):
-                    self.path = '/' + self.path
-                return SimpleHTTPRequestHandler.send_head(self)
-        Handler.extensions_map.update({'.md': 'text/plain',
-                                       '.json': 'application/json'})
-
-
-        class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-            """Handle requests in a separate thread."""
-
-        server = ThreadedHTTPServer((host, port), Handler)
+        output_path = self.paths['output_path']
+        if dev_config.get('in_memory', True):
+            self.memory_outputs = MemoryOutputs(output_path,
+                                                compressors=self._get_compressors())
+        live_reload = None
+        if self.dev_mode and dev_config.get('live_reload', True):
+            live_reload = LiveReloadHub()
+        server = DevServer((host, port), outputs=self.memory_outputs,
+                           base_path=base_url, live_reload=live_reload)
         serving = False
 
         config_path = self.paths['config_path']
         entries_path = self.paths['entries_path']
         theme_path = self.paths['theme_path']
-        output_path = self.paths['output_path']
-        for changed in _iter_changed_files(entries_path, theme_path, config_path):
+        watch_kw = {'interval': dev_config.get('watch_interval', DEV_WATCH_INTERVAL),
+                    'debounce': dev_config.get('watch_debounce', DEV_WATCH_DEBOUNCE),
+                    'use_inotify': dev_config.get('watch_inotify')}
+        custom_mod_path = pjoin(self.input_path, 'custom.py')
+        for changed in _iter_changed_files(entries_path, theme_path, config_path,
+                                           custom_mod_path, **watch_kw):
             if serving:
                 print('Changed %s files, regenerating...' % len(changed))
-                server.shutdown()
-            with chlog.critical('site generation', reraise=True):
-                self.process()
-            print('Serving from %s' % output_path)
-            os.chdir(abspath(output_path))
+            # the server stays up throughout. in memory, requests see
+            # the previous build until this one is done; on disk,
+            # each file is replaced atomically.
+            with chlog.critical('site generation', reraise=not serving) as rec:
+                self.update(changed)
+            if rec.status != 'success':
+                print('Site generation failed, still serving the last build')
+                continue
+            server.static_dirs = self._get_static_dirs()
+            changed_outputs, reload_all = self._get_changed_outputs(changed)
+            if live_reload is not None and serving:
+                with chlog.info('notify live reload') as rec:
+                    rec['page_count'] = live_reload.notify(changed_outputs,
+                                                           reload_all=reload_all)
+                    rec.success('notified {page_count} open pages')
+            if serving:
+                continue
+            if self.memory_outputs is None:
+                print('Serving from %s' % output_path)
+            else:
+                print('Serving %s pages from memory' % len(self.memory_outputs))
             print('Serving at http://%s:%s%s' % (host, port, base_url))
 
             thread = Thread(target=server.serve_forever)
             thread.daemon = True
             thread.start()
-            if not serving:
-                serving = True
+            serving = True
         # TODO: hook(s)?
         return
 
     @chlog.wrap('critical', 'publish site', inject_as='log_rec')
     def publish(self, log_rec):  # deploy?
+        """Publishes the files added, changed, or deleted since the
+        last successful publish to the same target, as recorded by the
+        export manifest. Without a record of a previous publish (e.g.,
+        after clearing the cache, or with caching disabled, when none is
+        kept), every file is published.
+        """
         #self._load_custom_mod()
         #self._call_custom_hook('pre_publish')
-        prod_config = self.get_config('prod')
-        rsync_cmd = prod_config.get('rsync_cmd', 'rsync')
-        if not rsync_cmd.isalpha():
-            rsync_cmd = shlex.quote(rsync_cmd)
-        # TODO: add -e 'ssh -o "NumberOfPasswordPrompts 0"' to fail if
-        # ssh keys haven't been set up.
-        rsync_flags = prod_config.get('rsync_flags', 'avzPk')
-        local_site_path = self.output_path
-        if not local_site_path.endswith('/'):
-            local_site_path += '/'  # not just cosmetic; rsync needs this
-        assert os.path.exists(local_site_path + 'index.html')
-        remote_host = prod_config['remote_host']
-        remote_user = prod_config['remote_user']
-        remote_path = prod_config['remote_path']
-        remote_slug = "%s@%s:'%s'" % (remote_user,
-                                      remote_host,
-                                      shlex.quote(remote_path))
-
-        full_rsync_cmd = '%s -%s %s %s' % (rsync_cmd,
-                                           rsync_flags,
-                                           local_site_path,
-                                           remote_slug)
-        log_rec['rsync_cmd'] = full_rsync_cmd
-        print('Executing', full_rsync_cmd)
+        output_path = self.output_path
+        assert os.path.exists(pjoin(output_path, 'index.html'))
+        target = self._get_publish_target()
+        # rebuilt in case the output changed since export, cheaply,
+        # as only files with new sizes or mtimes are rehashed
+        use_cache = self.use_cache
+        manifest = build_manifest(output_path,
+                                  self._load_manifest(self.manifest_path)
+                                  if use_cache else None)
+        published_path = self._get_published_manifest_path(target)
+        prev_manifest = self._load_manifest(published_path) if use_cache else None
+        added, changed, removed = diff_manifests(prev_manifest, manifest)
+        log_rec['publish_target'] = target.get_id()
+        log_rec['added_count'] = len(added)
+        log_rec['changed_count'] = len(changed)
+        log_rec['removed_count'] = len(removed)
+        if not (added or changed or removed):
+            log_rec.success('nothing to publish to {publish_target}')
+            return True
         try:
-            rsync_output = subprocess.check_output(full_rsync_cmd, shell=True)
+            target.publish(output_path, added + changed, removed)
         except subprocess.CalledProcessError as cpe:
             log_rec['rsync_exit_code'] = cpe.returncode
-            rsync_output = cpe.output
-            print(rsync_output)
+            print(cpe.output)
             log_rec.failure('publish failed: rsync got exit code {rsync_exit_code}')
             return False
-        else:
-            print(rsync_output)
-            log_rec.success()
+        except OSError as ose:
+            # e.g., no rsync installed, or an unwritable publish_path
+            log_rec['publish_error'] = '%s: %s' % (ose.__class__.__name__, ose)
+            log_rec.failure('publish failed: {publish_error}')
+            return False
+        if use_cache:
+            mkdir_p(os.path.dirname(published_path))
+            self.fal.write(published_path, json.dumps(manifest, sort_keys=True))
+        log_rec.success('published {added_count} added, {changed_count} changed,'
+                        ' and {removed_count} removed files to {publish_target}')
         return True
         #self._call_custom_hook('post_publish')
 
+    def _get_publish_target(self):
+        prod_config = self.get_config('prod')
+        target_name = prod_config.get('publish_target', 'rsync')
+        try:
+            target_type = PUBLISH_TARGETS[target_name]
+        except KeyError:
+            raise ValueError('expected prod.publish_target to be one of %r,'
+                             ' not: %r' % (sorted(PUBLISH_TARGETS), target_name))
+        return target_type.from_config(prod_config, self.input_path)
+
+    @property
+    def manifest_path(self):
+        return pjoin(self.cache_path, MANIFEST_FILENAME)
+
+    def _get_published_manifest_path(self, target):
+        return pjoin(self.cache_path, PUBLISHED_DIRNAME,
+                     make_key(target.get_id())[:16] + '.json')
+
+    def _load_manifest(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            ret = json.loads(self.fal.read(path))
+        except (OSError, ValueError):
+            return None
+        return ret if is_valid_manifest(ret) else None
+
+    def _write_manifest(self):
+        """Writes a manifest of the output directory to the cache,
+        hashing only the files that changed since the last manifest."""
+        with chlog.debug('write output manifest') as rec:
+            prev_manifest = self._load_manifest(self.manifest_path)
+            manifest = build_manifest(self.output_path, prev_manifest)
+            mkdir_p(self.cache_path)
+            self.fal.write(self.manifest_path, json.dumps(manifest, sort_keys=True))
+            rec['file_count'] = len(manifest['files'])
+        return manifest
+
 
 def get_subdirectories(path):
     "Returns a list of directory names (not absolute paths) in a given path."
@@ -1174,6 +2195,54 @@ def get_subdirectories(path):
         return []
 
 
+def _truncate_text(text, length):
+    text = ' '.join(text.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
+
+
+def _parse_entry_path(entry_type, path):
+    """Loads the entry at *path* with *entry_type*'s from_path() in a
+    worker process. Returns the Entry, or the exception raised, so that
+    errors can be logged per-entry by the parent process."""
+    try:
+        entry = entry_type.from_path(path)
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError('%s: %s' % (e.__class__.__name__, e))
+        return e
+    return entry
+
+
+_render_worker_site = None
+
+
+def _init_render_worker(site_type, input_path, site_kw, site_info,
+                        load_custom=False):
+    global _render_worker_site
+    site = site_type(input_path, **site_kw)
+    if load_custom:
+        site._load_custom_mod()
+    site._load_renderers()
+    site._prepare_render(site_info)  # shared, for identical timestamps
+    _render_worker_site = site
+
+
+def _render_entry_worker(entry_args):
+    entry_type, headers, parts, source_text, summary = entry_args
+    entry = entry_type.from_parsed(headers, parts, source_text=source_text)
+    entry.summary = summary
+    return _render_worker_site._get_rendered_content(entry)
+
+
+def _is_under(path, dir_path):
+    dir_path = os.path.join(abspath(dir_path), '')
+    return abspath(path).startswith(dir_path)
+
+
 def to_timestamp(dt_obj, to_utc=False):
     # TODO: RFC822: email.Utils.formatdate(time.mktime(dt.timetuple()))
     if to_utc and dt_obj.tzinfo:
@@ -1183,26 +2252,14 @@ def to_timestamp(dt_obj, to_utc=False):
     return dt_obj.strftime('%Y-%m-%dT%H:%M:%S%z')
 
 
-# TODO: also monitor config path
-def _iter_changed_files(entries_path, theme_path, config_path, interval=0.5):
-    mtimes = {}
-    while True:
-        changed = []
-        to_check = itertools.chain([config_path],
-                                   iter_find_files(entries_path, ENTRY_PATS),
-                                   iter_find_files(theme_path, '*'))
-        for path in to_check:
-            try:
-                new_mtime = os.stat(path).st_mtime
-            except OSError:
-                continue
-            old_mtime = mtimes.get(path)
-            if not old_mtime or new_mtime > old_mtime:
-                mtimes[path] = new_mtime
-                changed.append(path)
-        if changed:
-            yield changed
-        time.sleep(interval)
+def _iter_changed_files(entries_path, theme_path, config_path, custom_mod_path,
+                        interval=DEV_WATCH_INTERVAL,
+                        debounce=DEV_WATCH_DEBOUNCE, use_inotify=None):
+    return iter_changed_files([(entries_path, ENTRY_PATS), (theme_path, '*')],
+                              [config_path, custom_mod_path],
+                              interval=interval,
+                              debounce=debounce,
+                              use_inotify=use_inotify)
 
 
 """
@@ -1213,17 +2270,3 @@ Metadata ideas:
   - Via
 """
 _docstart_re = re.compile(b'^---(\r\n?|\n)')
-
-
-def omd_load(stream, Loader=yaml.Loader, object_pairs_hook=OMD):
-    class OrderedLoader(Loader):
-        pass
-
-    def construct_mapping(loader, node):
-        loader.flatten_mapping(node)
-        return object_pairs_hook(loader.construct_pairs(node))
-
-    OrderedLoader.add_constructor(
-        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-        construct_mapping)
-    return yaml.load(stream, OrderedLoader)
@@ -0,0 +1,61 @@
+"""
+A minimal dependency graph for incremental rebuilds.
+
+Outputs (any hashable, e.g., ``('entry', source_path)``) are mapped
+to the inputs they were built from (e.g., entry source paths). Given
+a set of changed inputs, the graph answers which outputs need to be
+rebuilt.
+"""
+
+
+class DependencyGraph(object):
+    def __init__(self):
+        self.output_map = {}  # output -> set of inputs
+        self.input_map = {}  # input -> set of outputs
+
+    def add(self, output, *inputs):
+        cur_inputs = self.output_map.setdefault(output, set())
+        for input_ in inputs:
+            cur_inputs.add(input_)
+            self.input_map.setdefault(input_, set()).add(output)
+        return
+
+    def remove(self, output):
+        for input_ in self.output_map.pop(output, ()):
+            outputs = self.input_map[input_]
+            outputs.discard(output)
+            if not outputs:
+                del self.input_map[input_]
+        return
+
+    def get_inputs(self, output):
+        return set(self.output_map.get(output, ()))
+
+    def get_affected(self, inputs):
+        "Returns the set of outputs depending on any of *inputs*."
+        ret = set()
+        for input_ in inputs:
+            ret.update(self.input_map.get(input_, ()))
+        return ret
+
+    def diff(self, other):
+        """Returns the set of outputs which were added, removed, or whose
+        inputs differ between this graph and *other*. For instance,
+        entries whose prev/next neighbors shifted after a reordering.
+        """
+        ret = set()
+        for output in set(self.output_map) | set(other.output_map):
+            if self.output_map.get(output) != other.output_map.get(output):
+                ret.add(output)
+        return ret
+
+    def __len__(self):
+        return len(self.output_map)
+
+    def __contains__(self, output):
+        return output in self.output_map
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s outputs=%r inputs=%r>'
+                % (cn, len(self.output_map), len(self.input_map)))
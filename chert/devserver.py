@@ -0,0 +1,423 @@
+"""
+The development server.
+
+By default, pages are exported to a :class:`MemoryOutputs` rather than
+to disk, and served straight from memory. Theme assets and uploads are
+served from their source directories, with validators (ETag,
+Last-Modified) so that browsers can revalidate them cheaply.
+
+Servers are configured with their outputs and directories rather than
+serving from the working directory, so several sites can be served
+from one process.
+
+Pages in dev mode subscribe to a server-sent events endpoint
+(LIVE_RELOAD_PATH, under the base path), and are told to reload by
+the :class:`LiveReloadHub` when their output changes.
+"""
+import os
+import queue
+import hashlib
+import posixpath
+import threading
+from socketserver import ThreadingMixIn
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, unquote, parse_qs
+from http.server import SimpleHTTPRequestHandler, HTTPServer
+
+from chert.compress import get_encoded_variant, parse_accept_encoding
+
+DEFAULT_INDEX = 'index.html'
+LIVE_RELOAD_PATH = '_chert/events'
+LIVE_RELOAD_KEEPALIVE = 15  # seconds between comments on idle streams
+_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class MemoryOutputs(object):
+    """Keeps exported outputs in memory, keyed by their path relative
+    to *root_path*. With *compressors*, compressed variants are made
+    on first request, and kept until the output changes.
+
+    Builds write to a :meth:`stage`, which replaces the served
+    snapshot all at once when it's done, so requests made during a
+    build see the complete previous build.
+    """
+    def __init__(self, root_path, compressors=None):
+        self.root_path = os.path.abspath(root_path)
+        self.compressors = compressors or []
+        self._snapshot = ({}, frozenset())  # ({rel_path: (data, etag)}, dirs)
+        self._variants = {}  # (rel_path, encoding, etag) -> data
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def get_rel_path(self, path):
+        rel_path = os.path.relpath(os.path.abspath(path), self.root_path)
+        return rel_path.replace(os.sep, '/')
+
+    def stage(self, replace=False):
+        """Returns a writer for a build. Its outputs are served once it
+        exits without error. With *replace*, outputs it didn't write
+        are dropped, as after a full build."""
+        return StagedOutputs(self, replace=replace)
+
+    def write(self, path, data, **kw):
+        with self.stage() as staged:
+            staged.write(path, data, **kw)
+
+    def commit(self, outputs, replace=False, removed=()):
+        """Serves *outputs*, a dict of (data, etag) pairs by rel_path,
+        and stops serving the rel_paths in *removed*."""
+        with self._lock:
+            prev_outputs = self._snapshot[0]
+            new_outputs = {} if replace else dict(prev_outputs)
+            new_outputs.update(outputs)
+            changed = set([rel_path for rel_path, (_, etag) in outputs.items()
+                           if prev_outputs.get(rel_path, (None, None))[1] != etag])
+            for rel_path in removed:
+                if new_outputs.pop(rel_path, None) is not None:
+                    changed.add(rel_path)
+            dirs = set()
+            for rel_path in new_outputs:
+                rel_dir = posixpath.dirname(rel_path)
+                while rel_dir and rel_dir not in dirs:
+                    dirs.add(rel_dir)
+                    rel_dir = posixpath.dirname(rel_dir)
+            self._snapshot = (new_outputs, frozenset(dirs))
+            self._changed |= changed
+            if changed or replace:
+                self._variants = dict([(k, v) for k, v in self._variants.items()
+                                       if new_outputs.get(k[0], (None, None))[1] == k[2]])
+        return
+
+    def pop_changed(self):
+        "Returns the paths whose content changed since the last call."
+        with self._lock:
+            ret, self._changed = self._changed, set()
+        return ret
+
+    def get(self, rel_path):
+        "Returns the (data, etag) pair for *rel_path*, or None."
+        return self._snapshot[0].get(rel_path)
+
+    def has_dir(self, rel_path):
+        return rel_path.rstrip('/') in self._snapshot[1]
+
+    def get_compressor(self, accept_encoding):
+        """Returns the first compressor acceptable under the
+        *accept_encoding* header value, or None."""
+        accepted = parse_accept_encoding(accept_encoding)
+        for compressor in self.compressors:
+            if compressor.encoding in accepted or '*' in accepted:
+                return compressor
+        return None
+
+    def get_variant(self, rel_path, output, compressor):
+        "Returns *output*, the (data, etag) pair at *rel_path*, compressed."
+        key = (rel_path, compressor.encoding, output[1])
+        data = self._variants.get(key)
+        if data is None:
+            data = compressor.compress(output[0])
+            self._variants[key] = data
+        return data
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+
+class StagedOutputs(object):
+    """Stands in for a :class:`~chert.fal.WriterPool` during export,
+    collecting a build's outputs for a :class:`MemoryOutputs`."""
+    def __init__(self, memory_outputs, replace=False):
+        self.memory_outputs = memory_outputs
+        self.replace = replace
+        self.outputs = {}
+        self.removed = set()
+
+    def makedirs(self, dir_path):
+        return
+
+    def write(self, path, data, encoding='utf-8', **kw):
+        if isinstance(data, str):
+            data = data.encode(encoding)
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()[:20]
+        self.outputs[self.memory_outputs.get_rel_path(path)] = (data, etag)
+
+    def remove(self, path, **kw):
+        rel_path = self.memory_outputs.get_rel_path(path)
+        self.outputs.pop(rel_path, None)
+        self.removed.add(rel_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.memory_outputs.commit(self.outputs, replace=self.replace,
+                                       removed=self.removed)
+        return
+
+
+class LiveReloadHub(object):
+    """Tracks the pages subscribed to reload events by their output
+    path, relative to the output directory."""
+    def __init__(self):
+        self.closed = False
+        self._subscribers = {}  # event queue -> rel_path
+        self._lock = threading.Lock()
+
+    def subscribe(self, rel_path):
+        "Returns a queue that receives the events for *rel_path*."
+        events = queue.Queue()
+        with self._lock:
+            self._subscribers[events] = rel_path
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def notify(self, rel_paths=(), reload_all=False):
+        """Tells the pages at *rel_paths*, or with *reload_all*, every
+        page, to reload. Returns the number of pages notified."""
+        rel_paths = set(rel_paths)
+        ret = 0
+        with self._lock:
+            for events, rel_path in self._subscribers.items():
+                if reload_all or rel_path in rel_paths:
+                    events.put('reload')
+                    ret += 1
+        return ret
+
+    def close(self):
+        "Ends all event streams."
+        self.closed = True
+        with self._lock:
+            for events in self._subscribers:
+                events.put(None)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+def get_file_etag(stat_result):
+    return '"%x-%x"' % (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+class DevRequestHandler(SimpleHTTPRequestHandler):
+    """Serves a :class:`DevServer`'s site. Paths are looked up in the
+    server's in-memory outputs, if any, then in its static
+    directories."""
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map,
+                          **{'.md': 'text/plain',
+                             '.json': 'application/json'})
+
+    def get_rel_path(self, url_path):
+        """Returns the path of *url_path* relative to the site root,
+        with a trailing slash for directory paths, or None if it's
+        outside the site."""
+        base_path = self.server.base_path
+        if not url_path.startswith(base_path):
+            return None
+        rel_path = posixpath.normpath('/' + url_path[len(base_path):]).lstrip('/')
+        if rel_path.startswith('..'):
+            return None
+        if rel_path == '.':
+            rel_path = ''
+        if rel_path and url_path.endswith('/'):
+            rel_path += '/'
+        return rel_path
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if (self.server.live_reload is not None
+                and self.get_rel_path(url.path) == LIVE_RELOAD_PATH):
+            self.send_events(parse_qs(url.query).get('path', [''])[0])
+            return
+        return SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_events(self, page_path):
+        """Streams server-sent events to the page at *page_path*, until
+        the client disconnects or the hub is closed."""
+        rel_path = self.get_rel_path(page_path)
+        if rel_path is not None and (not rel_path or rel_path.endswith('/')):
+            rel_path += DEFAULT_INDEX
+        hub = self.server.live_reload
+        events = hub.subscribe(rel_path)
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(b'retry: 1000\n\n')
+            self.wfile.flush()
+            while not hub.closed:
+                try:
+                    event = events.get(timeout=LIVE_RELOAD_KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    if event is None:
+                        break
+                    self.wfile.write(('event: %s\ndata: %s\n\n'
+                                      % (event, rel_path)).encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the page closed or reloaded
+        finally:
+            hub.unsubscribe(events)
+        return
+
+    def send_head(self):
+        url_path = unquote(urlsplit(self.path).path)
+        rel_path = self.get_rel_path(url_path)
+        if rel_path is None:
+            self.send_error(404, 'File not found')
+            return None
+        is_dir_path = not rel_path or rel_path.endswith('/')
+        rel_path = rel_path.rstrip('/')
+        index_path = posixpath.join(rel_path, DEFAULT_INDEX)
+
+        outputs = self.server.outputs
+        if outputs is not None:
+            if is_dir_path:
+                output = outputs.get(index_path)
+                if output is not None:
+                    return self.send_output(index_path, output)
+            else:
+                output = outputs.get(rel_path)
+                if output is not None:
+                    return self.send_output(rel_path, output)
+                if outputs.has_dir(rel_path):
+                    return self.send_dir_redirect(url_path)
+
+        fs_path = self.server.get_fs_path(rel_path)
+        if fs_path is not None and os.path.isdir(fs_path):
+            if not is_dir_path:
+                return self.send_dir_redirect(url_path)
+            fs_path = os.path.join(fs_path, DEFAULT_INDEX)
+        if fs_path is None or not os.path.isfile(fs_path):
+            self.send_error(404, 'File not found')
+            return None
+        return self.send_file(fs_path)
+
+    def send_dir_redirect(self, url_path):
+        self.send_response(301)
+        self.send_header('Location', url_path + '/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return None
+
+    def is_not_modified(self, etag, mtime=None):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return '*' in tags or etag in [t[2:] if t.startswith('W/') else t
+                                          for t in tags]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if mtime is not None and if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return None
+
+    def send_output(self, rel_path, output):
+        outputs = self.server.outputs
+        data, etag = output
+        compressor = outputs.get_compressor(self.headers.get('Accept-Encoding'))
+        if compressor is not None:
+            etag = etag[:-1] + '-' + compressor.encoding + '"'  # one per representation
+        if self.is_not_modified(etag):
+            return self.send_not_modified(etag)
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(rel_path))
+        if compressor is not None:
+            data = outputs.get_variant(rel_path, output, compressor)
+            self.send_header('Content-Encoding', compressor.encoding)
+        if outputs.compressors:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.write_body(data)
+        return None
+
+    def send_file(self, fs_path):
+        # serve a precompressed variant (see build.compress) if the
+        # client accepts one
+        accept_encoding = self.headers.get('Accept-Encoding')
+        variant_path, encoding = get_encoded_variant(fs_path, accept_encoding)
+        try:
+            f = open(variant_path or fs_path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+            return None
+        try:
+            fstat = os.fstat(f.fileno())
+            etag = get_file_etag(fstat)
+            if self.is_not_modified(etag, fstat.st_mtime):
+                f.close()
+                return self.send_not_modified(etag)
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(fs_path))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+                self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', str(fstat.st_size))
+            self.send_header('Last-Modified', self.date_time_string(fstat.st_mtime))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+        except Exception:
+            f.close()
+            raise
+        return f
+
+    def write_body(self, data):
+        if self.command == 'HEAD':
+            return
+        for i in range(0, len(data), _COPY_CHUNK_SIZE):
+            self.wfile.write(data[i:i + _COPY_CHUNK_SIZE])
+        return
+
+
+class DevServer(ThreadingMixIn, HTTPServer):
+    """Serves *outputs* (a :class:`MemoryOutputs`, or None), falling
+    back to *static_dirs*, a list of (url_prefix, dir_path) pairs,
+    e.g., ``[('css', '/path/to/theme/css')]``. A prefix of ``''``
+    maps the whole site, as when serving the output directory from
+    disk. With *live_reload*, a :class:`LiveReloadHub`, pages can
+    subscribe to reload events.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, outputs=None, static_dirs=None,
+                 base_path='/', live_reload=None,
+                 handler_type=DevRequestHandler):
+        self.outputs = outputs
+        self.live_reload = live_reload
+        self.static_dirs = list(static_dirs or [])
+        if not base_path.endswith('/'):
+            base_path += '/'
+        self.base_path = base_path
+        HTTPServer.__init__(self, server_address, handler_type)
+
+    def get_fs_path(self, rel_path):
+        "Returns the filesystem path for *rel_path*, or None."
+        for prefix, dir_path in self.static_dirs:
+            if not prefix:
+                return os.path.join(dir_path, *rel_path.split('/'))
+            if rel_path == prefix or rel_path.startswith(prefix + '/'):
+                sub_path = rel_path[len(prefix):].lstrip('/')
+                return os.path.join(dir_path, *sub_path.split('/'))
+        return None
@@ -1,10 +1,67 @@
 """
 File Access Layer
 """
+import os
+import stat
+import errno
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from boltons.fileutils import mkdir_p
+
+_DIGEST_CHUNK_SIZE = 64 * 1024
+DEFAULT_WRITE_WORKERS = 8
+
+
+def _get_umask():
+    ret = os.umask(0)
+    os.umask(ret)
+    return ret
+
+
+_NEW_FILE_MODE = 0o666 & ~_get_umask()
+
+
+def get_file_hash(path):
+    "Returns the hex sha256 digest of the file at *path*."
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_DIGEST_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 class ChertFAL(object):
-    def __init__(self, logger):
+    """With *skip_unchanged*, writes of bytes identical to the file
+    already on disk are skipped, leaving its mtime alone. All other
+    writes go to a temporary file renamed into place, so readers never
+    see a partially-written file.
+    """
+    def __init__(self, logger, skip_unchanged=True):
         # relative path for pprinting
         self.logger = logger
+        self.skip_unchanged = skip_unchanged
+        self._count_lock = threading.Lock()
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.written_count = self.written_bytes = 0
+        self.skipped_count = self.skipped_bytes = 0
+        self.removed_count = 0
+        # for the dev server's live reload
+        self.written_paths, self.removed_paths = set(), set()
+
+    def makedirs(self, dir_path):
+        mkdir_p(dir_path)
+
+    def get_counts(self):
+        return {'written_count': self.written_count,
+                'written_bytes': self.written_bytes,
+                'skipped_count': self.skipped_count,
+                'skipped_bytes': self.skipped_bytes}
 
     def read(self, path, level='debug'):
         level_method = getattr(self.logger, level)
@@ -14,15 +71,253 @@ class ChertFAL(object):
             rec.success('read {data_len} bytes from {path}', data_len=len(ret))
         return ret
 
-    def write(self, path, data, level='debug', encoding='utf-8'):
+    def is_unchanged(self, path, data):
+        "Whether the file at *path* already contains the bytes *data*."
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            return get_file_hash(path) == hashlib.sha256(data).hexdigest()
+        except OSError:
+            return False
+
+    def write(self, path, data, level='debug', encoding='utf-8',
+              skip_unchanged=None):
         level_method = getattr(self.logger, level)
+        if skip_unchanged is None:
+            skip_unchanged = self.skip_unchanged
         with level_method('write file {path}', path=path) as rec:
             if isinstance(data, str):
                 output_bytes = data.encode(encoding)
             else:
                 output_bytes = data
-            with open(path, 'wb') as f:
-                f.write(output_bytes)
+            if skip_unchanged and self.is_unchanged(path, output_bytes):
+                with self._count_lock:
+                    self.skipped_count += 1
+                    self.skipped_bytes += len(output_bytes)
+                rec.success('skipped writing unchanged {path}')
+                return
+            _atomic_write(path, output_bytes)
+            with self._count_lock:
+                self.written_count += 1
+                self.written_bytes += len(output_bytes)
+                self.written_paths.add(path)
             rec.success('wrote {data_len} bytes to {path}',
                         data_len=len(output_bytes))
         return
+
+    def remove(self, path, level='debug'):
+        "Removes the file at *path*, returning False if there was none."
+        level_method = getattr(self.logger, level)
+        with level_method('remove file {path}', path=path) as rec:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                rec.success('no file to remove at {path}')
+                return False
+            with self._count_lock:
+                self.removed_count += 1
+                self.removed_paths.add(path)
+        return True
+
+    def sync_tree(self, src_dir, dest_dir, hardlink=False, check_hash=False,
+                  keep=None, level='debug'):
+        """Makes *dest_dir* a copy of *src_dir*, copying only files
+        that differ by size and mtime (or with *check_hash*, by size
+        and content), and removing files and directories not present
+        in *src_dir*, except files for which *keep*, called with their
+        relative path, returns True. With *hardlink*, files are linked
+        rather than copied where the filesystem allows it. Returns a
+        dict of counts.
+        """
+        level_method = getattr(self.logger, level)
+        counts = {'copied_count': 0, 'linked_count': 0,
+                  'skipped_count': 0, 'removed_count': 0}
+        with level_method('sync {src_dir} to {dest_dir}',
+                          src_dir=src_dir, dest_dir=dest_dir) as rec:
+            src_rel_paths = set()
+            for cur_dir, dirnames, filenames in os.walk(src_dir):
+                rel_dir = os.path.relpath(cur_dir, src_dir)
+                mkdir_p(os.path.normpath(os.path.join(dest_dir, rel_dir)))
+                for dn in dirnames:
+                    src_rel_paths.add(os.path.normpath(os.path.join(rel_dir, dn)))
+                for fn in filenames:
+                    rel_path = os.path.normpath(os.path.join(rel_dir, fn))
+                    src_rel_paths.add(rel_path)
+                    src_path = os.path.join(src_dir, rel_path)
+                    dest_path = os.path.join(dest_dir, rel_path)
+                    if _is_synced(src_path, dest_path, check_hash):
+                        counts['skipped_count'] += 1
+                        continue
+                    if hardlink and _link_file(src_path, dest_path):
+                        counts['linked_count'] += 1
+                        continue
+                    hardlink = False  # cross-device, or not supported
+                    copy_file(src_path, dest_path)
+                    counts['copied_count'] += 1
+
+            for cur_dir, dirnames, filenames in os.walk(dest_dir, topdown=False):
+                rel_dir = os.path.relpath(cur_dir, dest_dir)
+                for name in filenames + dirnames:
+                    rel_path = os.path.normpath(os.path.join(rel_dir, name))
+                    if rel_path in src_rel_paths:
+                        continue
+                    dest_path = os.path.join(dest_dir, rel_path)
+                    if keep is not None and keep(rel_path):
+                        # its directory is kept too, being in the source
+                        continue
+                    if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                        os.rmdir(dest_path)  # contents already removed
+                    else:
+                        os.unlink(dest_path)
+                    counts['removed_count'] += 1
+            for key, value in counts.items():
+                rec[key] = value
+            rec.success('synced {src_dir} to {dest_dir}: copied {copied_count},'
+                        ' linked {linked_count}, skipped {skipped_count},'
+                        ' removed {removed_count}')
+        return counts
+
+
+def _is_synced(src_path, dest_path, check_hash=False):
+    try:
+        src_stat, dest_stat = os.stat(src_path), os.lstat(dest_path)
+    except OSError:
+        return False
+    if not stat.S_ISREG(dest_stat.st_mode):
+        return False
+    if (src_stat.st_ino, src_stat.st_dev) == (dest_stat.st_ino, dest_stat.st_dev):
+        return True  # hardlinked
+    if src_stat.st_size != dest_stat.st_size:
+        return False
+    if check_hash:
+        return get_file_hash(src_path) == get_file_hash(dest_path)
+    return src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+
+
+def _get_tmp_path(dest_path):
+    dir_path, filename = os.path.split(os.path.abspath(dest_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.' + filename,
+                                    suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+
+def _link_file(src_path, dest_path):
+    "Hardlinks *src_path* into place, returning False if not possible."
+    tmp_path = _get_tmp_path(dest_path)
+    os.unlink(tmp_path)  # only reserved the name
+    try:
+        os.link(src_path, tmp_path)
+    except OSError as ose:
+        if ose.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            return False
+        raise
+    try:
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        _try_unlink(tmp_path)
+        raise
+    return True
+
+
+def copy_file(src_path, dest_path):
+    "Copies *src_path*, with its mtime, into place atomically."
+    tmp_path = _get_tmp_path(dest_path)
+    try:
+        shutil.copy2(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        _try_unlink(tmp_path)
+        raise
+    return
+
+
+def _try_unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class WriterPool(object):
+    """Issues :meth:`ChertFAL.write` calls from a pool of *workers*
+    threads, for when writes are latency-bound (slow disks, network
+    filesystems). Once *max_pending* writes are queued, :meth:`write`
+    blocks until one finishes, bounding the memory held by queued
+    data. Directory creation is done once per directory.
+
+    Failed writes are logged by the FAL as they happen, and collected
+    in *errors* as (path, exception) pairs. Use as a context manager;
+    on exit, all writes are finished, and the first error, if any, is
+    raised.
+    """
+    def __init__(self, fal, workers=DEFAULT_WRITE_WORKERS, max_pending=None):
+        self.fal = fal
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or self.workers * 4
+        self.errors = []
+        self._made_dirs = set()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='chert-write')
+
+    def makedirs(self, dir_path):
+        if dir_path in self._made_dirs:
+            return
+        self.fal.makedirs(dir_path)
+        self._made_dirs.add(dir_path)
+
+    def write(self, path, data, **kw):
+        self.makedirs(os.path.dirname(path))
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._write, path, data, kw)
+        except Exception:
+            self._slots.release()
+            raise
+        return
+
+    def remove(self, path, **kw):
+        # quick enough not to need a thread
+        return self.fal.remove(path, **kw)
+
+    def _write(self, path, data, kw):
+        try:
+            self.fal.write(path, data, **kw)
+        except Exception as e:
+            self.errors.append((path, e))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._executor.shutdown(wait=True)
+            return
+        self.close()
+
+
+def _atomic_write(path, data):
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = _NEW_FILE_MODE
+    dir_path, filename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.' + filename,
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except Exception:
+        _try_unlink(tmp_path)
+        raise
+    return
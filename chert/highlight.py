@@ -0,0 +1,217 @@
+"""
+Caching for the Pygments syntax highlighting of Markdown code blocks.
+
+Python-Markdown highlights both indented and fenced code blocks by
+creating a CodeHilite per block, which looks up (or guesses) a lexer
+and runs Pygments every time. With the extension returned by
+get_caching_extension(), CachingCodeHilite returns results from a
+HighlightCache instead, keyed by the code, its language, and all the
+lexer/formatter options, so a block is only highlighted once per
+style, no matter how many entries or builds it appears in.
+"""
+import json
+from collections import OrderedDict
+
+from markdown.extensions import codehilite, fenced_code
+from markdown.extensions.attr_list import AttrListExtension, get_attrs_and_remainder
+from markdown.extensions.codehilite import (CodeHilite,
+                                            CodeHiliteExtension,
+                                            parse_hl_lines)
+
+from .cache import make_key
+
+try:
+    import pygments
+except ImportError:
+    pygments = None
+
+
+DEFAULT_MAX_ENTRIES = 4096
+_PYGMENTS_VERSION = getattr(pygments, '__version__', '')
+
+
+class HighlightCache(object):
+    """An in-memory LRU of up to *max_entries* highlighted blocks,
+    optionally backed by *disk_cache*, a RenderCache, so results
+    persist across processes."""
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, disk_cache=None):
+        self.max_entries = max_entries
+        self.disk_cache = disk_cache
+        self._memory = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get_key(self, src, lang, shebang, options):
+        options = json.dumps(options, sort_keys=True, default=repr)
+        return make_key(_PYGMENTS_VERSION, src, lang or '',
+                        'shebang' if shebang else '', options)
+
+    def get(self, key, default=None):
+        try:
+            ret = self._memory[key]
+        except KeyError:
+            pass
+        else:
+            self._memory.move_to_end(key)
+            self.hit_count += 1
+            return ret
+        disk_cache = self.disk_cache
+        if disk_cache is not None and disk_cache.enabled:
+            ret = disk_cache.get(key)
+            if ret is not None:
+                self._put_memory(key, ret['html'])
+                self.hit_count += 1
+                return ret['html']
+        self.miss_count += 1
+        return default
+
+    def put(self, key, html):
+        self._put_memory(key, html)
+        disk_cache = self.disk_cache
+        if disk_cache is not None and disk_cache.enabled:
+            disk_cache.put(key, {'html': html})
+        return
+
+    def _put_memory(self, key, html):
+        memory = self._memory
+        memory[key] = html
+        memory.move_to_end(key)
+        while len(memory) > self.max_entries:
+            memory.popitem(last=False)
+        return
+
+    def clear(self):
+        self._memory.clear()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s entries=%r hits=%r misses=%r>'
+                % (cn, len(self), self.hit_count, self.miss_count))
+
+
+class CachingCodeHilite(CodeHilite):
+    """A CodeHilite that consults the HighlightCache passed as the
+    *hilite_cache* option, and otherwise behaves exactly like its
+    parent."""
+    def __init__(self, src, **options):
+        self.hilite_cache = options.pop('hilite_cache', None)
+        super(CachingCodeHilite, self).__init__(src, **options)
+
+    def hilite(self, shebang=True):
+        cache = self.hilite_cache
+        if cache is None:
+            return super(CachingCodeHilite, self).hilite(shebang)
+        formatter = self.pygments_formatter
+        if not isinstance(formatter, str):
+            formatter = '%s.%s' % (formatter.__module__, formatter.__name__)
+        options = dict(self.options,
+                       _guess_lang=self.guess_lang,
+                       _use_pygments=self.use_pygments,
+                       _lang_prefix=self.lang_prefix,
+                       _formatter=formatter)
+        key = cache.get_key(self.src, self.lang, shebang, options)
+        ret = cache.get(key)
+        if ret is None:
+            ret = super(CachingCodeHilite, self).hilite(shebang)
+            cache.put(key, ret)
+        return ret
+
+
+class CachingHiliteTreeprocessor(codehilite.HiliteTreeprocessor):
+    "Highlights indented code blocks like its parent, with CachingCodeHilite."
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) != 1 or block[0].tag != 'code':
+                continue
+            text = block[0].text
+            if text is None:
+                continue
+            local_config = self.config.copy()
+            code = CachingCodeHilite(self.code_unescape(text),
+                                     tab_length=self.md.tab_length,
+                                     style=local_config.pop('pygments_style', 'default'),
+                                     **local_config)
+            placeholder = self.md.htmlStash.store(code.hilite())
+            # the p is replaced by the stashed html on output
+            block.clear()
+            block.tag = 'p'
+            block.text = placeholder
+        return
+
+
+class CachingFencedBlockPreprocessor(fenced_code.FencedBlockPreprocessor):
+    """Highlights fenced code blocks like its parent, with
+    CachingCodeHilite. Blocks which aren't highlighted with Pygments
+    are left to the parent."""
+    def run(self, lines):
+        if not self.checked_for_deps:
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, CodeHiliteExtension):
+                    self.codehilite_conf = ext.getConfigs()
+                if isinstance(ext, AttrListExtension):
+                    self.use_attr_list = True
+            self.checked_for_deps = True
+        hilite_conf = self.codehilite_conf
+        if not hilite_conf or not hilite_conf['use_pygments']:
+            return super(CachingFencedBlockPreprocessor, self).run(lines)
+
+        text = '\n'.join(lines)
+        index = 0
+        while True:
+            match = self.FENCED_BLOCK_RE.search(text, index)
+            if not match:
+                break
+            lang, classes, config = None, [], {}
+            if match.group('attrs'):
+                attrs, remainder = get_attrs_and_remainder(match.group('attrs'))
+                if remainder:  # not an attribute list, skip past it
+                    index = match.end('attrs')
+                    continue
+                _, classes, config = self.handle_attrs(attrs)
+                if classes:
+                    lang = classes.pop(0)
+            else:
+                lang = match.group('lang') or None
+                if match.group('hl_lines'):
+                    config['hl_lines'] = parse_hl_lines(match.group('hl_lines'))
+            if config.get('use_pygments', True):
+                local_config = hilite_conf.copy()
+                local_config.update(config)
+                if classes:
+                    # css_class last, as Pygments may add suffixes
+                    local_config['css_class'] = '%s %s' % (' '.join(classes),
+                                                           local_config['css_class'])
+                code = CachingCodeHilite(match.group('code'), lang=lang,
+                                         style=local_config.pop('pygments_style', 'default'),
+                                         **local_config)
+                block_text = '\n%s\n' % self.md.htmlStash.store(code.hilite(shebang=False))
+            else:
+                parent = super(CachingFencedBlockPreprocessor, self)
+                block_text = '\n'.join(parent.run(match.group(0).split('\n')))
+            text = text[:match.start()] + block_text + text[match.end():]
+            index = match.start() + len(block_text) - 1
+        return text.split('\n')
+
+
+class CachingCodeHiliteExtension(CodeHiliteExtension):
+    """A CodeHiliteExtension whose processors highlight through the
+    HighlightCache passed as *hilite_cache*. Fenced code blocks are
+    only cached if the fenced_code extension comes first."""
+    def extendMarkdown(self, md):
+        hiliter = CachingHiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        md.treeprocessors.register(hiliter, 'hilite', 30)
+        if 'fenced_code_block' in md.preprocessors:
+            fenced = md.preprocessors['fenced_code_block']
+            md.preprocessors.register(CachingFencedBlockPreprocessor(md, fenced.config),
+                                      'fenced_code_block', 25)
+        md.registerExtension(self)
+
+
+def get_caching_extension(hilite_ext, hilite_cache):
+    "Returns a copy of the CodeHiliteExtension *hilite_ext* using *hilite_cache*."
+    return CachingCodeHiliteExtension(hilite_cache=hilite_cache,
+                                      **hilite_ext.getConfigs())
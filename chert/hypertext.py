@@ -2,14 +2,24 @@
 
 Largely based on an extraction from python-markdown, but can be run on
 bare HTML (not a python-markdown-based ElementTree).
+
+Parsing and serialization go through an HTML backend: html5lib (the
+default, pure-Python) or lxml (C-backed, used when installed). Trees
+from either backend have an ElementTree-compatible API, which is all
+the transforms in this module rely on.
 """
 import re
-from xml.etree import cElementTree as ET
 
 import html5lib
 from hyperlink import URL
 from boltons.strutils import slugify
 
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
 
 _rel_link_re = re.compile(r'(?P<attribute>src|href)'
                           r'='
@@ -22,67 +32,360 @@ def remove_marker(text, marker='[TOC]'):
     return text.replace(marker, '', 1)
 
 
-def html_text_to_tree(html_text):
-    return html5lib.parse(html_text, namespaceHTMLElements=False)
+class HTML5LibBackend(object):
+    name = 'html5lib'
+
+    def __init__(self):
+        options = {'quote_attr_values': 'always',
+                   'use_trailing_solidus': True,
+                   'space_before_trailing_solidus': True}
+        self.serializer = html5lib.serializer.HTMLSerializer(**options)
+        self.walker = html5lib.getTreeWalker('etree')
+
+    def parse(self, html_text):
+        return html5lib.parse(html_text, namespaceHTMLElements=False)
+
+    def serialize(self, html_tree):
+        stream = self.serializer.serialize(self.walker(html_tree))
+        return u''.join(stream)
+
+
+class LXMLBackend(object):
+    """libxml2-based parsing and serialization. Not an HTML5 parser, so
+    severely malformed markup (e.g., misnested formatting elements)
+    may be repaired differently than html5lib would, but well-formed
+    HTML round-trips to equivalent output."""
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError('the lxml HTML backend requires lxml')
+
+    def parse(self, html_text):
+        if not html_text.strip():
+            html_text = '<html><head></head><body></body></html>'
+        return lxml.html.document_fromstring(html_text)
+
+    def serialize(self, html_tree):
+        # like html5lib, omit the html, head, and body tags when they
+        # carry no information
+        if html_tree.tag != 'html' or html_tree.attrib or html_tree.text:
+            return lxml.html.tostring(html_tree, encoding='unicode')
+        parts = []
+        for section in html_tree:
+            if section.tag not in ('head', 'body') or section.attrib:
+                return lxml.html.tostring(html_tree, encoding='unicode')
+            parts.append(section.text or '')
+            parts.extend([lxml.html.tostring(el, encoding='unicode')
+                          for el in section])
+        return u''.join(parts)
+
+
+HTML_BACKENDS = {'html5lib': HTML5LibBackend,
+                 'lxml': LXMLBackend}
+_BACKEND_INSTANCES = {}
+
+
+def get_html_backend(name='auto'):
+    """Returns the HTML backend registered under *name*. 'auto' picks
+    lxml when it is installed, falling back to html5lib."""
+    if name in (None, 'auto'):
+        name = 'lxml' if lxml is not None else 'html5lib'
+    try:
+        return _BACKEND_INSTANCES[name]
+    except KeyError:
+        pass
+    try:
+        backend_type = HTML_BACKENDS[name]
+    except KeyError:
+        raise ValueError('expected HTML backend to be one of %r, not: %r'
+                         % (sorted(HTML_BACKENDS) + ['auto'], name))
+    ret = _BACKEND_INSTANCES[name] = backend_type()
+    return ret
+
+
+def html_text_to_tree(html_text, backend=None):
+    if not hasattr(backend, 'parse'):
+        backend = get_html_backend(backend)
+    return backend.parse(html_text)
+
+
+def html_tree_to_text(html_tree, backend=None):
+    "Serializes *html_tree* with *backend*, by default the one that parsed it."
+    if backend is None:
+        is_lxml = lxml is not None and isinstance(html_tree, lxml.etree._Element)
+        backend = get_html_backend('lxml' if is_lxml else 'html5lib')
+    elif not hasattr(backend, 'serialize'):
+        backend = get_html_backend(backend)
+    return backend.serialize(html_tree)
+
+
+def _sub_element(parent, tag):
+    # makeelement keeps new elements the same type as the tree's
+    ret = parent.makeelement(tag, {})
+    parent.append(ret)
+    return ret
+
+
+class DOMTransform(object):
+    """Base class for tree transforms run by :class:`DOMPipeline`.
+
+    *tags* is a collection of the element tags the transform wants to
+    visit, or None for every element. :meth:`start` is called before
+    each document's walk, :meth:`visit` with each matching element and
+    its parent, and :meth:`finish` after the walk. :meth:`finish` may
+    return a list of elements it added to the tree, which are then
+    visited by the transforms that come after it in the pipeline.
+    """
+    tags = None
+
+    def start(self, html_tree):
+        pass
+
+    def visit(self, el, parent):
+        pass
+
+    def finish(self, html_tree):
+        return None
+
+
+class DOMPipeline(object):
+    """Runs any number of :class:`DOMTransform` instances over a tree
+    in a single walk. Elements are dispatched by their tag at the time
+    they are reached, and children are read after their parent is
+    visited, so transforms may restructure the element they are
+    visiting."""
+    def __init__(self, transforms=()):
+        self.transforms = list(transforms)
+
+    def _get_dispatch(self, transforms):
+        tag_map, all_tags = {}, []
+        for transform in transforms:
+            if transform.tags is None:
+                all_tags.append(transform)
+                for tag_transforms in tag_map.values():
+                    tag_transforms.append(transform)
+                continue
+            for tag in transform.tags:
+                tag_map.setdefault(tag, list(all_tags)).append(transform)
+        return tag_map, all_tags
+
+    def _walk(self, root, parent, dispatch):
+        tag_map, all_tags = dispatch
+        stack = [(root, parent)]
+        while stack:
+            el, parent = stack.pop()
+            if isinstance(el.tag, str):
+                for transform in tag_map.get(el.tag, all_tags):
+                    transform.visit(el, parent)
+            stack.extend([(child, el) for child in reversed(el)])
+        return
+
+    def process(self, html_tree):
+        transforms = self.transforms
+        for transform in transforms:
+            transform.start(html_tree)
+        self._walk(html_tree, None, self._get_dispatch(transforms))
+        for i, transform in enumerate(transforms):
+            added = transform.finish(html_tree)
+            later = transforms[i + 1:]
+            if not added or not later:
+                continue
+            dispatch = self._get_dispatch(later)
+            for el in added:
+                self._walk(el, None, dispatch)
+        return html_tree
 
 
-def html_tree_to_text(html_tree):
-    options = {'quote_attr_values': 'always',
-               'use_trailing_solidus': True,
-               'space_before_trailing_solidus': True}
-    serializer = html5lib.serializer.HTMLSerializer(**options)
-    walker = html5lib.getTreeWalker('etree')
-    stream = serializer.serialize(walker(html_tree))
-    return u''.join(stream)
+def canonicalize_link(link, domain, filename):
+    "returns the canonical version of a single href/src *link*"
+    # does allow '..' links etc., even though they're probably errors
+    # rule out already canonical URLs
+    # TODO: switch to better URL check
+    if link.startswith(domain) or '//' in link[:8]:
+        return link
+    ret = domain
+    if link and link[0] == '#':
+        ret += '/' + filename
+    return ret + link
 
 
 def canonicalize_links(text, domain, filename):
     "turns links into canonical links for feed links"
-    # does allow '..' links etc., even though they're probably errors
-    # TODO: port to use the html_tree
 
     def _replace_rel_link(match):
-        ret = ''
         mdict = match.groupdict()
         relpath = mdict['relpath']
-        # rule out already canonical URLs
-        # TODO: switch to better URL check
-        if relpath.startswith(domain) or '//' in relpath[:8]:
+        new_relpath = canonicalize_link(relpath, domain, filename)
+        if new_relpath == relpath:
             return match.group(0)
-
-        ret += mdict['attribute']
-        ret += '='
-        ret += mdict['quote']
-        ret += domain
-        if relpath and relpath[0] == '#':
-            ret += '/'
-            ret += filename
-        ret += relpath
-        ret += mdict['quote']
-        return ret
+        return (mdict['attribute'] + '=' + mdict['quote']
+                + new_relpath + mdict['quote'])
 
     return _rel_link_re.sub(_replace_rel_link, text)
 
 
+def canonicalize_tree_links(html_tree, domain, filename):
+    "canonicalize_links, but for an html_tree, in-place"
+    DOMPipeline([LinkCanonicalizer(domain, filename)]).process(html_tree)
+    return
+
+
+class LinkCanonicalizer(DOMTransform):
+    def __init__(self, domain, filename):
+        self.domain = domain
+        self.filename = filename
+
+    def visit(self, el, parent):
+        for attr in ('href', 'src'):
+            link = el.get(attr)
+            if link is None or any(c.isspace() for c in link):
+                continue  # as with the regex, links with spaces are skipped
+            el.set(attr, canonicalize_link(link, self.domain, self.filename))
+        return
+
+
+def inline_code_styles(html_tree, style_map, css_class='codehilite',
+                       div_style='', pre_style=''):
+    """Replaces the classes on syntax-highlighted code spans with inline
+    styles, for contexts without the site stylesheet, like feeds.
+
+    *style_map* maps span classes to style strings (see
+    :func:`get_inline_code_style_kw`). Like Pygments' own inline mode, a
+    span with several classes gets the style of the most specific one.
+    """
+    inliner = CodeStyleInliner(style_map, css_class=css_class,
+                               div_style=div_style, pre_style=pre_style)
+    DOMPipeline([inliner]).process(html_tree)
+    return
+
+
+class CodeStyleInliner(DOMTransform):
+    "The transform behind :func:`inline_code_styles`."
+    tags = ('div',)
+
+    def __init__(self, style_map, css_class='codehilite',
+                 div_style='', pre_style=''):
+        self.style_map = style_map
+        self.css_class = css_class
+        self.div_style = div_style
+        self.pre_style = pre_style
+
+    def visit(self, div_el, parent):
+        if self.css_class not in (div_el.get('class') or '').split():
+            return
+        if self.div_style:
+            div_el.set('style', self.div_style)
+        for parent_el in list(div_el.iter()):
+            if parent_el.tag == 'pre' and self.pre_style:
+                parent_el.set('style', self.pre_style)
+            for el in list(parent_el):
+                if el.tag != 'span' or not el.get('class'):
+                    continue
+                classes = el.attrib.pop('class').split()
+                for cls in reversed(classes):
+                    style = self.style_map.get(cls)
+                    if style:
+                        el.set('style', style)
+                        break
+                else:
+                    _unwrap_element(parent_el, el)
+            _merge_styled_spans(parent_el)
+        return
+
+
+def _merge_styled_spans(parent_el):
+    """Merges runs of adjacent, childless spans with the same style, as
+    Pygments does for consecutive tokens in its inline mode."""
+    prev_el = None
+    for el in list(parent_el):
+        if (prev_el is not None and el.tag == 'span' and len(el) == 0
+                and not prev_el.tail and el.get('style')
+                and el.attrib == prev_el.attrib):
+            prev_el.text = (prev_el.text or '') + (el.text or '')
+            prev_el.tail = el.tail
+            parent_el.remove(el)
+            continue
+        prev_el = el if (el.tag == 'span' and len(el) == 0) else None
+    return
+
+
+def _unwrap_element(parent_el, el):
+    "Replaces *el* with its text and children, keeping its tail."
+    idx = list(parent_el).index(el)
+    text = (el.text or '')
+    children = list(el)
+    if children:
+        children[-1].tail = (children[-1].tail or '') + (el.tail or '')
+    else:
+        text += (el.tail or '')
+    if idx:
+        prev_el = parent_el[idx - 1]
+        prev_el.tail = (prev_el.tail or '') + text
+    else:
+        parent_el.text = (parent_el.text or '') + text
+    parent_el.remove(el)
+    for i, child in enumerate(children):
+        parent_el.insert(idx + i, child)
+    return
+
+
+_style_def_re = re.compile(r'^\.(?P<css_class>[\w-]+) \.(?P<span_class>[\w-]+)'
+                           r' \{ (?P<style>[^}]*?);? \}')
+
+
+def get_inline_code_style_kw(style_name, css_class='codehilite'):
+    """Returns keyword arguments for :func:`inline_code_styles` matching
+    the inline output of a Pygments style, or None if Pygments is not
+    installed (in which case code is not highlighted in the first
+    place)."""
+    try:
+        from pygments.formatters.html import HtmlFormatter
+    except ImportError:
+        return None
+    formatter = HtmlFormatter(style=style_name, noclasses=True)
+    style_map = {}
+    for line in formatter.get_style_defs('.' + css_class).splitlines():
+        match = _style_def_re.match(line)
+        if match and match.group('css_class') == css_class:
+            style_map[match.group('span_class')] = match.group('style')
+    div_style = ''
+    if formatter.style.background_color is not None:
+        div_style = 'background: %s' % formatter.style.background_color
+    return {'style_map': style_map,
+            'css_class': css_class,
+            'div_style': div_style,
+            'pre_style': 'line-height: 125%;'}
+
+
 def retarget_links(html_tree, mode='external'):
     if mode == 'none':
         return
-    elif mode not in ('external', 'all'):
-        raise ValueError('expected "none", "external", or "all", not: %r'
-                         % mode)
-    for el in html_tree.iter():
-        if not isinstance(el.tag, str):
-            continue
-        if not el.tag == 'a':
-            continue
+    DOMPipeline([LinkRetargeter(mode)]).process(html_tree)
+    return
+
+
+class LinkRetargeter(DOMTransform):
+    "The transform behind :func:`retarget_links`."
+    tags = ('a',)
+
+    def __init__(self, mode='external'):
+        if mode not in ('none', 'external', 'all'):
+            raise ValueError('expected "none", "external", or "all", not: %r'
+                             % mode)
+        self.mode = mode
+
+    def visit(self, el, parent):
+        if self.mode == 'none':
+            return
         if el.get('target'):
-            continue  # let explicit settings lie
+            return  # let explicit settings lie
         href = el.get('href')
         if not href or href.startswith('#'):
-            continue
-        if mode == 'all':
+            return
+        if self.mode == 'all':
             retarget = True
-        elif mode == 'external':
+        else:
             try:
                 url = URL.from_text(href)
             except ValueError:
@@ -92,7 +395,7 @@ def retarget_links(html_tree, mode='external'):
         if retarget:
             el.set('target', '_blank')
             el.set('rel', 'noopener')
-    return
+        return
 
 
 def add_toc(html_tree, marker='[TOC]', title='Contents',
@@ -116,12 +419,12 @@ def add_toc(html_tree, marker='[TOC]', title='Contents',
     return html_tree
 
 
-class TOCifier(object):
+class TOCifier(DOMTransform):
     id_count_re = re.compile(r'^(.*)_([0-9]+)$')
     header_re = re.compile("[Hh][123456]")
 
-    def __init__(self, html_tree, marker, title, base_header_level=1,
-                 make_anchor_id=slugify):
+    def __init__(self, html_tree=None, marker='[TOC]', title='Contents',
+                 base_header_level=1, make_anchor_id=slugify):
         self.html_tree = html_tree
         self.marker = marker
         self.title = title
@@ -134,83 +437,83 @@ class TOCifier(object):
         return cls(html_tree=html_tree, **kw)
 
     def process(self):
-        self.root = self.html_tree
+        DOMPipeline([self]).process(self.html_tree)
+        return
+
+    def start(self, html_tree):
+        self.root = html_tree
         self.used_id_set = set()
+        self.id_nums = {}
+        self.h_tokens = []
+        self.marker_loc = None
+
+    def visit(self, el, parent):
+        if self.header_re.match(el.tag):
+            self.visit_header(el)
+            return
+        if parent is None or self.marker_loc is not None or not self.marker:
+            return
+        if el.tag in ('pre', 'code'):
+            return
+        # We do not allow the marker inside a header as that
+        # would causes an enless loop of placing a new TOC
+        # inside previously generated TOC.
+        if el.text and el.text.strip() == self.marker:
+            self.marker_loc = (parent, el)
+        return
 
-        h_tokens = []
-        for el in self.root.iter():
-            if not isinstance(el.tag, str):
-                continue
-            h_match = self.header_re.match(el.tag)
-            if not h_match:
-                continue
-            # TODO: tocskip in class
-            self.set_header_level(el)
-
-            header_text = ''.join(el.itertext()).strip()
-            if not el.attrib.get('id'):
-                slug = self.make_anchor_id(header_text)
-                el.attrib['id'] = self.get_unique_id(slug)
-
-            h_tokens.append({'level': int(el.tag[-1]),
-                             'id': el.attrib['id'],
-                             'text': header_text})
-            self.anchorize_header(el)
-        h_token_tree = nest_h_tokens(h_tokens)
+    def visit_header(self, el):
+        # TODO: tocskip in class
+        self.set_header_level(el)
+
+        header_text = ''.join(el.itertext()).strip()
+        if el.attrib.get('id'):
+            self.used_id_set.add(el.attrib['id'])
+        else:
+            slug = self.make_anchor_id(header_text)
+            el.attrib['id'] = self.get_unique_id(slug)
+
+        self.h_tokens.append({'level': int(el.tag[-1]),
+                              'id': el.attrib['id'],
+                              'text': header_text})
+        self.anchorize_header(el)
+
+    def finish(self, html_tree):
+        if self.marker_loc is None:
+            return None  # no marker found
+        h_token_tree = nest_h_tokens(self.h_tokens)
         toc_div_el = self.build_toc_div(h_token_tree)
-        if self.marker:
-            self.replace_marker(toc_div_el)
-        return
+        self.replace_marker(toc_div_el)
+        return [toc_div_el]
 
     def replace_marker(self, elem):
         ''' Replace marker with elem. '''
-        pc_pairs = ((parent, child)
-                    for parent in self.root.iter()
-                    for child in parent)
-        for (p, c) in pc_pairs:
-            if not isinstance(c.tag, str):
-                continue
-            if c.tag in ('pre', 'code'):
-                continue
-            if self.header_re.match(c.tag):
-                continue
-            text = ''.join(c.itertext()).strip()
-            if not text:
-                continue
-
-            # To keep the output from screwing up the
-            # validation by putting a <div> inside of a <p>
-            # we actually replace the <p> in its entirety.
-            # We do not allow the marker inside a header as that
-            # would causes an enless loop of placing a new TOC
-            # inside previously generated TOC.
-            if c.text and c.text.strip() == self.marker:
-                for i in range(len(p)):
-                    if p[i] == c:
-                        p[i] = elem
-                        # add TOC a maximum of once
-                        return
-
-        # no marker found
+        # To keep the output from screwing up the
+        # validation by putting a <div> inside of a <p>
+        # we actually replace the <p> in its entirety.
+        parent, marker_el = self.marker_loc
+        idx = list(parent).index(marker_el)
+        elem.tail = marker_el.tail
+        parent[idx] = elem  # add TOC a maximum of once
         return
 
     def build_toc_div(self, h_token_tree):
         """ Return a string div given a toc list. """
-        div_el = ET.Element("div")
+        div_el = self.root.makeelement("div", {})
         div_el.attrib["class"] = "toc"
 
         # Add title to the div
         if self.title:
-            title_el = ET.SubElement(div_el, "span")
+            title_el = _sub_element(div_el, "span")
             title_el.attrib["class"] = "toctitle"
             title_el.text = self.title
 
         def build_etree_ul(toc_list, parent):
-            ul = ET.SubElement(parent, "ul")
+            ul = _sub_element(parent, "ul")
             for item in toc_list:
                 # List item link, to be inserted into the toc div
-                li = ET.SubElement(ul, "li")
-                link = ET.SubElement(li, "a")
+                li = _sub_element(ul, "li")
+                link = _sub_element(li, "a")
                 link.text = item.get('text', '')
                 link.attrib["href"] = '#' + item.get('id', '')
                 if item['children']:
@@ -221,15 +524,15 @@ class TOCifier(object):
         return div_el
 
     def anchorize_header(self, header_el):
-        anchor_el = ET.Element("a")
+        anchor_el = header_el.makeelement("a", {})
         anchor_el.text = header_el.text
         anchor_el.attrib["href"] = "#" + header_el.attrib['id']
         anchor_el.attrib["class"] = "toclink"
         header_el.text = ""  # blank the header element
         # transfer all header subelements into the anchor
-        for el in header_el:
-            anchor_el.append(el)
+        for el in list(header_el):
             header_el.remove(el)
+            anchor_el.append(el)
         header_el.append(anchor_el)  # put the anchor into the header
         return
 
@@ -242,14 +545,20 @@ class TOCifier(object):
     def get_unique_id(self, id_str):
         """ Ensure id is unique in set of ids. Append '_1', '_2'... if not """
         used_id_set = self.used_id_set
-        while id_str and id_str in used_id_set:
+        if id_str and id_str in used_id_set:
             match = self.id_count_re.match(id_str)
             if match:
-                new_num = int(match.group(2)) + 1
-                id_str = '%s_%d' % (match.group(1), new_num)
+                base_id, num = match.group(1), int(match.group(2))
             else:
-                id_str = '%s_%d' % (id_str, 1)
-            used_id_set.add(id_str)
+                base_id, num = id_str, 0
+            # resume from the last number used for this base, keeping
+            # documents with many repeated headings linear
+            num = max(num, self.id_nums.get(base_id, 0))
+            while id_str in used_id_set:
+                num += 1
+                id_str = '%s_%d' % (base_id, num)
+            self.id_nums[base_id] = num
+        used_id_set.add(id_str)
         return id_str
 
 
@@ -263,22 +572,25 @@ def nest_h_tokens(h_tokens):
     [{'level': 2}, {'level': 1}]
     =>
     [{'level': 2, 'children': []}, {'level': 1, 'children': []}]
+
+    Runs in linear time, as the stacks of levels and parents never
+    grow deeper than the number of distinct heading levels.
     """
-    toc_list = list(h_tokens)
     ordered_list = []
-    if not toc_list:
+    h_tokens = iter(h_tokens)
+    try:
+        last = next(h_tokens)
+    except StopIteration:
         return ordered_list
 
     # Initialize everything by processing the first entry
-    last = toc_list.pop(0)
     last['children'] = []
     levels = [last['level']]
     ordered_list.append(last)
     parents = []
 
     # Walk the rest nesting the entries properly
-    while toc_list:
-        t = toc_list.pop(0)
+    for t in h_tokens:
         current_level = t['level']
         t['children'] = []
 
@@ -288,15 +600,9 @@ def nest_h_tokens(h_tokens):
             levels.pop()
 
             # Pop parents and levels we are less than or equal to
-            to_pop = 0
-            for p in reversed(parents):
-                if current_level <= p['level']:
-                    to_pop += 1
-                else:  # pragma: no cover
-                    break
-            if to_pop:
-                levels = levels[:-to_pop]
-                parents = parents[:-to_pop]
+            while parents and current_level <= parents[-1]['level']:
+                levels.pop()
+                parents.pop()
 
             # Note current level as last
             levels.append(current_level)
@@ -0,0 +1,294 @@
+"""
+Persistent index of entry metadata, in SQLite.
+
+The index maps each entry source path to the file's mtime, size, and
+content hash, along with its parsed headers and a few derived fields
+(tags, publish date, and entry_root). Entries whose files are
+unchanged can be loaded from the index without being read, and custom
+hooks can query it, e.g., for tag counts or entries in a date range.
+
+The index is rebuilt from scratch whenever it fails an integrity
+check, or was written by a different version of chert.
+"""
+import os
+import json
+import sqlite3
+from datetime import date, datetime
+
+from boltons.dictutils import OrderedMultiDict as OMD
+from boltons.timeutils import LocalTZ, UTC
+
+from chert import __version__
+from chert.fal import get_file_hash
+
+
+INDEX_FILENAME = 'entries.sqlite3'
+SCHEMA_VERSION = '1'
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    source_path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    title TEXT,
+    entry_root TEXT,
+    publish_date TEXT,
+    is_draft INTEGER NOT NULL,
+    is_special INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_tags (
+    source_path TEXT NOT NULL REFERENCES entries ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (source_path, tag)
+);
+CREATE INDEX IF NOT EXISTS entry_tags_tag ON entry_tags (tag);
+CREATE INDEX IF NOT EXISTS entries_publish_date ON entries (publish_date);
+'''
+
+
+def _encode_header_value(obj):
+    # YAML loads some unquoted values as dates
+    if isinstance(obj, datetime):
+        return {'$datetime': obj.isoformat()}
+    elif isinstance(obj, date):
+        return {'$date': obj.isoformat()}
+    raise TypeError('unindexable header value: %r' % (obj,))
+
+
+def _decode_header_pairs(pairs):
+    if len(pairs) == 1:
+        key, value = pairs[0]
+        if key == '$datetime':
+            return datetime.fromisoformat(value)
+        elif key == '$date':
+            return date.fromisoformat(value)
+    return OMD(pairs)
+
+
+def dump_headers(headers):
+    return json.dumps(headers, default=_encode_header_value)
+
+
+def load_headers(headers_json):
+    return json.loads(headers_json, object_pairs_hook=_decode_header_pairs)
+
+
+def _to_utc_str(dt):
+    if not dt.tzinfo:
+        dt = dt.replace(tzinfo=LocalTZ)  # as with entry publish dates
+    # fixed-width, so that they sort as strings
+    return dt.astimezone(UTC).isoformat(timespec='microseconds')
+
+
+class EntryIndex(object):
+    """An index stored in the SQLite database at *path*, or kept in
+    memory if *path* is ':memory:', which is still queryable for the
+    current run."""
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.rebuilt = False
+        self.open()
+
+    @property
+    def in_memory(self):
+        return self.path == ':memory:'
+
+    def open(self):
+        if not self.in_memory:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        try:
+            self._connect()
+            is_valid = self.check()
+        except sqlite3.DatabaseError:
+            is_valid = False
+        if not is_valid:
+            self.rebuild()
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def check(self):
+        """Whether the index is intact and was written by this version
+        of chert. New, empty databases are not, until :meth:`rebuild`."""
+        conn = self.conn
+        if conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+            return False
+        tables = set(r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"))
+        if not tables >= set(['meta', 'entries', 'entry_tags']):
+            return False
+        meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+        return (meta.get('schema_version') == SCHEMA_VERSION
+                and meta.get('chert_version') == __version__)
+
+    def rebuild(self):
+        "Discards the index and creates an empty one."
+        self.close()
+        if not self.in_memory:
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                try:
+                    os.unlink(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+        self._connect()
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+            self.conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)',
+                                  [('schema_version', SCHEMA_VERSION),
+                                   ('chert_version', __version__)])
+        self.rebuilt = True
+
+    def _get_row(self, source_path, stat=None, content_hash=None):
+        """Returns the record for *source_path*, if it's current. The
+        file is only hashed if its mtime changed, and no *content_hash*
+        is passed."""
+        row = self.conn.execute('SELECT * FROM entries WHERE source_path = ?',
+                                (source_path,)).fetchone()
+        if row is None:
+            return None
+        if stat is None:
+            stat = os.stat(source_path)
+        if stat.st_size != row['size']:
+            return None
+        if stat.st_mtime_ns != row['mtime_ns']:
+            if content_hash is None:
+                content_hash = get_file_hash(source_path)
+            if content_hash != row['content_hash']:
+                return None
+            with self.conn:
+                self.conn.execute('UPDATE entries SET mtime_ns = ?'
+                                  ' WHERE source_path = ?',
+                                  (stat.st_mtime_ns, source_path))
+        return row
+
+    def is_current(self, source_path, stat=None, content_hash=None):
+        return self._get_row(source_path, stat, content_hash) is not None
+
+    def get_headers(self, source_path, stat=None):
+        """Returns the indexed headers of the entry at *source_path*, or
+        None if it isn't indexed or the file has changed since. Files
+        with a new mtime but the same size are hashed, and, if their
+        content is unchanged, their index record is kept."""
+        row = self._get_row(source_path, stat)
+        if row is None:
+            return None
+        return load_headers(row['headers'])
+
+    def add(self, entry, stat=None, content_hash=None):
+        """Indexes *entry*, replacing any previous record for its
+        source_path. Raises TypeError if its headers can't be stored."""
+        source_path = entry.source_path
+        headers_json = dump_headers(entry.headers)
+        if stat is None:
+            stat = os.stat(source_path)
+        if content_hash is None:
+            content_hash = get_file_hash(source_path)
+        publish_date = None
+        if entry.headers.get('publish_date'):
+            publish_date = _to_utc_str(entry.publish_date)
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE source_path = ?',
+                              (source_path,))
+            self.conn.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (source_path, stat.st_mtime_ns, stat.st_size,
+                               content_hash, headers_json, entry.title,
+                               entry.entry_root, publish_date,
+                               int(bool(entry.headers.get('draft'))),
+                               int(entry.is_special)))
+            # not entry.tags, which would add a tags header
+            self.conn.executemany('INSERT OR IGNORE INTO entry_tags VALUES (?, ?)',
+                                  [(source_path, str(tag)) for tag
+                                   in entry.headers.get('tags') or []])
+        return
+
+    def remove(self, source_path):
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE source_path = ?',
+                              (source_path,))
+
+    def prune(self, source_paths):
+        "Removes records for all paths not in *source_paths*."
+        source_paths = set(source_paths)
+        stale = [p for p in self.get_source_paths() if p not in source_paths]
+        with self.conn:
+            self.conn.executemany('DELETE FROM entries WHERE source_path = ?',
+                                  [(p,) for p in stale])
+        return stale
+
+    def get_source_paths(self):
+        return [r[0] for r in self.conn.execute('SELECT source_path FROM entries'
+                                                ' ORDER BY source_path')]
+
+    def _get_published_clause(self, now=None):
+        # draft status depends on the current time, so it's not stored
+        now = _to_utc_str(now or datetime.now(UTC))
+        return ('(publish_date IS NOT NULL AND publish_date <= ?'
+                ' AND NOT is_draft AND NOT is_special)', [now])
+
+    def get_tag_counts(self, published_only=True):
+        "Returns a dict mapping each tag to its number of entries."
+        query = ('SELECT tag, COUNT(*) FROM entry_tags'
+                 ' JOIN entries USING (source_path)')
+        params = []
+        if published_only:
+            clause, params = self._get_published_clause()
+            query += ' WHERE ' + clause
+        query += ' GROUP BY tag ORDER BY tag'
+        return dict(self.conn.execute(query, params).fetchall())
+
+    def get_entries(self, start=None, end=None, tag=None, published_only=True):
+        """Returns a list of dicts describing indexed entries, newest
+        first, optionally limited to those published in the range
+        [*start*, *end*), or with the tag *tag*. Naive datetimes are
+        taken to be local time."""
+        clauses, params = [], []
+        if published_only:
+            clause, params = self._get_published_clause()
+            clauses.append(clause)
+        if start is not None:
+            clauses.append('publish_date >= ?')
+            params.append(_to_utc_str(start))
+        if end is not None:
+            clauses.append('publish_date < ?')
+            params.append(_to_utc_str(end))
+        if tag is not None:
+            clauses.append('source_path IN'
+                           ' (SELECT source_path FROM entry_tags WHERE tag = ?)')
+            params.append(tag)
+        query = ('SELECT source_path, title, entry_root, publish_date, headers'
+                 ' FROM entries')
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY publish_date DESC, source_path'
+        ret = []
+        for row in self.conn.execute(query, params):
+            publish_date = row['publish_date']
+            if publish_date is not None:
+                publish_date = datetime.fromisoformat(publish_date)
+            headers = load_headers(row['headers'])
+            ret.append({'source_path': row['source_path'],
+                        'title': row['title'],
+                        'entry_root': row['entry_root'],
+                        'publish_date': publish_date,
+                        'tags': list(headers.get('tags') or []),
+                        'headers': headers})
+        return ret
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __repr__(self):
+        return '<%s path=%r>' % (self.__class__.__name__, self.path)
@@ -19,7 +19,8 @@ _part_sep_re = re.compile(b'^---(?:\r\n?|\n)', flags=re.MULTILINE)
 #    entry_types = {}
 
 
-def parse_entry(string, **kwargs):
+def _split_entry(string):
+    "Returns the (headers, body) of an entry bytestring."
     if not string:
         ValueError('expected non-empty string')
     tokens = _part_sep_re.split(string, maxsplit=2)
@@ -35,23 +36,115 @@ def parse_entry(string, **kwargs):
         raise
     if not isinstance(headers, dict):
         raise ValueError('headers must be a YAML dictionary')
+    return headers, body
+
+
+def get_parts_parser(headers):
+    return ENTRY_PARTS_PARSERS.get(headers.get('entry_type'),
+                                   ENTRY_PARTS_PARSERS['default'])
 
-    parse_func = ENTRY_PARTS_PARSERS.get(headers.get('entry_type'),
-                                         ENTRY_PARTS_PARSERS['default'])
+
+def parse_entry(string, **kwargs):
+    headers, body = _split_entry(string)
+    parse_func = get_parts_parser(headers)
     parts = parse_func(headers, body, **kwargs)
     return headers, parts
 
 
+def parse_entry_headers(string):
+    "Parses only the headers of an entry, leaving the body as-is."
+    return _split_entry(string)[0]
+
+
+def read_entry_headers(path):
+    """Reads and parses the headers of the entry at *path*, without
+    reading the rest of the file."""
+    lines, sep_count = [], 0
+    with open(path, 'rb') as f:
+        for line in f:
+            lines.append(line)
+            if _part_sep_re.match(line):
+                sep_count += 1
+                if sep_count == 2:
+                    break
+    return parse_entry_headers(b''.join(lines))
+
+
 class StringLoaded(Exception):
     pass
 
 
+# A part can declare its type on its first line, e.g.:
+#   #<!--{type: markdown}-->
+# which is a comment in YAML and invisible once rendered from Markdown.
+_part_meta_re = re.compile(br'\A#<!--\s*(?P<meta>\{.*?\})\s*-->[ \t]*(?:\r\n?|\n|\Z)')
+TEXT_PART_TYPES = ('markdown', 'md', 'text')
+DATA_PART_TYPES = ('data', 'yaml')
+
+# first characters which may begin a non-scalar YAML node
+_yaml_indicators = tuple(iter(b'-?:,[]{}#&*!|>\'"%@`'))
+_PART_TYPE_MAX_LINES = 16
+
+
+def get_part_type(token):
+    """Cheaply classifies a part *token* as 'text' (Markdown) or 'data'
+    (YAML), returning None if it can't be decided lexically and the
+    YAML parser must have its say.
+
+    A part is only classified as text if YAML would have loaded it as
+    a string or failed to load it: more than one non-comment line,
+    where the first does not start with a YAML indicator and does not
+    look like a mapping key.
+    """
+    match = _part_meta_re.match(token)
+    if match:
+        meta = omd_load(match.group('meta'))
+        part_type = meta.get('type')
+        if part_type in TEXT_PART_TYPES:
+            return 'text'
+        elif part_type in DATA_PART_TYPES:
+            return 'data'
+        raise ValueError('expected part type to be one of %r, not: %r'
+                         % (TEXT_PART_TYPES + DATA_PART_TYPES, part_type))
+    first_line, line_count = None, 0
+    # only the first few lines matter, avoid splitting the whole part
+    for line in token.split(b'\n', _PART_TYPE_MAX_LINES)[:_PART_TYPE_MAX_LINES]:
+        line = line.strip()
+        if not line or line[0] == ord('#'):
+            continue
+        if first_line is None:
+            first_line = line
+        line_count += 1
+        if line_count > 1:
+            break
+    if line_count < 2:
+        return None  # short enough to leave to YAML
+    if first_line[0] in _yaml_indicators or first_line.startswith(b'...'):
+        return None
+    if b': ' in first_line or b':\t' in first_line or first_line.endswith(b':'):
+        return None
+    return 'text'
+
+
 def parse_entry_parts(headers, body, **kwargs):
     # NOTE: headers can also be modified in-place, this is by design
     parts = []
     tokens = _part_sep_re.split(body)
     for t in tokens:
-        # TODO: pull out part metadata:  "#<!--{}-->"
+        part_type = get_part_type(t)
+        meta_match = _part_meta_re.match(t)
+        if meta_match:
+            t = t[meta_match.end():]
+        if part_type == 'text':
+            parts.append(t.decode('utf-8'))
+            continue
+        elif part_type == 'data':
+            item = omd_load(t)
+            if not isinstance(item, dict):
+                raise ValueError('expected data part to be a dict, not %r'
+                                 % type(item))
+            parts.append(item)
+            continue
         try:
             item = omd_load(t)
             if item is None:
@@ -67,7 +160,27 @@ def parse_entry_parts(headers, body, **kwargs):
     return parts
 
 
-def omd_load(stream, Loader=yaml.Loader, object_pairs_hook=OMD):
+try:
+    # libyaml-backed, when PyYAML was built with it
+    from yaml import CSafeLoader as DEFAULT_LOADER
+except ImportError:
+    from yaml import SafeLoader as DEFAULT_LOADER
+
+
+_ORDERED_LOADERS = {}
+
+
+def get_ordered_loader(Loader=DEFAULT_LOADER, object_pairs_hook=OMD):
+    """Returns a subclass of *Loader* which loads mappings with
+    *object_pairs_hook*, preserving key order. Loader classes are
+    built once and cached, as omd_load is called for every part of
+    every entry."""
+    key = (Loader, object_pairs_hook)
+    try:
+        return _ORDERED_LOADERS[key]
+    except KeyError:
+        pass
+
     class OrderedLoader(Loader):
         pass
 
@@ -78,7 +191,12 @@ def omd_load(stream, Loader=yaml.Loader, object_pairs_hook=OMD):
     OrderedLoader.add_constructor(
         yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
         construct_mapping)
-    return yaml.load(stream, OrderedLoader)
+    _ORDERED_LOADERS[key] = OrderedLoader
+    return OrderedLoader
+
+
+def omd_load(stream, Loader=DEFAULT_LOADER, object_pairs_hook=OMD):
+    return yaml.load(stream, get_ordered_loader(Loader, object_pairs_hook))
 
 
 _init()
@@ -0,0 +1,179 @@
+"""
+Manifest-based publishing.
+
+Each export writes a manifest of every file in the output directory,
+with its size and content hash. Publishing diffs that manifest against
+the one saved after the last successful publish to the same target,
+and hands only the added, changed, and deleted paths to the target's
+transport.
+
+Targets are looked up by name in PUBLISH_TARGETS, from the
+prod.publish_target config. Sites can register their own, e.g., from
+custom.py.
+"""
+import os
+import shlex
+import tempfile
+import subprocess
+
+from boltons.fileutils import mkdir_p
+
+from chert.fal import get_file_hash, copy_file
+
+MANIFEST_VERSION = 1
+
+
+def build_manifest(root_path, prev_manifest=None):
+    """Returns a manifest of all files under *root_path*, following
+    symlinks (e.g., to the uploads directory). Hashes are reused from
+    *prev_manifest* for files whose size and mtime haven't changed."""
+    prev_files = (prev_manifest or {}).get('files', {})
+    files = {}
+    for cur_dir, dirnames, filenames in os.walk(root_path, followlinks=True):
+        for fn in filenames:
+            path = os.path.join(cur_dir, fn)
+            rel_path = os.path.relpath(path, root_path).replace(os.sep, '/')
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # broken symlink
+            prev = prev_files.get(rel_path)
+            if (prev and prev['size'] == stat.st_size
+                    and prev['mtime_ns'] == stat.st_mtime_ns):
+                file_hash = prev['sha256']
+            else:
+                file_hash = get_file_hash(path)
+            files[rel_path] = {'size': stat.st_size,
+                               'mtime_ns': stat.st_mtime_ns,
+                               'sha256': file_hash}
+    return {'version': MANIFEST_VERSION, 'files': files}
+
+
+def is_valid_manifest(manifest):
+    return (isinstance(manifest, dict)
+            and manifest.get('version') == MANIFEST_VERSION
+            and isinstance(manifest.get('files'), dict))
+
+
+def diff_manifests(old, new):
+    """Returns sorted lists of the (added, changed, removed) paths going
+    from manifest *old* to manifest *new*. Files are compared by size
+    and hash, mtimes are ignored."""
+    old_files = (old or {}).get('files', {})
+    new_files = new['files']
+    added, changed = [], []
+    for rel_path, info in new_files.items():
+        old_info = old_files.get(rel_path)
+        if old_info is None:
+            added.append(rel_path)
+        elif (old_info['size'], old_info['sha256']) != (info['size'], info['sha256']):
+            changed.append(rel_path)
+    removed = [p for p in old_files if p not in new_files]
+    return sorted(added), sorted(changed), sorted(removed)
+
+
+class PublishTarget(object):
+    """Base class for publish transports. Subclasses implement
+    :meth:`get_id`, which identifies the destination so that each
+    destination has its own last-published manifest, and
+    :meth:`publish`."""
+    @classmethod
+    def from_config(cls, prod_config, input_path):
+        raise NotImplementedError()
+
+    def get_id(self):
+        raise NotImplementedError()
+
+    def publish(self, src_path, upload_paths, delete_paths):
+        """Transfers *upload_paths* (relative to *src_path*) and deletes
+        *delete_paths* at the destination. Raises on failure."""
+        raise NotImplementedError()
+
+
+class LocalDirTarget(PublishTarget):
+    "Publishes to a directory on a local (or mounted) filesystem."
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    @classmethod
+    def from_config(cls, prod_config, input_path):
+        path = os.path.expanduser(prod_config['publish_path'])
+        return cls(os.path.join(input_path, path))
+
+    def get_id(self):
+        return 'local:' + self.path
+
+    def publish(self, src_path, upload_paths, delete_paths):
+        for rel_path in upload_paths:
+            dest_path = os.path.join(self.path, rel_path)
+            mkdir_p(os.path.dirname(dest_path))
+            copy_file(os.path.join(src_path, rel_path), dest_path)
+        for rel_path in delete_paths:
+            dest_path = os.path.join(self.path, rel_path)
+            try:
+                os.unlink(dest_path)
+            except FileNotFoundError:
+                pass
+            self._remove_empty_dirs(os.path.dirname(dest_path))
+        return
+
+    def _remove_empty_dirs(self, dir_path):
+        while dir_path.startswith(os.path.join(self.path, '')):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                return  # not empty, or already gone
+            dir_path = os.path.dirname(dir_path)
+
+
+class RsyncTarget(PublishTarget):
+    """Publishes over rsync, passing the paths to transfer with
+    --files-from, so rsync doesn't have to compare whole trees."""
+    def __init__(self, remote_slug, rsync_cmd='rsync', rsync_flags='avzPk'):
+        self.remote_slug = remote_slug
+        self.rsync_cmd = rsync_cmd
+        self.rsync_flags = rsync_flags
+
+    @classmethod
+    def from_config(cls, prod_config, input_path):
+        rsync_cmd = prod_config.get('rsync_cmd', 'rsync')
+        if not rsync_cmd.isalpha():
+            rsync_cmd = shlex.quote(rsync_cmd)
+        # TODO: add -e 'ssh -o "NumberOfPasswordPrompts 0"' to fail if
+        # ssh keys haven't been set up.
+        rsync_flags = prod_config.get('rsync_flags', 'avzPk')
+        remote_slug = "%s@%s:'%s'" % (prod_config['remote_user'],
+                                      prod_config['remote_host'],
+                                      shlex.quote(prod_config['remote_path']))
+        return cls(remote_slug, rsync_cmd=rsync_cmd, rsync_flags=rsync_flags)
+
+    def get_id(self):
+        return 'rsync:' + self.remote_slug
+
+    def get_command(self, src_path, files_from_path, delete=False):
+        if not src_path.endswith('/'):
+            src_path += '/'  # not just cosmetic; rsync needs this
+        # deleted paths are in the list too, and removed remotely
+        # thanks to --delete-missing-args (rsync 3.1+)
+        delete_flag = ' --delete-missing-args' if delete else ''
+        return '%s -%s --files-from=%s%s %s %s' % (self.rsync_cmd,
+                                                   self.rsync_flags,
+                                                   shlex.quote(files_from_path),
+                                                   delete_flag,
+                                                   shlex.quote(src_path),
+                                                   self.remote_slug)
+
+    def publish(self, src_path, upload_paths, delete_paths):
+        with tempfile.NamedTemporaryFile('w', prefix='chert-files-',
+                                         suffix='.txt') as f:
+            f.write(''.join([p + '\n' for p in upload_paths + delete_paths]))
+            f.flush()
+            cmd = self.get_command(src_path, f.name, delete=bool(delete_paths))
+            print('Executing', cmd)
+            rsync_output = subprocess.check_output(cmd, shell=True)
+        print(rsync_output)
+        return
+
+
+PUBLISH_TARGETS = {'rsync': RsyncTarget,
+                   'local': LocalDirTarget}
@@ -17,6 +17,20 @@ def chert_pre_audit(chert_obj):
     raise ValueError('something went awry')
 
 
+# def chert_html_transforms(chert_obj):
+#     # transforms run in the same walk as chert's own TOC and link
+#     # handling, over both the content and inline (feed) HTML
+#     from chert.hypertext import DOMTransform
+#
+#     class LazyImages(DOMTransform):
+#         tags = ('img',)
+#
+#         def visit(self, el, parent):
+#             el.set('loading', 'lazy')
+#
+#     return [LazyImages()]
+
+
 def _autotag_entries(chert_obj):
     # called by post_load
     for entry in chert_obj.entries:
@@ -0,0 +1,129 @@
+"""
+Compiled template caching.
+
+Loading an Ashes template means parsing it, optimizing the AST,
+generating Python, and compiling that. :class:`TemplateCache` keeps
+compiled templates in memory across rebuilds, and their bytecode on
+disk across runs, so only changed templates are recompiled.
+
+Templates are identified by path, name, and content hash, plus the
+environment settings that affect compilation (e.g., whitespace
+handling and autoescaping). File mtimes and sizes are used to skip
+rereading and rehashing unchanged files.
+"""
+import os
+import time
+import base64
+import hashlib
+import marshal
+import importlib.util
+
+import ashes
+from ashes import Template, walk_ext_matches
+
+from chert.cache import make_key
+
+# bytecode is only valid for the Python version that produced it
+_KEY_PREFIX = ('chert-template-1', ashes.__version__,
+               importlib.util.MAGIC_NUMBER.hex())
+
+
+def _get_env_signature(env):
+    return repr((type(env).__name__,
+                 getattr(env, 'keep_whitespace', None),
+                 env.autoescape_filter,
+                 sorted(env.special_chars.items()),
+                 sorted(env.optimizers)))
+
+
+class TemplateCache(object):
+    """With *disk_cache*, a :class:`~chert.cache.RenderCache`, compiled
+    bytecode is also persisted. *compile_count* and *compile_time*
+    (in seconds) cover templates compiled from source since the last
+    :meth:`reset_stats`."""
+    def __init__(self, disk_cache=None):
+        self.disk_cache = disk_cache
+        self._templates = {}  # key -> Template
+        self._current_keys = {}  # (env signature, path, name) -> key
+        self._file_hashes = {}  # path -> (mtime_ns, size, sha256)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hit_count = self.disk_hit_count = 0
+        self.compile_count = 0
+        self.compile_time = 0.0
+
+    def _read(self, path):
+        "Returns the (source, content_hash) of *path*, source may be None."
+        stat = os.stat(path)
+        known = self._file_hashes.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return None, known[2]
+        with open(path, 'rb') as f:
+            source = f.read()
+        content_hash = hashlib.sha256(source).hexdigest()
+        self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return source, content_hash
+
+    def load(self, path, name=None, env=None):
+        """Returns a compiled template for the file at *path*, named
+        *name* (defaulting to the path), for rendering with *env*
+        (defaulting to Ashes' default environment)."""
+        path = os.path.abspath(path)
+        name = name or path
+        env = env or ashes.default_env
+        env_sig = _get_env_signature(env)
+        source, content_hash = self._read(path)
+        key = make_key(*(_KEY_PREFIX + (env_sig, path, name, content_hash)))
+        ret = self._templates.get(key)
+        if ret is not None:
+            self.hit_count += 1
+            return ret
+
+        code = None
+        if self.disk_cache is not None:
+            encoded = self.disk_cache.get(key)
+            if encoded is not None:
+                try:
+                    code = marshal.loads(base64.b64decode(encoded))
+                except (ValueError, EOFError, TypeError):
+                    code = None
+                else:
+                    self.disk_hit_count += 1
+        if code is None:
+            if source is None:
+                with open(path, 'rb') as f:
+                    source = f.read()
+            start = time.perf_counter()
+            tmpl = Template(name, source.decode('utf-8'), source_file=path,
+                            env=env, lazy=True)
+            code = tmpl.to_python_code()
+            self.compile_time += time.perf_counter() - start
+            self.compile_count += 1
+            if self.disk_cache is not None:
+                self.disk_cache.put(key, base64.b64encode(marshal.dumps(code)).decode('ascii'))
+        ret = Template.from_python_code(code, name=name, env=env)
+
+        cur_key = (env_sig, path, name)
+        self._templates.pop(self._current_keys.get(cur_key), None)
+        self._current_keys[cur_key] = key
+        self._templates[key] = ret
+        return ret
+
+    def load_all(self, env):
+        """Loads and registers every template under each of the path
+        loaders of *env*, an AshesEnv, like :meth:`AshesEnv.load_all`.
+        Returns the list of templates."""
+        ret = []
+        # reversed so the first loader to have a template takes precedence
+        for loader in reversed(env.loaders):
+            root_path = loader.root_path
+            for path in walk_ext_matches(root_path, loader.exts):
+                name = os.path.relpath(os.path.abspath(path), root_path)
+                tmpl = self.load(path, name=name, env=env)
+                env.register(tmpl)
+                ret.append(tmpl)
+        return ret
+
+    def __len__(self):
+        return len(self._templates)
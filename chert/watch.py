@@ -0,0 +1,318 @@
+"""
+File watching for the dev server.
+
+On Linux, changes are picked up from inotify (via ctypes, no extra
+dependencies). Everywhere else, and wherever inotify is unavailable,
+a stat-polling watcher is used instead. Both watchers report added,
+modified, and deleted files, and ignore editor temp/swap files.
+"""
+import os
+import sys
+import time
+import errno
+import fnmatch
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from boltons.fileutils import iter_find_files
+
+
+DEFAULT_INTERVAL = 0.5  # seconds between polls
+DEFAULT_DEBOUNCE = 0.1  # seconds of quiet before a batch is reported
+
+# vim swap files and its write test file, emacs backups and lockfiles,
+# and generic temp files
+IGNORED_PATS = ['.*.sw?', '4913', '*~', '.#*', '#*#', '*.tmp', '.DS_Store']
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+
+_IN_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE
+                  | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+                  | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_IN_EVENT_STRUCT = struct.Struct('iIII')
+_IN_READ_SIZE = 64 * 1024
+
+
+def is_ignored(path, ignored=IGNORED_PATS):
+    basename = os.path.basename(path)
+    return any(fnmatch.fnmatch(basename, pat) for pat in ignored)
+
+
+class BaseWatcher(object):
+    """Watches *watch_dirs*, a list of (directory, patterns) pairs, as
+    well as individual *watch_files*, which need not exist yet.
+    """
+    def __init__(self, watch_dirs, watch_files=(), ignored=IGNORED_PATS):
+        self.watch_dirs = [(os.path.abspath(d), [p] if isinstance(p, str) else list(p))
+                           for d, p in watch_dirs]
+        self.watch_files = set([os.path.abspath(f) for f in watch_files])
+        self.ignored = list(ignored)
+
+    def is_in_watch_dirs(self, path):
+        return any(path == dir_path or path.startswith(os.path.join(dir_path, ''))
+                   for dir_path, _ in self.watch_dirs)
+
+    def is_watched(self, path):
+        if path in self.watch_files:
+            return True
+        if is_ignored(path, self.ignored):
+            return False
+        basename = os.path.basename(path)
+        for dir_path, patterns in self.watch_dirs:
+            if not path.startswith(os.path.join(dir_path, '')):
+                continue
+            if any(fnmatch.fnmatch(basename, pat) for pat in patterns):
+                return True
+        return False
+
+    def iter_paths(self):
+        "Yields every currently-existing watched path."
+        for path in sorted(self.watch_files):
+            if os.path.exists(path):
+                yield path
+        for dir_path, patterns in self.watch_dirs:
+            if not os.path.isdir(dir_path):
+                continue
+            for path in iter_find_files(dir_path, patterns,
+                                        ignored=self.ignored):
+                yield path
+
+    def wait(self, timeout=None):
+        """Blocks until at least one watched path changes, or *timeout*
+        seconds pass. Returns a set of changed paths, which may be
+        empty on timeout."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(BaseWatcher):
+    def __init__(self, watch_dirs, watch_files=(), ignored=IGNORED_PATS,
+                 interval=DEFAULT_INTERVAL):
+        super(PollingWatcher, self).__init__(watch_dirs, watch_files, ignored)
+        self.interval = interval
+        self._snapshot = self.snapshot()
+
+    def snapshot(self):
+        ret = {}
+        for path in self.iter_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # deleted while walking
+            ret[path] = (stat.st_mtime, stat.st_size)
+        return ret
+
+    def poll(self):
+        "Returns a set of paths added, modified, or deleted since the last poll."
+        old, new = self._snapshot, self.snapshot()
+        self._snapshot = new
+        changed = set([p for p, stat in new.items() if old.get(p) != stat])
+        changed.update([p for p in old if p not in new])
+        return changed
+
+    def wait(self, timeout=None):
+        start = time.time()
+        while True:
+            if timeout is None:
+                to_sleep = self.interval
+            else:
+                to_sleep = min(self.interval, max(0, start + timeout - time.time()))
+            time.sleep(to_sleep)
+            changed = self.poll()
+            if changed:
+                return changed
+            if timeout is not None and time.time() - start >= timeout:
+                return changed
+
+
+def _get_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        # check availability
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class InotifyWatcher(BaseWatcher):
+    def __init__(self, watch_dirs, watch_files=(), ignored=IGNORED_PATS):
+        super(InotifyWatcher, self).__init__(watch_dirs, watch_files, ignored)
+        self._libc = _get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wd_map = {}  # watch descriptor -> directory path
+        self._dir_map = {}  # directory path -> watch descriptor
+        # existing watched paths, so that deletions can be reported
+        # when a whole directory goes away, or the event queue overflows
+        self._known_paths = set(self.iter_paths())
+        for dir_path, _ in self.watch_dirs:
+            self._add_tree(dir_path)
+        # individual files are watched through their parent
+        # directories, as editors often replace files on save
+        for file_path in self.watch_files:
+            self._add_dir(os.path.dirname(file_path))
+
+    def _add_dir(self, dir_path):
+        if dir_path in self._dir_map:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path),
+                                          _IN_WATCH_MASK)
+        if wd < 0:
+            return  # vanished or unreadable, the next event will tell
+        self._wd_map[wd] = dir_path
+        self._dir_map[dir_path] = wd
+
+    def _remove_tree(self, dir_path):
+        """Stops watching *dir_path* and its subdirectories, and returns
+        the known paths under it, which no longer exist there."""
+        prefix = os.path.join(dir_path, '')
+        for cur_dir in [d for d in self._dir_map
+                        if d == dir_path or d.startswith(prefix)]:
+            wd = self._dir_map.pop(cur_dir)
+            self._wd_map.pop(wd, None)
+            # moved directories keep their watches, deleted ones are
+            # already gone, in which case this fails harmlessly
+            self._libc.inotify_rm_watch(self._fd, wd)
+        removed = set([p for p in self._known_paths if p.startswith(prefix)])
+        self._known_paths -= removed
+        return removed
+
+    def _add_tree(self, dir_path):
+        for cur_dir, _, _ in os.walk(dir_path):
+            self._add_dir(cur_dir)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, _IN_READ_SIZE)
+        except BlockingIOError:
+            return []
+        ret, offset, header_size = [], 0, _IN_EVENT_STRUCT.size
+        while offset + header_size <= len(data):
+            wd, mask, _, name_len = _IN_EVENT_STRUCT.unpack_from(data, offset)
+            offset += header_size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            ret.append((wd, mask, os.fsdecode(name)))
+        return ret
+
+    def _process_events(self, events):
+        changed = set()
+        for wd, mask, name in events:
+            if mask & _IN_Q_OVERFLOW:
+                # too many events to track, report everything,
+                # including anything deleted in the meantime
+                cur_paths = set(self.iter_paths())
+                changed.update(cur_paths, self._known_paths)
+                self._known_paths = cur_paths
+                continue
+            dir_path = self._wd_map.get(wd)
+            if dir_path is None:
+                continue
+            if mask & _IN_IGNORED:
+                self._wd_map.pop(wd, None)
+                if self._dir_map.get(dir_path) == wd:
+                    self._dir_map.pop(dir_path)
+                continue
+            if not name:
+                continue  # events on the watched directory itself
+            path = os.path.join(dir_path, name)
+            if mask & _IN_ISDIR:
+                # directories next to watch_files (e.g., the output
+                # directory, next to the config) aren't watched
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and self.is_in_watch_dirs(path):
+                    self._add_tree(path)
+                    added = [p for p in self.iter_paths()
+                             if p.startswith(os.path.join(path, ''))]
+                    self._known_paths.update(added)
+                    changed.update(added)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    changed.update(self._remove_tree(path))
+                continue
+            if self.is_watched(path):
+                if mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._known_paths.discard(path)
+                else:
+                    self._known_paths.add(path)
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        start = time.time()
+        while True:
+            remaining = None
+            if timeout is not None:
+                remaining = max(0, start + timeout - time.time())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return set()
+            changed = self._process_events(self._read_events())
+            if changed:
+                return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def get_watcher(watch_dirs, watch_files=(), interval=DEFAULT_INTERVAL,
+                use_inotify=None):
+    """Returns an InotifyWatcher where supported, falling back to a
+    PollingWatcher. Pass *use_inotify* as False to force polling."""
+    if use_inotify is not False:
+        try:
+            return InotifyWatcher(watch_dirs, watch_files)
+        except OSError:
+            if use_inotify:
+                raise
+    return PollingWatcher(watch_dirs, watch_files, interval=interval)
+
+
+def iter_changed_files(watch_dirs, watch_files=(), interval=DEFAULT_INTERVAL,
+                       debounce=DEFAULT_DEBOUNCE, use_inotify=None):
+    """Yields sorted lists of changed paths, starting with every
+    currently-existing path. Bursts of changes (e.g., an editor save)
+    are batched until *debounce* seconds pass without further
+    changes.
+    """
+    watcher = get_watcher(watch_dirs, watch_files,
+                          interval=interval, use_inotify=use_inotify)
+    try:
+        yield sorted(watcher.iter_paths())
+        while True:
+            changed = watcher.wait()
+            while True:
+                more = watcher.wait(timeout=debounce)
+                if not more:
+                    break
+                changed.update(more)
+            if changed:
+                yield sorted(changed)
+    finally:
+        watcher.close()
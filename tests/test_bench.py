@@ -0,0 +1,230 @@
+"""Benchmarks, skipped unless the CHERT_BENCH environment variable is
+set. Run with::
+
+    CHERT_BENCH=1 pytest -s tests/test_bench.py
+"""
+import os
+import time
+
+import pytest
+import yaml
+import markdown
+from boltons.dictutils import OMD
+
+from chert.cli import init
+from chert.core import Site
+from chert.hypertext import (html_text_to_tree,
+                             html_tree_to_text,
+                             add_toc,
+                             nest_h_tokens,
+                             retarget_links)
+from chert.parsers import (omd_load,
+                           parse_entry_parts,
+                           DEFAULT_LOADER,
+                           _part_sep_re)
+
+pytestmark = pytest.mark.skipif(not os.getenv('CHERT_BENCH'),
+                                reason='set CHERT_BENCH=1 to run benchmarks')
+
+_ENTRY_TMPL = '''---
+title: Benchmark Entry {i}
+publish_date: '2020-01-{day:02d}'
+tags: [bench, group{group}]
+---
+
+[TOC]
+
+## Introduction {i}
+
+{prose}
+
+## Some code
+
+```python
+def entry_{i}(x):
+    return [x * i for i in range({i})]
+```
+
+## Conclusion
+
+{prose}
+'''
+
+_PROSE = ('Chert renders *Markdown* with [links](/about.html), `code`, '
+          'and other **inline** markup. ') * 20
+
+
+def _best_of(func, count=3):
+    ret = None
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        ret = duration if ret is None else min(ret, duration)
+    return ret
+
+
+def _make_bench_site(tmp_path, entry_count):
+    site_path = tmp_path / ('bench_%s' % entry_count)
+    init(target_dir=str(site_path))
+    entries_path = site_path / 'entries'
+    for i in range(entry_count):
+        text = _ENTRY_TMPL.format(i=i, day=(i % 28) + 1, group=i % 8,
+                                  prose=_PROSE)
+        (entries_path / ('bench_%05d.md' % i)).write_text(text)
+    return site_path
+
+
+@pytest.mark.parametrize('entry_count', [16, 64, 256])
+def test_bench_parallel_render(tmp_path, entry_count):
+    site_path = _make_bench_site(tmp_path, entry_count)
+    workers = max(2, os.cpu_count() or 1)
+
+    def _render(worker_count):
+        site = Site(str(site_path), use_cache=False, workers=worker_count)
+        site.load()
+        return lambda: site.render()
+
+    serial = _best_of(_render(1))
+    parallel = _best_of(_render(workers))
+    print('\nrender %4d entries: serial %.3fs, %d workers %.3fs (%.2fx)'
+          % (entry_count, serial, workers, parallel, serial / parallel))
+
+
+def _legacy_omd_load(stream, Loader=yaml.Loader, object_pairs_hook=OMD):
+    # omd_load as it was: a new loader class per call, pure-Python Loader
+    class OrderedLoader(Loader):
+        pass
+
+    def construct_mapping(loader, node):
+        loader.flatten_mapping(node)
+        return object_pairs_hook(loader.construct_pairs(node))
+
+    OrderedLoader.add_constructor(
+        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
+        construct_mapping)
+    return yaml.load(stream, OrderedLoader)
+
+
+_BENCH_HEADERS = b'''title: Benchmark Entry
+publish_date: 'May 6th, 2015'
+tags: [meta, reference, bench]
+entry_root: bench/entry
+field_label_map: {url: Link, year: Year}
+'''
+
+_BENCH_PART = b'''title: A data part
+url: https://example.com/a/data/part
+year: 2015
+summary: A few sentences of summary text, as might accompany a link.
+tags: [one, two, three]
+'''
+
+
+@pytest.mark.parametrize('label, stream', [('headers', _BENCH_HEADERS),
+                                           ('data part', _BENCH_PART)])
+def test_bench_omd_load(label, stream):
+    count = 2000
+    assert _legacy_omd_load(stream) == omd_load(stream)
+
+    def _run(load_func):
+        return lambda: [load_func(stream) for _ in range(count)]
+
+    before = _best_of(_run(_legacy_omd_load))
+    after = _best_of(_run(omd_load))
+    print('\nomd_load %-9s: before %7.0f/s, after %7.0f/s (%.1fx, %s)'
+          % (label, count / before, count / after, before / after,
+             DEFAULT_LOADER.__name__))
+
+
+def _legacy_parse_entry_parts(headers, body):
+    # parse_entry_parts as it was: every part is first tried as YAML
+    parts = []
+    for t in _part_sep_re.split(body):
+        try:
+            item = omd_load(t)
+            if item is None:
+                continue
+            if isinstance(item, str):
+                raise ValueError()
+            parts.append(item)
+        except (ValueError, yaml.YAMLError):
+            parts.append(t.decode('utf-8'))
+    return parts
+
+
+def test_bench_parse_prose_parts():
+    prose = ('A paragraph of prose, with *emphasis*, [links](/a.html),'
+             ' and other inline markup.\n' * 12 + '\n') * 8
+    body = ('---\n'.join(['## Section %s\n\n%s' % (i, prose) for i in range(20)]
+                         + ['title: A data part\nyear: 2015\n'])).encode('utf-8')
+    part_count = len(_part_sep_re.split(body))
+    assert _legacy_parse_entry_parts({}, body) == parse_entry_parts({}, body)
+
+    count = 20
+    before = _best_of(lambda: [_legacy_parse_entry_parts({}, body)
+                               for _ in range(count)])
+    after = _best_of(lambda: [parse_entry_parts({}, body)
+                              for _ in range(count)])
+    print('\nprose parts: before %7.0f/s, after %7.0f/s (%.1fx)'
+          % (part_count * count / before, part_count * count / after,
+             before / after))
+
+
+@pytest.mark.parametrize('backend', ['html5lib', 'lxml'])
+def test_bench_html_backend(backend):
+    if backend == 'lxml':
+        pytest.importorskip('lxml')
+    text = _ENTRY_TMPL.format(i=1, day=1, group=1, prose=_PROSE)
+    html_text = markdown.markdown(text.split('---', 2)[2] * 10)
+
+    def _round_trip():
+        tree = html_text_to_tree(html_text, backend)
+        add_toc(tree)
+        retarget_links(tree)
+        return html_tree_to_text(tree, backend)
+
+    count = 20
+    duration = _best_of(lambda: [_round_trip() for _ in range(count)])
+    print('\n%s: %6.1f round trips/s (%d KB)'
+          % (backend, count / duration, len(html_text) // 1024))
+
+
+def _make_big_html(heading_count, size):
+    # repeated heading text exercises anchor id deduplication too
+    para = '<p>%s</p>' % ('Reference text with <code>code</code> and '
+                          '<a href="/ref.html">links</a>. ' * 8)
+    para_count = max(1, (size // heading_count) // len(para))
+    chunks = ['<p>[TOC]</p>']
+    for i in range(heading_count):
+        level = (1, 2, 3, 3, 2, 4, 5, 6, 2, 1)[i % 10]
+        chunks.append('<h%d>Section %d</h%d>' % (level, i % 100, level))
+        chunks.append(para * para_count)
+    return ''.join(chunks)
+
+
+@pytest.mark.parametrize('heading_count', [1000, 10000])
+def test_bench_toc_large_document(heading_count):
+    html_text = _make_big_html(heading_count, size=5 * 1024 * 1024)
+    tree = html_text_to_tree(html_text, 'lxml' if _has_lxml() else 'html5lib')
+    start = time.perf_counter()
+    add_toc(tree)
+    duration = time.perf_counter() - start
+    ids = [el.get('id') for el in tree.iter('h1', 'h2', 'h3', 'h4', 'h5', 'h6')]
+    assert len(ids) == len(set(ids)) == heading_count
+    print('\ntoc: %5d headings in %.1f MB: %.3fs'
+          % (heading_count, len(html_text) / 1024 / 1024, duration))
+
+    tokens = [{'level': (i * 7) % 6 + 1} for i in range(heading_count * 10)]
+    start = time.perf_counter()
+    nest_h_tokens(tokens)
+    print('nest_h_tokens: %d tokens: %.3fs'
+          % (len(tokens), time.perf_counter() - start))
+
+
+def _has_lxml():
+    try:
+        import lxml.html
+    except ImportError:
+        return False
+    return True
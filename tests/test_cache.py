@@ -0,0 +1,47 @@
+import os
+
+from chert.cache import RenderCache, make_key
+
+
+def test_make_key_stable():
+    assert make_key('a', b'b') == make_key(b'a', 'b')
+    assert make_key('ab', 'c') != make_key('a', 'bc')
+
+
+def test_render_cache_roundtrip(tmp_path):
+    cache = RenderCache(str(tmp_path))
+    key = make_key('entry')
+    assert cache.get(key) is None
+    cache.put(key, {'content_html': '<p>hi</p>'})
+    assert cache.get(key) == {'content_html': '<p>hi</p>'}
+    assert (cache.hit_count, cache.miss_count) == (1, 1)
+
+
+def test_render_cache_disabled(tmp_path):
+    cache = RenderCache(str(tmp_path), enabled=False)
+    key = make_key('entry')
+    cache.put(key, {'content_html': ''})
+    assert cache.get(key) is None
+    assert not os.listdir(str(tmp_path))
+
+
+def test_render_cache_evict_by_age(tmp_path):
+    cache = RenderCache(str(tmp_path), max_age=10)
+    old_key, new_key = make_key('old'), make_key('new')
+    cache.put(old_key, {'x': 1})
+    cache.put(new_key, {'x': 2})
+    old_path = cache._get_key_path(old_key)
+    os.utime(old_path, (0, 0))
+    assert cache.evict() == 1
+    assert cache.get(old_key) is None
+    assert cache.get(new_key) == {'x': 2}
+
+
+def test_render_cache_evict_by_size(tmp_path):
+    cache = RenderCache(str(tmp_path), max_size=30, max_age=None)
+    keys = [make_key(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, {'content_html': 'x' * 10})
+        os.utime(cache._get_key_path(key), (i, i))
+    assert cache.evict() == 2
+    assert cache.get(keys[2]) is not None
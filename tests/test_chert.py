@@ -1,7 +1,7 @@
 import pytest
 
 from chert.cli import init
-from chert.core import Site
+from chert.core import Entry, Site
 
 
 @pytest.fixture(scope="function")
@@ -30,3 +30,414 @@ def chert_render_path(chert_site_path):
 def test_render_assets_exist(chert_render_path):
     assert chert_render_path.is_dir()
     assert (chert_render_path / 'index.html').is_file()
+
+
+def test_render_cache_hit(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    first = dict((e.entry_root, e.content_html) for e in site.all_entries)
+    assert site.render_cache.miss_count == len(first)
+
+    site = Site(str(chert_site_path))
+    site.process()
+    assert site.render_cache.hit_count == len(first)
+    assert first == dict((e.entry_root, e.content_html)
+                         for e in site.all_entries)
+
+
+def test_export_skips_unchanged(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    assert site.fal.written_count and not site.fal.skipped_count
+    entry_path = chert_site_path / 'site' / 'about.html'
+    mtime = entry_path.stat().st_mtime_ns
+    asset_paths = list((chert_site_path / 'site' / 'css').iterdir())
+    asset_mtimes = [p.stat().st_mtime_ns for p in asset_paths]
+    stale_path = chert_site_path / 'site' / 'css' / 'stale.css'
+    stale_path.write_text(u'')
+
+    site = Site(str(chert_site_path))
+    site.process()
+    assert site.fal.skipped_count
+    assert entry_path.stat().st_mtime_ns == mtime
+    assert [p.stat().st_mtime_ns for p in asset_paths] == asset_mtimes
+    assert not stale_path.exists()
+
+
+def test_render_no_cache(chert_site_path):
+    site = Site(str(chert_site_path), use_cache=False)
+    site.process()
+    assert not (chert_site_path / '.chert_cache').exists()
+
+
+def _clear_render_cache(site_path):
+    cache_path = site_path / '.chert_cache'
+    for key_path in cache_path.glob('??/*.json'):
+        key_path.unlink()
+
+
+def test_render_highlight_cache(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.load()
+    site.render()
+    miss_count = site.highlight_cache.miss_count
+    assert miss_count and not site.highlight_cache.hit_count
+
+    _clear_render_cache(chert_site_path)
+    site.render()
+    assert site.highlight_cache.hit_count == miss_count
+
+    # a new site gets highlighting from disk
+    _clear_render_cache(chert_site_path)
+    site = Site(str(chert_site_path))
+    site.load()
+    site.render()
+    assert site.highlight_cache.hit_count == miss_count
+    assert not site.highlight_cache.miss_count
+
+
+def test_update_incremental(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    about = [e for e in site.special_entries if e.title == 'About'][0]
+    colophon = [e for e in site.entries if e.title == 'Colophon'][0]
+    colophon_html = colophon.entry_html
+
+    about_path = about.source_path
+    with open(about_path, 'a') as f:
+        f.write('\nAn incremental addendum.\n')
+    affected = site.update([about_path])
+    assert affected == set([('entry', about_path)])
+    assert colophon.entry_html is colophon_html
+    out_html = (chert_site_path / 'site' / 'about.html').read_text()
+    assert 'incremental addendum' in out_html
+
+
+def test_update_tagged_entry(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    colophon = [e for e in site.entries if e.title == 'Colophon'][0]
+    colophon_path = colophon.source_path
+    with open(colophon_path, 'a') as f:
+        f.write('\nA tagged addendum.\n')
+    affected = site.update([colophon_path])
+    assert ('entry', colophon_path) in affected
+    assert ('list', None) in affected
+    assert ('list', 'code') in affected
+    # the newer post links to the colophon as its previous entry
+    new_post = [e for e in site.entries if e.title == 'A New Post'][0]
+    assert ('entry', new_post.source_path) in affected
+    feed = (chert_site_path / 'site' / 'tagged' / 'code' / 'rss.xml').read_text()
+    assert 'tagged addendum' in feed
+
+
+def test_update_index_neighbors(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    colophon_path = site.entries[1].source_path
+    with open(colophon_path) as f:
+        text = f.read()
+    with open(colophon_path, 'w') as f:
+        f.write(text.replace('title: Colophon', 'title: Colophonic'))
+    affected = site.update([colophon_path])
+    assert ('index', None) in affected
+    index_html = (chert_site_path / 'site' / 'index.html').read_text()
+    assert 'Colophonic' in index_html
+    # renamed, so the old page is removed
+    assert (chert_site_path / 'site' / 'colophonic.html').exists()
+    assert not (chert_site_path / 'site' / 'colophon.html').exists()
+
+
+def test_update_deleted_entry(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    output_path = chert_site_path / 'site'
+    assert (output_path / 'a_new_post.html').exists()
+    assert (output_path / 'tagged' / 'reference' / 'index.html').exists()
+    new_post_path = chert_site_path / 'entries' / 'new_post.md'
+    new_post_path.unlink()
+    site.update([str(new_post_path)])
+    for ext in ('.html', '.gen.md', '.json'):
+        assert not (output_path / ('a_new_post' + ext)).exists()
+    # the post was the only one tagged reference
+    assert not (output_path / 'tagged' / 'reference').exists()
+    assert (output_path / 'tagged' / 'meta' / 'index.html').exists()
+    assert 'A New Post' not in (output_path / 'index.html').read_text()
+
+
+def test_entry_dicts_memoized(chert_site_path, monkeypatch):
+    import chert.core
+    site = Site(str(chert_site_path))
+    site.process()
+    entry = site.entries[0]
+    ctx = entry.to_dict(with_links=True)
+    assert entry.to_dict(with_links=True) is ctx
+    assert ctx['entry_html'] == entry.entry_html
+    entry.clear_dict_cache()
+    assert entry.to_dict(with_links=True) is not ctx
+
+    # rendering every list again reuses the contexts from the first
+    calls = []
+    orig_to_timestamp = chert.core.to_timestamp
+    monkeypatch.setattr(chert.core, 'to_timestamp',
+                        lambda *a, **kw: calls.append(a) or orig_to_timestamp(*a, **kw))
+    monkeypatch.setattr(site, 'get_site_info', lambda: 1 / 0)
+    for entry_list in [site.entries] + list(site.tag_map.values()):
+        entry_list.render(site_obj=site)
+    call_count = len(calls)
+    for entry_list in [site.entries] + list(site.tag_map.values()):
+        entry_list.render(site_obj=site)
+    assert len(calls) == call_count
+
+
+def test_update_config_full(chert_site_path):
+    site = Site(str(chert_site_path))
+    site.process()
+    assert site.update([site.paths['config_path']]) is None
+
+
+def test_iter_changed_files_custom_mod(chert_site_path, tmp_path):
+    from chert.core import _iter_changed_files
+    config_path = tmp_path / 'chert.yaml'
+    (chert_site_path / 'chert.yaml').rename(config_path)
+    custom_mod_path = chert_site_path / 'custom.py'
+    changed_iter = _iter_changed_files(str(chert_site_path / 'entries'),
+                                       str(chert_site_path / 'themes'),
+                                       str(config_path), str(custom_mod_path),
+                                       use_inotify=False)
+    changed = next(changed_iter)
+    changed_iter.close()
+    assert str(config_path) in changed
+    assert str(custom_mod_path) in changed
+
+
+def test_load_parallel_matches_serial(chert_site_path):
+    (chert_site_path / 'entries' / 'broken.md').write_text('no headers here')
+    serial_site = Site(str(chert_site_path), workers=1)
+    serial_site.load()
+    parallel_site = Site(str(chert_site_path), workers=2)
+    parallel_site.load()
+
+    def _summarize(site):
+        return [(e.source_path, e.title, list(e.headers.items()), e.parts)
+                for e in site.all_entries]
+    assert _summarize(serial_site) == _summarize(parallel_site)
+    assert len(parallel_site.all_entries) == 3
+    assert all(e.source_text for e in parallel_site.all_entries)
+
+
+class _MarkedEntry(Entry):
+    @classmethod
+    def from_path(cls, in_path, **kwargs):
+        ret = super(_MarkedEntry, cls).from_path(in_path, **kwargs)
+        ret.headers['marked'] = True
+        return ret
+
+
+class _MarkedSite(Site):
+    _entry_type = _MarkedEntry
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_load_entry_type_from_path(chert_site_path, workers):
+    site = _MarkedSite(str(chert_site_path), use_cache=False, workers=workers)
+    site.load()
+    assert site.all_entries
+    for entry in site.all_entries:
+        assert isinstance(entry, _MarkedEntry)
+        assert entry.headers['marked'] is True
+
+
+def test_load_lazy_entries(chert_site_path):
+    eager_site = Site(str(chert_site_path), use_cache=False)
+    eager_site.process()
+    eager_index = (chert_site_path / 'site' / 'index.html').read_bytes()
+
+    site = Site(str(chert_site_path), use_cache=False, lazy_entries=True)
+    site.load()
+    assert site.all_entries
+    assert not any(e.is_body_loaded for e in site.all_entries)
+    assert [(e.title, e.publish_date, e.tags) for e in site.all_entries] == \
+        [(e.title, e.publish_date, e.tags) for e in eager_site.all_entries]
+
+    site.validate()
+    site.render()
+    assert all(e.is_body_loaded for e in site.all_entries)
+    assert [e.parts for e in site.all_entries] == \
+        [e.parts for e in eager_site.all_entries]
+    site.export()
+    index = (chert_site_path / 'site' / 'index.html').read_bytes()
+    assert index.split(b'Last generated')[0] == eager_index.split(b'Last generated')[0]
+
+
+def test_load_from_entry_index(chert_site_path):
+    site = Site(str(chert_site_path), lazy_entries=True)
+    site.load()
+    entry_count = len(site.all_entries)
+    assert len(site.entry_index) == entry_count
+    assert site.entry_index.get_tag_counts()
+
+    new_post = chert_site_path / 'entries' / 'new_post.md'
+    new_post.write_bytes(new_post.read_bytes().replace(b'A New Post', b'A Newer Post'))
+    site = Site(str(chert_site_path), lazy_entries=True)
+    site.load()
+    assert len(site.all_entries) == entry_count
+    assert 'A Newer Post' in [e.title for e in site.all_entries]
+    assert site.entry_index.get_headers(str(new_post))['title'] == 'A Newer Post'
+    site.render()
+    assert all(e.is_body_loaded for e in site.all_entries)
+
+    new_post.unlink()
+    site = Site(str(chert_site_path), lazy_entries=True)
+    site.load()
+    assert len(site.entry_index) == entry_count - 1
+
+
+def test_entry_index_lazy_hashes_once(chert_site_path, monkeypatch):
+    import chert.index
+    from chert.parsers import ENTRY_PARTS_PARSERS, parse_entry_parts
+
+    def _custom_parser(headers, body, **kwargs):
+        headers['custom_parsed'] = True
+        return parse_entry_parts(headers, body, **kwargs)
+    monkeypatch.setitem(ENTRY_PARTS_PARSERS, 'custom', _custom_parser)
+    about_path = chert_site_path / 'entries' / 'about.md'
+    about_path.write_bytes(about_path.read_bytes().replace(
+        b'special: true', b'special: true\nentry_type: custom'))
+
+    # files are hashed before parsing, and not again by the index
+    def _no_rehash(path):
+        raise AssertionError('rehashed %s' % path)
+    monkeypatch.setattr(chert.index, 'get_file_hash', _no_rehash)
+    site = Site(str(chert_site_path), lazy_entries=True)
+    site.load()
+    assert len(site.entry_index) == len(site.all_entries)
+
+    # custom entry types are fully parsed, even when indexed
+    site = Site(str(chert_site_path), lazy_entries=True)
+    site.load()
+    about = [e for e in site.special_entries if e.title == 'About'][0]
+    assert about.is_body_loaded
+    assert about.headers['custom_parsed']
+    assert not any(e.is_body_loaded for e in site.entries)
+
+
+def test_render_parallel_matches_serial(chert_site_path):
+    def _render(workers):
+        site = Site(str(chert_site_path), use_cache=False, workers=workers)
+        site.load()
+        site.render()
+        return [(e.content_md, e.content_html, e.content_ihtml, e.summary,
+                 [dict(p) for p in e.loaded_parts])
+                for e in site.all_entries]
+    assert _render(1) == _render(2)
+
+
+def test_render_inline_html_from_tree(chert_site_path):
+    site = Site(str(chert_site_path), use_cache=False)
+    site.load()
+    site.render()
+    new_post = [e for e in site.entries if e.title == 'A New Post'][0]
+    canonical_url = site.get_site_info()['canonical_url']
+    assert 'class="k"' in new_post.content_html
+    assert 'class="k"' not in new_post.content_ihtml
+    assert 'style="color: #A2F; font-weight: bold">def</span>' in new_post.content_ihtml
+    assert 'href="%sa_new_post.html#headings"' % canonical_url in new_post.content_ihtml
+
+    site.config['theme']['render_inline_layout'] = True
+    site.render()
+    assert 'style="color: #A2F; font-weight: bold">def</span>' in new_post.content_ihtml
+
+
+_CUSTOM_TRANSFORMS = """
+
+from chert.hypertext import DOMTransform
+
+
+class MarkParagraphs(DOMTransform):
+    tags = ('p',)
+
+    def visit(self, el, parent):
+        el.set('data-marked', 'yes')
+
+
+def chert_html_transforms(chert_obj):
+    return [MarkParagraphs()]
+"""
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_render_custom_html_transforms(chert_site_path, workers):
+    with open(str(chert_site_path / 'custom.py'), 'a') as f:
+        f.write(_CUSTOM_TRANSFORMS)
+    site = Site(str(chert_site_path), use_cache=False, workers=workers)
+    site.load()
+    site.render()
+    for entry in site.all_entries:
+        assert 'data-marked="yes"' in entry.content_html
+        assert 'data-marked="yes"' in entry.content_ihtml
+
+
+def _set_config(site_path, **sections):
+    import yaml
+    config_path = site_path / 'chert.yaml'
+    config = yaml.safe_load(config_path.read_text())
+    config.update(sections)
+    config_path.write_text(yaml.safe_dump(config))
+
+
+def _add_entries(site_path, count):
+    for i in range(count):
+        (site_path / 'entries' / ('post_%02d.md' % i)).write_text(
+            u'---\ntitle: Post %02d\npublish_date: 2019-01-%02d 12:00\n'
+            u'tags: [bulk]\n---\n\n%s\n' % (i, i + 1, u'Lorem ipsum dolor. ' * 40))
+
+
+def test_entry_list_pages():
+    from chert.core import EntryList
+    entry_list = EntryList(list(range(25, 0, -1)))  # newest first
+    pages = entry_list.get_pages(10)
+    assert [n for n, _ in pages] == [3, 2, 1]
+    assert pages[0][1] == [25, 24, 23, 22, 21]
+    assert pages[2][1] == list(range(10, 0, -1))
+    # adding an entry doesn't change the numbered pages
+    entry_list.entries.insert(0, 26)
+    assert entry_list.get_pages(10)[1:] == pages[1:]
+    assert entry_list.get_pages(0) == [(1, entry_list.entries)]
+    assert entry_list.get_page_filename(1, 3) == 'archive/1.html'
+    assert entry_list.get_page_filename(3, 3) == 'archive.html'
+
+
+def test_feeds_unbounded_by_default(chert_site_path):
+    _add_entries(chert_site_path, 25)
+    Site(str(chert_site_path)).process()
+    rss = (chert_site_path / 'site' / 'rss.xml').read_text()
+    assert rss.count('<item>') == 27
+
+
+def test_bounded_feeds_and_pages(chert_site_path):
+    _add_entries(chert_site_path, 12)
+    _set_config(chert_site_path,
+                feed={'max_entries': 5, 'content': 'truncated',
+                      'truncate_length': 50,
+                      'tags': {'bulk': {'max_entries': 3, 'content': 'summary'}}},
+                archive={'page_size': 4})
+    site = Site(str(chert_site_path))
+    site.process()
+    output_path = chert_site_path / 'site'
+
+    rss = (output_path / 'rss.xml').read_text()
+    assert rss.count('<item>') == 5
+    assert '&lt;p&gt;Lorem ipsum dolor. Lorem ipsum dolor. Lorem ipsum...&lt;/p&gt;' in rss
+    bulk_atom = (output_path / 'tagged' / 'bulk' / 'atom.xml').read_text()
+    assert bulk_atom.count('<entry>') == 3
+
+    assert len(site.entries) == 14  # 12 bulk posts and 2 from the scaffold
+    # pages of 4 from the oldest: 1-4, 5-8, 9-12, and the newest, 13-14
+    assert (output_path / 'archive.html').read_text().count('<h4>') == 2
+    for page_number in (1, 2, 3):
+        page_html = (output_path / 'archive' / ('%s.html' % page_number)).read_text()
+        assert page_html.count('<h4>') == 4
+    assert 'href="/archive/3.html"' in (output_path / 'archive.html').read_text()
+    assert (output_path / 'tagged' / 'bulk' / '2.html').is_file()
+    assert not (output_path / 'tagged' / 'bulk' / '3.html').exists()
@@ -0,0 +1,119 @@
+import os
+import gzip
+
+import pytest
+import yaml
+
+from chert.cli import init
+from chert.core import Site
+from chert.fal import ChertFAL
+from chert.log import chert_log
+from chert.compress import (compress_tree,
+                            get_compressors,
+                            get_encoded_variant)
+
+BIG_HTML = u'<p>%s</p>' % (u'hello compression ' * 200)
+
+
+def _write_tree(root):
+    (root / 'sub').mkdir()
+    (root / 'index.html').write_text(BIG_HTML)
+    (root / 'sub' / 'feed.xml').write_text(BIG_HTML)
+    (root / 'small.html').write_text(u'<p>hi</p>')
+    (root / 'image.png').write_bytes(b'\x89PNG' * 1000)
+
+
+def test_compress_tree(tmp_path):
+    _write_tree(tmp_path)
+    fal = ChertFAL(chert_log)
+    gzip_only = get_compressors(['gzip'])
+    counts = compress_tree(fal, str(tmp_path), gzip_only, workers=2)
+    assert counts == {'compressed_count': 2, 'skipped_count': 0, 'removed_count': 0}
+    gz_path = tmp_path / 'index.html.gz'
+    assert gzip.decompress(gz_path.read_bytes()) == BIG_HTML.encode('utf-8')
+    assert gz_path.stat().st_mtime_ns == (tmp_path / 'index.html').stat().st_mtime_ns
+    assert (tmp_path / 'sub' / 'feed.xml.gz').is_file()
+    assert not (tmp_path / 'small.html.gz').exists()
+    assert not (tmp_path / 'image.png.gz').exists()
+
+    counts = compress_tree(fal, str(tmp_path), gzip_only)
+    assert counts == {'compressed_count': 0, 'skipped_count': 2, 'removed_count': 0}
+
+    # a changed source is recompressed, and one too small loses its variant
+    (tmp_path / 'index.html').write_text(BIG_HTML + u'<p>more</p>')
+    (tmp_path / 'sub' / 'feed.xml').write_text(u'<rss/>')
+    counts = compress_tree(fal, str(tmp_path), gzip_only)
+    assert counts == {'compressed_count': 1, 'skipped_count': 0, 'removed_count': 1}
+    assert gzip.decompress(gz_path.read_bytes()).endswith(b'<p>more</p>')
+    assert not (tmp_path / 'sub' / 'feed.xml.gz').exists()
+
+
+def test_gzip_deterministic():
+    gzip_c = get_compressors(['gzip'])[0]
+    assert gzip_c.compress(b'x' * 2000) == gzip_c.compress(b'x' * 2000)
+
+
+def test_unknown_compressor():
+    with pytest.raises(ValueError):
+        get_compressors(['lzma'])
+
+
+def test_get_encoded_variant(tmp_path):
+    _write_tree(tmp_path)
+    compress_tree(ChertFAL(chert_log), str(tmp_path), get_compressors(['gzip']))
+    path = str(tmp_path / 'index.html')
+    assert get_encoded_variant(path, 'gzip, deflate') == (path + '.gz', 'gzip')
+    assert get_encoded_variant(path, 'deflate, gzip;q=0') == (None, None)
+    assert get_encoded_variant(path, None) == (None, None)
+    assert get_encoded_variant(str(tmp_path / 'small.html'), 'gzip') == (None, None)
+
+    # stale variants aren't served
+    os.utime(path, ns=(0, 0))
+    assert get_encoded_variant(path, 'gzip') == (None, None)
+
+
+def test_export_compressed(tmp_path):
+    site_path = tmp_path / 'site'
+    init(target_dir=str(site_path))
+    config_path = site_path / 'chert.yaml'
+    config = yaml.safe_load(config_path.read_text())
+    config['build'] = {'compress': ['gzip'], 'compress_min_size': 100}
+    config_path.write_text(yaml.safe_dump(config))
+
+    site = Site(str(site_path))
+    site.process()
+    output_path = site_path / 'site'
+    assert (output_path / 'index.html.gz').is_file()
+    assert (output_path / 'atom.xml.gz').is_file()
+    assert not (output_path / 'index.html.gz.gz').exists()
+    gz_mtime = (output_path / 'index.html.gz').stat().st_mtime_ns
+
+    site = Site(str(site_path))
+    site.process()
+    assert (output_path / 'index.html.gz').stat().st_mtime_ns == gz_mtime
+
+
+def test_export_keeps_asset_variants(tmp_path):
+    site_path = tmp_path / 'site'
+    init(target_dir=str(site_path))
+    config_path = site_path / 'chert.yaml'
+    config = yaml.safe_load(config_path.read_text())
+    config['build'] = {'compress': ['gzip'], 'compress_min_size': 100}
+    config_path.write_text(yaml.safe_dump(config))
+
+    Site(str(site_path)).process()
+    css_path = site_path / 'site' / 'css'
+    variant_paths = sorted(css_path.glob('*.gz'))
+    assert variant_paths
+    variant_stats = [(p.stat().st_ino, p.stat().st_mtime_ns) for p in variant_paths]
+
+    site = Site(str(site_path))
+    site.process()
+    assert sorted(css_path.glob('*.gz')) == variant_paths
+    assert [(p.stat().st_ino, p.stat().st_mtime_ns) for p in variant_paths] == variant_stats
+
+    # without compression, the variants go along with other stale files
+    config['build'] = {}
+    config_path.write_text(yaml.safe_dump(config))
+    Site(str(site_path)).process()
+    assert not list(css_path.glob('*.gz'))
@@ -17,6 +17,26 @@ Hello world.
     assert len(entry.parts) >= 1
 
 
+def test_entry_from_path_headers_only(tmp_path):
+    path = tmp_path / 'entry.md'
+    path.write_bytes(b"""---
+title: Lazy Entry
+tags: [a]
+---
+Hello world.
+---
+key: value
+""")
+    entry = Entry.from_path(str(path), headers_only=True)
+    assert entry.title == 'Lazy Entry'
+    assert entry.tags == ['a']
+    assert not entry.is_body_loaded
+    assert 'parts=' not in repr(entry)
+    assert entry.parts == ['Hello world.\n', {'key': 'value'}]
+    assert len(entry.loaded_parts) == 2
+    assert entry.source_text == path.read_bytes()
+
+
 def test_entry_is_draft_no_publish_date():
     raw = b"""---
 title: Draft Entry
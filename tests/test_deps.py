@@ -0,0 +1,31 @@
+from chert.deps import DependencyGraph
+
+
+def test_dep_graph_affected():
+    graph = DependencyGraph()
+    graph.add(('entry', 'a.md'), 'a.md', 'b.md')
+    graph.add(('entry', 'b.md'), 'b.md', 'a.md')
+    graph.add(('list', 'tag'), 'b.md')
+    assert graph.get_affected(['a.md']) == set([('entry', 'a.md'),
+                                                ('entry', 'b.md')])
+    assert ('list', 'tag') in graph.get_affected(['b.md'])
+    assert graph.get_affected(['c.md']) == set()
+
+
+def test_dep_graph_remove():
+    graph = DependencyGraph()
+    graph.add('out', 'in1', 'in2')
+    graph.remove('out')
+    assert 'out' not in graph
+    assert graph.get_affected(['in1']) == set()
+
+
+def test_dep_graph_diff():
+    old, new = DependencyGraph(), DependencyGraph()
+    old.add('same', 'x')
+    new.add('same', 'x')
+    old.add('moved', 'x')
+    new.add('moved', 'y')
+    old.add('removed', 'x')
+    new.add('added', 'x')
+    assert old.diff(new) == set(['moved', 'removed', 'added'])
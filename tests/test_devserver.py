@@ -0,0 +1,217 @@
+import gzip
+import threading
+import http.client
+
+import pytest
+
+from chert.cli import init
+from chert.core import Site
+from chert.compress import get_compressors
+from chert.devserver import (DevServer,
+                             MemoryOutputs,
+                             LiveReloadHub,
+                             LIVE_RELOAD_PATH)
+
+
+def _make_site(path, compressors=None, **kw):
+    init(target_dir=str(path))
+    site = Site(str(path), **kw)
+    site.memory_outputs = MemoryOutputs(site.paths['output_path'],
+                                        compressors=compressors)
+    site.process()
+    return site
+
+
+@pytest.fixture
+def serve_site():
+    servers = []
+
+    def _serve(site, live_reload=None):
+        server = DevServer(('127.0.0.1', 0), outputs=site.memory_outputs,
+                           live_reload=live_reload)
+        server.static_dirs = site._get_static_dirs()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield _serve
+    for server in servers:
+        if server.live_reload is not None:
+            server.live_reload.close()
+        server.shutdown()
+        server.server_close()
+
+
+def _get(port, path, **headers):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', path, headers=headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, body
+
+
+def test_memory_outputs_etag(tmp_path):
+    outputs = MemoryOutputs(str(tmp_path))
+    outputs.write(str(tmp_path / 'a.html'), u'hi')
+    data, etag = outputs.get('a.html')
+    assert data == b'hi'
+    outputs.write(str(tmp_path / 'a.html'), b'hi')
+    assert outputs.get('a.html')[1] == etag
+    outputs.write(str(tmp_path / 'a.html'), u'bye')
+    assert outputs.get('a.html')[1] != etag
+
+
+def test_memory_outputs_stage(tmp_path):
+    outputs = MemoryOutputs(str(tmp_path))
+    with outputs.stage() as staged:
+        staged.write(str(tmp_path / 'a.html'), u'a')
+        staged.write(str(tmp_path / 'sub' / 'b.html'), u'b')
+        assert outputs.get('a.html') is None  # not yet
+    assert outputs.get('a.html')[0] == b'a'
+    assert outputs.has_dir('sub') and not outputs.has_dir('a.html')
+    assert outputs.pop_changed() == set(['a.html', 'sub/b.html'])
+
+    with pytest.raises(ValueError):
+        with outputs.stage() as staged:
+            staged.write(str(tmp_path / 'a.html'), u'A')
+            raise ValueError('failed build')
+    assert outputs.get('a.html')[0] == b'a'
+
+    with outputs.stage(replace=True) as staged:
+        staged.write(str(tmp_path / 'a.html'), u'a')
+    assert outputs.get('sub/b.html') is None
+    assert not outputs.has_dir('sub')
+    assert outputs.pop_changed() == set()
+
+
+def test_export_in_memory(tmp_path):
+    site = _make_site(tmp_path / 'site')
+    assert not (tmp_path / 'site' / 'site').exists()
+    assert site.memory_outputs.get('index.html')
+    assert site.memory_outputs.get('atom.xml')
+
+
+def test_update_deleted_entry_in_memory(tmp_path):
+    site = _make_site(tmp_path / 'site')
+    outputs = site.memory_outputs
+    assert outputs.get('a_new_post.html')
+    outputs.pop_changed()
+    new_post_path = tmp_path / 'site' / 'entries' / 'new_post.md'
+    new_post_path.unlink()
+    site.update([str(new_post_path)])
+    assert outputs.get('a_new_post.html') is None
+    assert outputs.get('tagged/reference/index.html') is None
+    assert outputs.get('tagged/reference/atom.xml') is None
+    assert outputs.get('tagged/meta/index.html')
+    assert 'a_new_post.html' in outputs.pop_changed()
+
+
+def test_serve_from_memory(tmp_path, serve_site):
+    site = _make_site(tmp_path / 'site')
+    port = serve_site(site)
+
+    resp, body = _get(port, '/')
+    assert resp.status == 200
+    assert body == site.memory_outputs.get('index.html')[0]
+    assert resp.getheader('Content-Type') == 'text/html'
+    etag = resp.getheader('ETag')
+    resp, body = _get(port, '/', **{'If-None-Match': etag})
+    assert (resp.status, body) == (304, b'')
+
+    tag = sorted(site.tag_map)[0]
+    resp, _ = _get(port, '/tagged/%s' % tag)
+    assert resp.status == 301
+    assert resp.getheader('Location') == '/tagged/%s/' % tag
+    resp, _ = _get(port, '/tagged/%s/' % tag)
+    assert resp.status == 200
+
+    resp, _ = _get(port, '/nope.html')
+    assert resp.status == 404
+
+    # pages from a build in progress aren't served
+    index_body = site.memory_outputs.get('index.html')[0]
+    with site.memory_outputs.stage() as staged:
+        staged.write(site.paths['output_path'] + '/index.html', u'new')
+        assert _get(port, '/')[1] == index_body
+    assert _get(port, '/')[1] == b'new'
+
+    resp, _ = _get(port, '/../chert.yaml')
+    assert resp.status == 404
+
+
+def test_serve_assets_from_theme(tmp_path, serve_site):
+    site = _make_site(tmp_path / 'site')
+    port = serve_site(site)
+    css_path = tmp_path / 'site' / 'themes' / 'sedimental' / 'css' / 'sedimental.css'
+    resp, body = _get(port, '/css/sedimental.css')
+    assert resp.status == 200
+    assert body == css_path.read_bytes()
+    etag, last_modified = resp.getheader('ETag'), resp.getheader('Last-Modified')
+    assert _get(port, '/css/sedimental.css', **{'If-None-Match': etag})[0].status == 304
+    resp, _ = _get(port, '/css/sedimental.css', **{'If-Modified-Since': last_modified})
+    assert resp.status == 304
+
+    css_path.write_text(u'body {}')
+    resp, body = _get(port, '/css/sedimental.css', **{'If-None-Match': etag})
+    assert (resp.status, body) == (200, b'body {}')
+
+
+def test_serve_compressed(tmp_path, serve_site):
+    site = _make_site(tmp_path / 'site', compressors=get_compressors(['gzip']))
+    port = serve_site(site)
+    resp, body = _get(port, '/index.html', **{'Accept-Encoding': 'gzip'})
+    assert resp.getheader('Content-Encoding') == 'gzip'
+    assert gzip.decompress(body) == site.memory_outputs.get('index.html')[0]
+    resp, body = _get(port, '/index.html')
+    assert resp.getheader('Content-Encoding') is None
+    assert resp.getheader('Vary') == 'Accept-Encoding'
+
+
+def test_serve_two_sites(tmp_path, serve_site):
+    site_a = _make_site(tmp_path / 'a')
+    site_b = _make_site(tmp_path / 'b')
+    site_b.memory_outputs.write(site_b.paths['output_path'] + '/only_b.html', u'b')
+    port_a, port_b = serve_site(site_a), serve_site(site_b)
+    assert _get(port_a, '/only_b.html')[0].status == 404
+    assert _get(port_b, '/only_b.html')[1] == b'b'
+
+
+def test_live_reload_hub():
+    hub = LiveReloadHub()
+    about, index = hub.subscribe('about.html'), hub.subscribe('index.html')
+    assert hub.notify(['about.html']) == 1
+    assert about.get_nowait() == 'reload'
+    assert index.empty()
+    assert hub.notify(reload_all=True) == 2
+    hub.unsubscribe(about)
+    assert len(hub) == 1
+
+
+def test_live_reload_events(tmp_path, serve_site):
+    site = _make_site(tmp_path / 'site', dev_mode=True)
+    page = site.memory_outputs.get('about.html')[0].decode('utf-8')
+    assert '/' + LIVE_RELOAD_PATH in page
+    assert 'http-equiv="refresh"' not in page
+
+    hub = LiveReloadHub()
+    port = serve_site(site, live_reload=hub)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/%s?path=/about.html' % LIVE_RELOAD_PATH)
+    resp = conn.getresponse()
+    assert resp.getheader('Content-Type') == 'text/event-stream'
+    assert resp.fp.readline() == b'retry: 1000\n'
+    assert resp.fp.readline() == b'\n'
+
+    # only the changed page is notified
+    site.memory_outputs.pop_changed()
+    entry_path = tmp_path / 'site' / 'entries' / 'about.md'
+    entry_path.write_text(entry_path.read_text() + u'\n\nMore about.\n')
+    site.update([str(entry_path)])
+    changed, reload_all = site._get_changed_outputs([str(entry_path)])
+    assert 'about.html' in changed and 'index.html' not in changed
+    assert not reload_all
+    assert hub.notify(changed) == 1
+    assert resp.fp.readline() == b'event: reload\n'
+    assert resp.fp.readline() == b'data: about.html\n'
+    conn.close()
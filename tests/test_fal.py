@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+
+import pytest
+
+from chert.fal import ChertFAL, WriterPool
+from chert.log import chert_log
+
+
+def test_write_skips_unchanged(tmp_path):
+    fal = ChertFAL(chert_log)
+    path = str(tmp_path / 'a.html')
+    fal.write(path, u'<p>hi</p>')
+    os.utime(path, (1, 1))
+    fal.write(path, b'<p>hi</p>')
+    assert os.path.getmtime(path) == 1
+    assert fal.get_counts() == {'written_count': 1, 'written_bytes': 9,
+                                'skipped_count': 1, 'skipped_bytes': 9}
+
+    fal.write(path, u'<p>ho</p>')  # same size, different bytes
+    assert os.path.getmtime(path) != 1
+    assert fal.read(path) == b'<p>ho</p>'
+    assert fal.written_count == 2
+
+
+def test_write_always(tmp_path):
+    fal = ChertFAL(chert_log, skip_unchanged=False)
+    path = str(tmp_path / 'a.html')
+    fal.write(path, u'<p>hi</p>')
+    fal.write(path, u'<p>hi</p>')
+    assert (fal.written_count, fal.skipped_count) == (2, 0)
+    fal.reset_counts()
+    fal.write(path, u'<p>hi</p>', skip_unchanged=True)
+    assert (fal.written_count, fal.skipped_count) == (0, 1)
+
+
+def test_write_atomic(tmp_path):
+    fal = ChertFAL(chert_log)
+    path = str(tmp_path / 'a.html')
+    fal.write(path, u'before')
+    os.chmod(path, 0o640)
+    fal.write(path, u'after')
+    assert fal.read(path) == b'after'
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(str(tmp_path)) == ['a.html']
+
+
+class _SlowFAL(ChertFAL):
+    def __init__(self, *a, **kw):
+        super(_SlowFAL, self).__init__(*a, **kw)
+        self.release = threading.Event()
+        self.dir_calls = []
+
+    def makedirs(self, dir_path):
+        self.dir_calls.append(dir_path)
+        super(_SlowFAL, self).makedirs(dir_path)
+
+    def write(self, *a, **kw):
+        self.release.wait(5)
+        return super(_SlowFAL, self).write(*a, **kw)
+
+
+def test_writer_pool(tmp_path):
+    fal = _SlowFAL(chert_log)
+    paths = [str(tmp_path / 'sub' / ('%s.html' % i)) for i in range(10)]
+    with WriterPool(fal, workers=2, max_pending=3) as writer:
+        submitter = threading.Thread(target=lambda: [writer.write(p, p)
+                                                     for p in paths])
+        submitter.start()
+        time.sleep(0.1)
+        assert submitter.is_alive()  # blocked on the pending limit
+        fal.release.set()
+        submitter.join(5)
+    assert fal.written_count == 10
+    assert fal.dir_calls == [str(tmp_path / 'sub')]
+    assert all(fal.read(p) == p.encode('utf-8') for p in paths)
+
+
+def test_writer_pool_errors(tmp_path):
+    fal = ChertFAL(chert_log)
+    (tmp_path / 'dir.html').mkdir()
+    with pytest.raises(OSError):
+        with WriterPool(fal, workers=2) as writer:
+            writer.write(str(tmp_path / 'a.html'), u'a')
+            writer.write(str(tmp_path / 'dir.html'), u'b')
+            writer.write(str(tmp_path / 'c.html'), u'c')
+    assert [p for p, _ in writer.errors] == [str(tmp_path / 'dir.html')]
+    assert fal.written_count == 2
+
+
+def _make_theme_dir(path):
+    (path / 'fonts').mkdir(parents=True)
+    (path / 'style.css').write_text(u'body {}')
+    (path / 'fonts' / 'a.woff').write_bytes(b'font data')
+    return path
+
+
+def test_sync_tree(tmp_path):
+    fal = ChertFAL(chert_log)
+    src, dest = _make_theme_dir(tmp_path / 'src'), tmp_path / 'dest'
+    counts = fal.sync_tree(str(src), str(dest))
+    assert counts['copied_count'] == 2
+    assert (dest / 'fonts' / 'a.woff').read_bytes() == b'font data'
+
+    counts = fal.sync_tree(str(src), str(dest))
+    assert (counts['copied_count'], counts['skipped_count']) == (0, 2)
+
+    (src / 'style.css').write_text(u'body {color: red}')
+    (src / 'fonts' / 'a.woff').unlink()
+    (src / 'fonts').rmdir()
+    (dest / 'extra').mkdir()
+    (dest / 'extra' / 'stale.js').write_text(u'')
+    counts = fal.sync_tree(str(src), str(dest))
+    assert counts['copied_count'] == 1
+    assert counts['removed_count'] == 4
+    assert sorted(os.listdir(str(dest))) == ['style.css']
+    assert (dest / 'style.css').read_text() == u'body {color: red}'
+
+
+def test_sync_tree_check_hash(tmp_path):
+    fal = ChertFAL(chert_log)
+    src, dest = _make_theme_dir(tmp_path / 'src'), tmp_path / 'dest'
+    fal.sync_tree(str(src), str(dest))
+    os.utime(str(dest / 'style.css'), (1, 1))
+    counts = fal.sync_tree(str(src), str(dest), check_hash=True)
+    assert counts['skipped_count'] == 2
+
+    (dest / 'style.css').write_text(u'body ()')  # same size and mtime
+    src_stat = os.stat(str(src / 'style.css'))
+    os.utime(str(dest / 'style.css'), ns=(src_stat.st_atime_ns,
+                                          src_stat.st_mtime_ns))
+    assert fal.sync_tree(str(src), str(dest))['copied_count'] == 0
+    assert fal.sync_tree(str(src), str(dest), check_hash=True)['copied_count'] == 1
+    assert (dest / 'style.css').read_text() == u'body {}'
+
+
+def test_sync_tree_hardlink(tmp_path):
+    fal = ChertFAL(chert_log)
+    src, dest = _make_theme_dir(tmp_path / 'src'), tmp_path / 'dest'
+    counts = fal.sync_tree(str(src), str(dest), hardlink=True)
+    assert counts['linked_count'] == 2
+    assert os.path.samefile(str(src / 'style.css'), str(dest / 'style.css'))
+    counts = fal.sync_tree(str(src), str(dest), hardlink=True)
+    assert counts['skipped_count'] == 2
@@ -0,0 +1,117 @@
+import pytest
+from markdown import Markdown
+from markdown.extensions.codehilite import CodeHiliteExtension
+
+from chert.cache import RenderCache
+from chert.highlight import HighlightCache, get_caching_extension
+
+pytest.importorskip('pygments')
+
+EXTENSIONS = ['markdown.extensions.fenced_code']
+
+FENCED_MD = '''Some code:
+
+```python
+def hello(name):
+    return 'hello, %s' % name
+```
+'''
+
+INDENTED_MD = '''Some code:
+
+    :::python
+    print('indented')
+'''
+
+
+def _convert(text, hilite_ext):
+    return Markdown(extensions=EXTENSIONS + [hilite_ext]).convert(text)
+
+
+@pytest.mark.parametrize('text', [FENCED_MD, INDENTED_MD])
+def test_cached_output_matches(text):
+    for kw in ({}, {'noclasses': True, 'pygments_style': 'emacs'}):
+        cache = HighlightCache()
+        plain_ext = CodeHiliteExtension(**kw)
+        expected = _convert(text, plain_ext)
+        caching_ext = get_caching_extension(plain_ext, cache)
+        assert _convert(text, caching_ext) == expected
+        assert (cache.hit_count, cache.miss_count) == (0, 1)
+        assert _convert(text, caching_ext) == expected
+        assert (cache.hit_count, cache.miss_count) == (1, 1)
+
+
+MIXED_MD = FENCED_MD + '''
+More code:
+
+    :::python
+    print('indented')
+
+``` { .python hl_lines="1" }
+x = 1
+```
+
+``` { .python use_pygments=false }
+y = 2
+```
+'''
+
+
+@pytest.mark.parametrize('inline', [False, True])
+def test_site_converters_hit_cache(tmp_path, inline):
+    from chert.core import Site, MD_EXTENSIONS, INLINE_MD_EXTENSIONS
+    from chert.cli import init
+    init(target_dir=str(tmp_path / 'site'))
+    site = Site(str(tmp_path / 'site'))
+    cache = site.highlight_cache
+    if inline:
+        converter, extensions = site.inline_md_converter, INLINE_MD_EXTENSIONS
+    else:
+        converter, extensions = site.md_converter, MD_EXTENSIONS
+    converter.registerExtensions(['markdown.extensions.attr_list'], {})
+    expected = Markdown(extensions=extensions + ['markdown.extensions.attr_list']).convert(MIXED_MD)
+    assert converter.reset().convert(MIXED_MD) == expected
+    # the fenced, indented, and hl_lines blocks, but not use_pygments=false
+    assert (cache.hit_count, cache.miss_count) == (0, 3)
+    assert converter.reset().convert(MIXED_MD) == expected
+    assert (cache.hit_count, cache.miss_count) == (3, 3)
+
+
+def test_options_in_key():
+    cache = HighlightCache()
+    classes_html = _convert(FENCED_MD, get_caching_extension(CodeHiliteExtension(), cache))
+    inline_html = _convert(FENCED_MD, get_caching_extension(
+        CodeHiliteExtension(noclasses=True), cache))
+    assert classes_html != inline_html
+    assert cache.miss_count == 2
+    assert len(cache) == 2
+
+
+def test_lru_eviction():
+    cache = HighlightCache(max_entries=2)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    assert cache.get('a') == 'A'  # b is now least-recently used
+    cache.put('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert (cache.hit_count, cache.miss_count) == (3, 1)
+
+
+def test_disk_persistence(tmp_path):
+    hilite_ext = CodeHiliteExtension()
+    cache = HighlightCache(disk_cache=RenderCache(str(tmp_path)))
+    expected = _convert(FENCED_MD, get_caching_extension(hilite_ext, cache))
+
+    cache = HighlightCache(disk_cache=RenderCache(str(tmp_path)))
+    assert _convert(FENCED_MD, get_caching_extension(hilite_ext, cache)) == expected
+    assert (cache.hit_count, cache.miss_count) == (1, 0)
+
+
+def test_markdown_not_patched():
+    import chert.core  # noqa: F401, sets up chert's converters
+    from markdown.extensions import codehilite, fenced_code
+    from chert.highlight import CachingCodeHilite
+    assert codehilite.CodeHilite is not CachingCodeHilite
+    assert fenced_code.CodeHilite is codehilite.CodeHilite
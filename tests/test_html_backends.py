@@ -0,0 +1,119 @@
+import pytest
+
+from chert.cli import init
+from chert.core import Site
+from chert.hypertext import (
+    add_toc,
+    get_html_backend,
+    html_text_to_tree,
+    html_tree_to_text,
+    retarget_links,
+)
+
+lxml = pytest.importorskip('lxml')
+
+BACKENDS = ['html5lib', 'lxml']
+
+WELL_FORMED = [
+    '',
+    '<p>plain</p>',
+    '<p>[TOC]</p><h1>One</h1><p>a</p><h2>Two <em>em</em></h2><h3>Three</h3>'
+    '<h2>Four</h2><h1>Five</h1>',
+    '<h3>Skips</h3><h1>levels</h1><h4>around</h4>',
+    '<p>a <a href="https://example.com/">ext</a> <a href="/int">int</a> '
+    '<a href="#frag">frag</a> <a>none</a></p>',
+    '<p title="&quot;q&quot; &amp; &lt;">&lt;escaped&gt; &amp; &#169; ☃</p>',
+    '<div class="codehilite"><pre><span></span><span class="k">def</span> '
+    '<span class="nf">f</span>():\n    <span class="k">pass</span>\n</pre></div>',
+    '<p>img <img src="/a.png" alt="a"> and br<br>tail</p>',
+    '<table><thead><tr><th>h</th></tr></thead>'
+    '<tbody><tr><td>d</td></tr></tbody></table>',
+    '<ul><li>one<ul><li>nested</li></ul></li><li>two</li></ul>',
+    '<!-- comment --><p>after</p>',
+    '<script>if (a < b && c > d) {}</script><p>x</p>',
+    '<pre>\nleading newline</pre>',
+]
+
+MALFORMED = [
+    '<p>unclosed <b>bold <i>both</b> italic</i>',
+    '<p>para<div>block in para</div>',
+    '<ul><li>one<li>two</ul>',
+    '<table><tr><td>cell<p>para</table>',
+    '<h1>header <h2>nested header</h2></h1>',
+    '</p>stray close',
+    '<a href="x"><a href="y">nested anchors</a></a>',
+    '<p>&notanentity; &amp &lt</p>',
+]
+
+
+def _normalize(html_text):
+    """Reparses serialized output with html5lib and flattens it, so
+    that the backends' differing (but equivalent) choices of optional
+    tags and quoting don't count as differences."""
+    ret = []
+    tree = html_text_to_tree(html_text, 'html5lib')
+    for el in tree.iter():
+        if not isinstance(el.tag, str):
+            continue  # comments
+        if el.tag == 'p' and not (len(el) or el.attrib or (el.text or '').strip()):
+            continue  # html5lib makes empty paragraphs of stray </p> tags
+        ret.append((el.tag, sorted(el.attrib.items()),
+                    (el.text or '').strip(), (el.tail or '').strip()))
+    return ret
+
+
+def _get_text(html_text):
+    tree = html_text_to_tree(html_text, 'html5lib')
+    return ''.join(tree.itertext()).split()
+
+
+def _process(html_text, backend):
+    tree = html_text_to_tree(html_text, backend)
+    add_toc(tree)
+    retarget_links(tree)
+    return html_tree_to_text(tree)
+
+
+def test_get_html_backend():
+    assert get_html_backend().name == 'lxml'
+    assert get_html_backend('html5lib').name == 'html5lib'
+    assert get_html_backend('lxml') is get_html_backend('lxml')
+    with pytest.raises(ValueError):
+        get_html_backend('nope')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_tree_backend_detected(backend):
+    tree = html_text_to_tree('<p>x</p>', backend)
+    assert html_tree_to_text(tree) == html_tree_to_text(tree, backend)
+
+
+@pytest.mark.parametrize('html_text', WELL_FORMED)
+def test_well_formed_equivalent(html_text):
+    results = [_process(html_text, backend) for backend in BACKENDS]
+    assert _normalize(results[0]) == _normalize(results[1])
+
+
+@pytest.mark.parametrize('html_text', MALFORMED)
+def test_malformed_text_equivalent(html_text):
+    # libxml2 repairs broken markup differently than the HTML5
+    # algorithm, but no content should be lost either way
+    results = [_process(html_text, backend) for backend in BACKENDS]
+    assert _get_text(results[0]) == _get_text(results[1])
+
+
+def test_scaffold_equivalent(tmp_path):
+    site_path = tmp_path / 'test_site'
+    init(target_dir=str(site_path))
+
+    def _render(backend):
+        site = Site(str(site_path), use_cache=False)
+        site.config['site']['html_backend'] = backend
+        site.load()
+        site.render()
+        return [(e.content_html, e.content_ihtml) for e in site.all_entries]
+
+    results = [_render(backend) for backend in BACKENDS]
+    for html5lib_res, lxml_res in zip(*results):
+        for html5lib_html, lxml_html in zip(html5lib_res, lxml_res):
+            assert _normalize(html5lib_html) == _normalize(lxml_html)
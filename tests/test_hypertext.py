@@ -1,9 +1,22 @@
+import time
+
+import pytest
+
 from chert.hypertext import (
     canonicalize_links,
+    canonicalize_tree_links,
+    inline_code_styles,
+    get_inline_code_style_kw,
     retarget_links,
     html_text_to_tree,
     html_tree_to_text,
     nest_h_tokens,
+    add_toc,
+    DOMPipeline,
+    DOMTransform,
+    LinkRetargeter,
+    LinkCanonicalizer,
+    TOCifier,
 )
 
 
@@ -70,3 +83,140 @@ def test_nest_h_tokens_nested():
     assert len(result) == 1
     assert len(result[0]['children']) == 1
     assert result[0]['children'][0]['id'] == 'b'
+
+
+def test_nest_h_tokens_wrong_order():
+    tokens = [{'level': 3}, {'level': 2}, {'level': 3}, {'level': 1},
+              {'level': 2}]
+    result = nest_h_tokens(tokens)
+    assert [t['level'] for t in result] == [3, 2, 1]
+    assert [t['level'] for t in result[1]['children']] == [3]
+    assert [t['level'] for t in result[2]['children']] == [2]
+
+
+def test_nest_h_tokens_iterator():
+    tokens = ({'level': i % 3 + 1} for i in range(9))
+    result = nest_h_tokens(tokens)
+    assert len(result) == 3
+    assert all(len(t['children']) == 1 for t in result)
+
+
+def test_add_toc_unique_ids():
+    html = ('<h1>Intro</h1><h1>Intro</h1><h1 id="intro_2">Explicit</h1>'
+            '<h1>Intro</h1><h1>Intro_1</h1>')
+    tree = add_toc(html_text_to_tree(html))
+    ids = [el.get('id') for el in tree.iter('h2')]
+    assert ids == ['intro', 'intro_1', 'intro_2', 'intro_3', 'intro_4']
+
+
+def test_add_toc_many_duplicate_headings():
+    # deduplicating ids one suffix at a time would take seconds here
+    heading_count = 5000
+    html = '<p>[TOC]</p>' + '<h1>Intro</h1><p>Text</p>' * heading_count
+    tree = html_text_to_tree(html)
+    start = time.perf_counter()
+    add_toc(tree)
+    assert time.perf_counter() - start < 2.0
+    ids = [el.get('id') for el in tree.iter('h2')]
+    assert len(set(ids)) == heading_count
+    assert ids[-1] == 'intro_%s' % (heading_count - 1)
+
+
+def test_canonicalize_tree_links_matches_text():
+    html = ('<html><body><a href="/about">About</a><a href="#sec">Sec</a>'
+            '<a href="https://other.com/">Other</a><img src="/a.png" />'
+            '</body></html>')
+    tree = html_text_to_tree(html)
+    canonicalize_tree_links(tree, 'https://example.com', 'page.html')
+    from_tree = html_tree_to_text(tree)
+    from_text = html_tree_to_text(html_text_to_tree(
+        canonicalize_links(html, 'https://example.com', 'page.html')))
+    assert from_tree == from_text
+    assert 'https://example.com/page.html#sec' in from_tree
+
+
+def test_inline_code_styles():
+    html = ('<html><body><div class="codehilite"><pre><span></span><code>'
+            '<span class="k">def</span> <span class="nf">f</span>'
+            '<span class="p">():</span></code></pre></div></body></html>')
+    tree = html_text_to_tree(html)
+    inline_code_styles(tree, {'k': 'font-weight: bold', 'nf': 'color: #00A000'},
+                       div_style='background: #f8f8f8',
+                       pre_style='line-height: 125%;')
+    text = html_tree_to_text(tree)
+    assert 'class="k"' not in text
+    assert '<span style="font-weight: bold">def</span>' in text
+    assert '<div class="codehilite" style="background: #f8f8f8">' in text
+    assert '<pre style="line-height: 125%;">' in text
+    # unstyled spans are unwrapped, keeping their text
+    assert '<span style="color: #00A000">f</span>():</code>' in text
+
+
+def test_inline_code_styles_match_pygments():
+    pytest.importorskip('pygments')
+    from markdown import Markdown
+    from markdown.extensions.codehilite import CodeHiliteExtension
+
+    text = '```python\ndef f(x=1, *args):\n    return x + 1  # c\n```\n'
+    exts = ['markdown.extensions.fenced_code']
+    inline_html = Markdown(extensions=exts + [CodeHiliteExtension(
+        noclasses=True, pygments_style='emacs')]).convert(text)
+    class_html = Markdown(extensions=exts + [CodeHiliteExtension(
+        pygments_style='emacs')]).convert(text)
+    tree = html_text_to_tree(class_html)
+    inline_code_styles(tree, **get_inline_code_style_kw('emacs'))
+    expected = html_tree_to_text(html_text_to_tree(inline_html))
+    assert html_tree_to_text(tree) == expected
+    # pygments merges consecutive tokens with the same style
+    assert '<span style="color: #666">=1</span>' in expected
+
+
+def test_get_inline_code_style_kw():
+    style_kw = get_inline_code_style_kw('emacs')
+    assert style_kw['style_map']['k'] == 'color: #A2F; font-weight: bold'
+    assert style_kw['div_style'] == 'background: #f8f8f8'
+
+
+class _TagCounter(DOMTransform):
+    def __init__(self, tags=None):
+        self.tags = tags
+        self.seen = []
+
+    def visit(self, el, parent):
+        self.seen.append(el.tag)
+
+
+def test_pipeline_dispatch():
+    html = '<p>a <a href="/x">x</a> <em>b</em></p><p>c</p>'
+    tree = html_text_to_tree(html)
+    p_counter, all_counter = _TagCounter(tags=('p',)), _TagCounter()
+    DOMPipeline([p_counter, all_counter]).process(tree)
+    assert p_counter.seen == ['p', 'p']
+    assert [t for t in all_counter.seen if t not in ('head', 'body')] == [
+        'html', 'p', 'a', 'em', 'p']
+
+
+def test_pipeline_matches_separate_passes():
+    html = ('<p>[TOC]</p><h1>One</h1><p><a href="https://example.com">ext</a>'
+            ' <a href="/int">int</a></p><h2>Two</h2>')
+    separate = html_text_to_tree(html)
+    add_toc(separate)
+    retarget_links(separate)
+    canonicalize_tree_links(separate, 'https://chert.io', 'page.html')
+
+    combined = html_text_to_tree(html)
+    DOMPipeline([TOCifier(),
+                 LinkRetargeter(),
+                 LinkCanonicalizer('https://chert.io', 'page.html')]).process(combined)
+    assert html_tree_to_text(separate) == html_tree_to_text(combined)
+    # later transforms see the TOC added at the end of the walk
+    assert 'href="https://chert.io/page.html#two"' in html_tree_to_text(combined)
+
+
+def test_pipeline_reusable():
+    pipeline = DOMPipeline([TOCifier()])
+    for _ in range(2):
+        tree = html_text_to_tree('<p>[TOC]</p><h1>One</h1><h1>Two</h1>')
+        text = html_tree_to_text(pipeline.process(tree))
+        assert text.count('class="toc"') == 1
+        assert text.count('<li>') == 2
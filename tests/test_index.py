@@ -0,0 +1,69 @@
+import os
+from datetime import date, datetime
+
+from chert.core import Entry
+from chert.index import EntryIndex, INDEX_FILENAME, dump_headers, load_headers
+
+
+def _write_entry(path, title, publish_date='2020-01-02', tags=('a',)):
+    path.write_text(u'---\ntitle: %s\npublish_date: "%s"\ntags: [%s]\n---\nBody.\n'
+                    % (title, publish_date, ', '.join(tags)))
+    return Entry.from_path(str(path))
+
+
+def test_headers_round_trip():
+    headers = Entry.from_string(b'---\ntitle: T\nupdated: 2020-01-02\n---\nx\n').headers
+    loaded = load_headers(dump_headers(headers))
+    assert loaded == headers
+    assert loaded['updated'] == date(2020, 1, 2)
+
+
+def test_entry_index_current(tmp_path):
+    index = EntryIndex(str(tmp_path / INDEX_FILENAME))
+    path = tmp_path / 'a.md'
+    entry = _write_entry(path, 'A')
+    assert index.get_headers(str(path)) is None
+    index.add(entry)
+    assert index.get_headers(str(path))['title'] == 'A'
+
+    # same content, new mtime
+    os.utime(str(path), (1, 1))
+    assert index.get_headers(str(path))['title'] == 'A'
+
+    _write_entry(path, 'Changed')
+    assert index.get_headers(str(path)) is None
+    assert index.prune([]) == [str(path)]
+    assert len(index) == 0
+
+
+def test_entry_index_queries(tmp_path):
+    index = EntryIndex(':memory:')
+    index.add(_write_entry(tmp_path / 'a.md', 'A', '2020-01-02', ['x', 'y']))
+    index.add(_write_entry(tmp_path / 'b.md', 'B', '2021-01-02', ['x']))
+    index.add(_write_entry(tmp_path / 'c.md', 'C', '2999-01-02', ['x']))
+    assert index.get_tag_counts() == {'x': 2, 'y': 1}
+    assert index.get_tag_counts(published_only=False) == {'x': 3, 'y': 1}
+    assert [e['title'] for e in index.get_entries()] == ['B', 'A']
+    assert [e['title'] for e in index.get_entries(start=datetime(2021, 1, 1))] == ['B']
+    assert [e['title'] for e in index.get_entries(end=datetime(2021, 1, 1))] == ['A']
+    assert [e['title'] for e in index.get_entries(tag='y')] == ['A']
+    assert index.get_entries(tag='y')[0]['tags'] == ['x', 'y']
+
+
+def test_entry_index_rebuilds(tmp_path):
+    index_path = tmp_path / INDEX_FILENAME
+    index = EntryIndex(str(index_path))
+    index.add(_write_entry(tmp_path / 'a.md', 'A'))
+    index.close()
+    index = EntryIndex(str(index_path))
+    assert not index.rebuilt and len(index) == 1
+    index.conn.execute("UPDATE meta SET value = 'old' WHERE key = 'chert_version'")
+    index.conn.commit()
+    index.close()
+    index = EntryIndex(str(index_path))
+    assert index.rebuilt and len(index) == 0
+    index.close()
+
+    index_path.write_bytes(b'not a database' * 100)
+    index = EntryIndex(str(index_path))
+    assert index.rebuilt and len(index) == 0
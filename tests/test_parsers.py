@@ -1,6 +1,11 @@
 import pytest
+import yaml
 from boltons.dictutils import OMD
-from chert.parsers import parse_entry, parse_entry_parts, omd_load
+from chert.parsers import (parse_entry,
+                           parse_entry_parts,
+                           omd_load,
+                           get_ordered_loader,
+                           get_part_type)
 
 
 def test_parse_entry_basic():
@@ -41,3 +46,48 @@ def test_omd_load_preserves_order():
     result = omd_load(stream)
     assert isinstance(result, OMD)
     assert list(result.keys()) == ['a', 'b', 'c']
+
+
+def test_omd_load_safe_by_default():
+    with pytest.raises(yaml.YAMLError):
+        omd_load(b"a: !!python/object/apply:os.getcwd []")
+
+
+def test_omd_load_pure_python_loader():
+    stream = b"z: 1\ny: {b: 2, a: 1}"
+    result = omd_load(stream, Loader=yaml.SafeLoader)
+    assert list(result.keys()) == ['z', 'y']
+    assert list(result['y'].keys()) == ['b', 'a']
+    assert result == omd_load(stream)
+
+
+def test_ordered_loader_cached():
+    assert get_ordered_loader() is get_ordered_loader()
+    assert get_ordered_loader(yaml.SafeLoader) is not get_ordered_loader()
+
+
+def test_get_part_type_prose():
+    assert get_part_type(b'# Heading\n\nSome prose.\nMore prose.\n') == 'text'
+    # ambiguous parts are left to the YAML parser
+    assert get_part_type(b'key: value\nother: value\n') is None
+    assert get_part_type(b'Note: a colon\nin prose\n') is None
+    assert get_part_type(b'- a list\n- of items\n') is None
+    assert get_part_type(b'One line.') is None
+
+
+def test_parse_entry_parts_explicit_markdown():
+    body = b"#<!--{type: markdown}-->\nkey: not data\n"
+    parts = parse_entry_parts({}, body)
+    assert parts == ['key: not data\n']
+
+
+def test_parse_entry_parts_explicit_data():
+    body = b"#<!--{type: data}-->\nkey: value\n"
+    parts = parse_entry_parts({}, body)
+    assert isinstance(parts[0], OMD)
+    assert parts[0]['key'] == 'value'
+
+
+def test_parse_entry_parts_bad_marker():
+    with pytest.raises(ValueError, match='part type'):
+        parse_entry_parts({}, b"#<!--{type: html}-->\n<p>hi</p>\n")
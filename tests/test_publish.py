@@ -0,0 +1,120 @@
+import os
+import sys
+import shlex
+
+import yaml
+
+from chert.cli import init, delete_dir_contents
+from chert.core import Site
+from chert.publish import (build_manifest,
+                           diff_manifests,
+                           LocalDirTarget,
+                           RsyncTarget)
+
+
+def test_manifest_diff(tmp_path):
+    (tmp_path / 'a.html').write_text(u'a')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.html').write_text(u'b')
+    old = build_manifest(str(tmp_path))
+    assert sorted(old['files']) == ['a.html', 'sub/b.html']
+
+    (tmp_path / 'a.html').write_text(u'A')
+    (tmp_path / 'sub' / 'b.html').unlink()
+    (tmp_path / 'c.html').write_text(u'c')
+    new = build_manifest(str(tmp_path), old)
+    assert diff_manifests(old, new) == (['c.html'], ['a.html'], ['sub/b.html'])
+    assert diff_manifests(None, new) == (['a.html', 'c.html'], [], [])
+    assert diff_manifests(new, new) == ([], [], [])
+
+
+def test_manifest_reuses_hashes(tmp_path):
+    (tmp_path / 'a.html').write_text(u'a')
+    old = build_manifest(str(tmp_path))
+    old['files']['a.html']['sha256'] = 'stale'
+    assert build_manifest(str(tmp_path), old)['files']['a.html']['sha256'] == 'stale'
+    os.utime(str(tmp_path / 'a.html'), (1, 1))
+    assert build_manifest(str(tmp_path), old)['files']['a.html']['sha256'] != 'stale'
+
+
+def _set_prod_config(site_path, **kw):
+    config_path = site_path / 'chert.yaml'
+    config = yaml.safe_load(config_path.read_text())
+    config['prod'].update(kw)
+    config_path.write_text(yaml.safe_dump(config))
+
+
+def test_publish_local_dir(tmp_path):
+    site_path, publish_path = tmp_path / 'site', tmp_path / 'public'
+    init(target_dir=str(site_path))
+    _set_prod_config(site_path, publish_target='local',
+                     publish_path=str(publish_path))
+    site = Site(str(site_path))
+    site.process()
+    assert site.publish()
+    assert (publish_path / 'index.html').read_bytes() == \
+        (site_path / 'site' / 'index.html').read_bytes()
+    assert (publish_path / 'css' / 'sedimental.css').is_file()
+
+    css_ino = (publish_path / 'css' / 'sedimental.css').stat().st_ino
+    (site_path / 'entries' / 'new_post.md').unlink()
+    delete_dir_contents(str(site_path / 'site'))
+    site = Site(str(site_path))
+    site.process()
+    assert site.publish()
+    assert not (publish_path / 'a_new_post.html').exists()
+    assert (publish_path / 'about.html').exists()
+    assert (publish_path / 'css' / 'sedimental.css').stat().st_ino == css_ino
+
+
+def test_rsync_files_from(tmp_path):
+    target = RsyncTarget("user@host:'/srv/site'")
+    cmd = target.get_command(str(tmp_path), '/tmp/files.txt', delete=True)
+    assert cmd == ("rsync -avzPk --files-from=/tmp/files.txt --delete-missing-args"
+                   " %s/ user@host:'/srv/site'" % tmp_path)
+
+    # a stand-in for rsync, which records the files it was given
+    script_path, log_path = tmp_path / 'fake_rsync.py', tmp_path / 'log.txt'
+    script_path.write_text(u'import sys\n'
+                           u'files_from = [a for a in sys.argv if a.startswith("--files-from=")]\n'
+                           u'listed = open(files_from[0].split("=", 1)[1]).read()\n'
+                           u'open(%r, "w").write(listed)\n' % str(log_path))
+    rsync_cmd = '%s %s' % (shlex.quote(sys.executable), shlex.quote(str(script_path)))
+    target = RsyncTarget('dest', rsync_cmd=rsync_cmd)
+    target.publish(str(tmp_path), ['a.html', 'b/c.html'], ['old.html'])
+    assert log_path.read_text() == u'a.html\nb/c.html\nold.html\n'
+
+
+def test_local_dir_target_prunes(tmp_path):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    (src / 'tagged' / 'x').mkdir(parents=True)
+    (src / 'tagged' / 'x' / 'index.html').write_text(u'x')
+    target = LocalDirTarget(str(dest))
+    target.publish(str(src), ['tagged/x/index.html'], [])
+    assert (dest / 'tagged' / 'x' / 'index.html').read_text() == u'x'
+    target.publish(str(src), [], ['tagged/x/index.html'])
+    assert os.listdir(str(dest)) == []
+
+
+def test_publish_no_cache(tmp_path):
+    site_path, publish_path = tmp_path / 'site', tmp_path / 'public'
+    init(target_dir=str(site_path))
+    _set_prod_config(site_path, publish_target='local',
+                     publish_path=str(publish_path))
+    site = Site(str(site_path), use_cache=False)
+    site.process()
+    assert site.publish()
+    assert (publish_path / 'index.html').is_file()
+    assert not (site_path / '.chert_cache').exists()
+
+
+def test_publish_os_error(tmp_path):
+    site_path, publish_path = tmp_path / 'site', tmp_path / 'public'
+    publish_path.write_text(u'not a directory')
+    init(target_dir=str(site_path))
+    _set_prod_config(site_path, publish_target='local',
+                     publish_path=str(publish_path))
+    site = Site(str(site_path))
+    site.process()
+    assert site.publish() is False
+    assert not (site_path / '.chert_cache' / 'published').exists()
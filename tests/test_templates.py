@@ -0,0 +1,95 @@
+import os
+
+from ashes import AshesEnv
+
+from chert.cache import RenderCache
+from chert.templates import TemplateCache
+
+
+def _write_theme(path):
+    (path / 'base.html').write_text(u'<p>{+body/}</p>')
+    (path / 'page.html').write_text(u'{>base.html/}{<body}{title}{/body}')
+    (path / 'page.md').write_text(u'# {title}')
+
+
+def test_load_all_matches_ashes(tmp_path):
+    _write_theme(tmp_path)
+    cache = TemplateCache()
+    env = AshesEnv(paths=[str(tmp_path)])
+    tmpls = cache.load_all(env)
+    assert sorted(t.name for t in tmpls) == ['base.html', 'page.html']
+    plain_env = AshesEnv(paths=[str(tmp_path)])
+    plain_env.load_all()
+    model = {'title': 'A & B'}
+    assert env.render('page.html', model) == plain_env.render('page.html', model)
+    assert cache.compile_count == 2
+
+
+def test_recompiles_only_changed(tmp_path):
+    _write_theme(tmp_path)
+    cache = TemplateCache()
+    cache.load_all(AshesEnv(paths=[str(tmp_path)]))
+    cache.reset_stats()
+
+    env = AshesEnv(paths=[str(tmp_path)])
+    cache.load_all(env)
+    assert (cache.hit_count, cache.compile_count) == (2, 0)
+
+    cache.reset_stats()
+    (tmp_path / 'page.html').write_text(u'{>base.html/}{<body}[{title}]{/body}')
+    env = AshesEnv(paths=[str(tmp_path)])
+    cache.load_all(env)
+    assert (cache.hit_count, cache.compile_count) == (1, 1)
+    assert env.render('page.html', {'title': 'x'}) == '<p>[x]</p>'
+    assert len(cache) == 2  # the old page.html was dropped
+
+    # a touched, but unchanged, template isn't recompiled
+    cache.reset_stats()
+    os.utime(str(tmp_path / 'base.html'), (1, 1))
+    cache.load_all(AshesEnv(paths=[str(tmp_path)]))
+    assert (cache.hit_count, cache.compile_count) == (2, 0)
+
+
+def test_env_settings_in_key(tmp_path):
+    _write_theme(tmp_path)
+    cache = TemplateCache()
+    html_env = AshesEnv(paths=[str(tmp_path)], exts=['md'])
+    md_env = AshesEnv(paths=[str(tmp_path)], exts=['md'], keep_whitespace=False)
+    md_env.autoescape_filter = ''
+    cache.load_all(html_env)
+    cache.load_all(md_env)
+    assert cache.compile_count == 2
+    assert html_env.render('page.md', {'title': '<b>'}) == '# &lt;b&gt;'
+    assert md_env.render('page.md', {'title': '<b>'}) == '# <b>'
+
+
+def test_disk_cache(tmp_path):
+    theme_path, cache_path = tmp_path / 'theme', tmp_path / 'cache'
+    theme_path.mkdir()
+    _write_theme(theme_path)
+    cache = TemplateCache(disk_cache=RenderCache(str(cache_path)))
+    cache.load_all(AshesEnv(paths=[str(theme_path)]))
+    assert cache.compile_count == 2
+
+    cache = TemplateCache(disk_cache=RenderCache(str(cache_path)))
+    env = AshesEnv(paths=[str(theme_path)])
+    cache.load_all(env)
+    assert (cache.disk_hit_count, cache.compile_count) == (2, 0)
+    assert env.render('page.html', {'title': 'x'}) == '<p>x</p>'
+
+
+def test_site_reuses_templates(tmp_path):
+    from chert.cli import init
+    from chert.core import Site
+    init(target_dir=str(tmp_path / 'site'))
+    site = Site(str(tmp_path / 'site'))
+    site.process()
+    assert site.template_cache.compile_count > 0
+    site.process()
+    assert site.template_cache.compile_count == 0
+    assert site.template_cache.hit_count
+
+    site = Site(str(tmp_path / 'site'))
+    site.process()
+    assert site.template_cache.compile_count == 0
+    assert not site.template_cache.hit_count  # all from disk
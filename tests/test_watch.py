@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+
+import pytest
+
+from chert.watch import (PollingWatcher,
+                         InotifyWatcher,
+                         is_ignored,
+                         iter_changed_files,
+                         _get_libc,
+                         _IN_Q_OVERFLOW)
+
+_has_inotify = _get_libc() is not None
+
+
+def _make_watcher(kind, path):
+    watch_dirs = [(str(path / 'entries'), ['*.md'])]
+    watch_files = [str(path / 'chert.yaml')]
+    if kind == 'inotify':
+        return InotifyWatcher(watch_dirs, watch_files)
+    return PollingWatcher(watch_dirs, watch_files, interval=0.01)
+
+
+@pytest.fixture(params=['polling',
+                        pytest.param('inotify', marks=pytest.mark.skipif(
+                            not _has_inotify, reason='inotify unavailable'))])
+def watcher(request, tmp_path):
+    (tmp_path / 'entries').mkdir()
+    (tmp_path / 'entries' / 'a.md').write_text('a')
+    ret = _make_watcher(request.param, tmp_path)
+    yield ret
+    ret.close()
+
+
+def test_is_ignored():
+    assert is_ignored('/x/.post.md.swp')
+    assert is_ignored('/x/.#post.md')
+    assert is_ignored('/x/post.md~')
+    assert not is_ignored('/x/post.md')
+
+
+def test_watcher_add_modify_delete(watcher, tmp_path):
+    entries = tmp_path / 'entries'
+    time.sleep(0.02)  # ensure distinct mtimes for the polling watcher
+    (entries / 'b.md').write_text('b')
+    assert str(entries / 'b.md') in watcher.wait(timeout=2)
+
+    (entries / 'a.md').write_text('changed a')
+    assert str(entries / 'a.md') in watcher.wait(timeout=2)
+
+    os.unlink(str(entries / 'a.md'))
+    assert str(entries / 'a.md') in watcher.wait(timeout=2)
+
+
+def test_watcher_ignores_unwatched(watcher, tmp_path):
+    entries = tmp_path / 'entries'
+    (entries / '.a.md.swp').write_text('swap')
+    (entries / 'notes.txt').write_text('txt')
+    assert watcher.wait(timeout=0.2) == set()
+
+
+def test_watcher_watch_files(watcher, tmp_path):
+    (tmp_path / 'chert.yaml').write_text('site: {}')
+    assert str(tmp_path / 'chert.yaml') in watcher.wait(timeout=2)
+
+
+def test_iter_changed_files_debounce(tmp_path):
+    entries = tmp_path / 'entries'
+    entries.mkdir()
+    (entries / 'a.md').write_text('a')
+    changed_iter = iter_changed_files([(str(entries), '*.md')],
+                                      interval=0.01, debounce=0.2)
+    assert next(changed_iter) == [str(entries / 'a.md')]
+
+    def _write_burst():
+        for i in range(5):
+            (entries / ('%s.md' % i)).write_text(str(i))
+            time.sleep(0.02)
+
+    writer = threading.Thread(target=_write_burst)
+    writer.start()
+    changed = next(changed_iter)
+    writer.join()
+    assert changed == sorted([str(entries / ('%s.md' % i)) for i in range(5)])
+    changed_iter.close()
+
+
+@pytest.mark.skipif(not _has_inotify, reason='inotify unavailable')
+def test_inotify_skips_new_sibling_dirs(tmp_path):
+    (tmp_path / 'entries').mkdir()
+    watcher = _make_watcher('inotify', tmp_path)
+    try:
+        watch_count = len(watcher._wd_map)
+        (tmp_path / 'site' / 'tagged').mkdir(parents=True)
+        (tmp_path / 'site' / 'tagged' / 'index.md').write_text('out')
+        assert watcher.wait(timeout=0.2) == set()
+        assert len(watcher._wd_map) == watch_count
+
+        (tmp_path / 'entries' / 'sub').mkdir()
+        (tmp_path / 'entries' / 'sub' / 'c.md').write_text('c')
+        changed = set()
+        for _ in range(5):
+            changed |= watcher.wait(timeout=0.5)
+            if changed:
+                break
+        assert str(tmp_path / 'entries' / 'sub' / 'c.md') in changed
+        assert len(watcher._wd_map) == watch_count + 1
+    finally:
+        watcher.close()
+
+
+def _wait_for(watcher, paths, tries=5):
+    changed = set()
+    for _ in range(tries):
+        changed |= watcher.wait(timeout=0.5)
+        if changed >= paths:
+            break
+    return changed
+
+
+@pytest.mark.skipif(not _has_inotify, reason='inotify unavailable')
+def test_inotify_dir_moved_out(tmp_path):
+    entries = tmp_path / 'entries'
+    (entries / 'sub' / 'deeper').mkdir(parents=True)
+    (entries / 'sub' / 'c.md').write_text('c')
+    (entries / 'sub' / 'deeper' / 'd.md').write_text('d')
+    watcher = _make_watcher('inotify', tmp_path)
+    try:
+        watch_count = len(watcher._wd_map)
+        os.rename(str(entries / 'sub'), str(tmp_path / 'sub'))
+        removed = set([str(entries / 'sub' / 'c.md'),
+                       str(entries / 'sub' / 'deeper' / 'd.md')])
+        assert _wait_for(watcher, removed) == removed
+        assert len(watcher._wd_map) == watch_count - 2
+        assert len(watcher._dir_map) == watch_count - 2
+
+        # no longer watched once outside entries
+        (tmp_path / 'sub' / 'c.md').write_text('changed c')
+        assert watcher.wait(timeout=0.2) == set()
+    finally:
+        watcher.close()
+
+
+@pytest.mark.skipif(not _has_inotify, reason='inotify unavailable')
+def test_inotify_overflow_reports_deleted(tmp_path):
+    entries = tmp_path / 'entries'
+    entries.mkdir()
+    (entries / 'a.md').write_text('a')
+    (entries / 'b.md').write_text('b')
+    watcher = _make_watcher('inotify', tmp_path)
+    try:
+        os.unlink(str(entries / 'a.md'))
+        # as if the deletion's own event had been lost
+        changed = watcher._process_events([(-1, _IN_Q_OVERFLOW, '')])
+        assert changed == set([str(entries / 'a.md'), str(entries / 'b.md')])
+        changed = watcher._process_events([(-1, _IN_Q_OVERFLOW, '')])
+        assert changed == set([str(entries / 'b.md')])
+    finally:
+        watcher.close()